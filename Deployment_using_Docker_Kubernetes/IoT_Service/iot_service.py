@@ -1,21 +1,36 @@
+import os
 import random
 import time
 from datetime import datetime
 import requests
+import http_client
 from flask import Flask
+from reading_buffer import ReadingBuffer, Uploader
 
 app = Flask(__name__)
 
 SERVER_SERVICE_ADDRESS = "http://127.0.0.1:5000/status"
 DATA_SERVICE_ADDRESS = "http://127.0.0.1:5001/sensor_data"
 DEFAULT_TARGET_TEMPERATURE = 20.0
+# Last status received and its ETag; an unchanged status comes back as an empty 304
+last_status = {"etag": None, "target_temperature": DEFAULT_TARGET_TEMPERATURE}
+# Readings are kept until the data service has them: at most IOT_BUFFER_SIZE,
+# spooled to IOT_SPOOL_FILE if set, and uploaded IOT_UPLOAD_BATCH per request
+IOT_BUFFER_SIZE = int(os.getenv("IOT_BUFFER_SIZE", "10000"))
+IOT_SPOOL_FILE = os.getenv("IOT_SPOOL_FILE")
+IOT_UPLOAD_BATCH = int(os.getenv("IOT_UPLOAD_BATCH", "500"))
 
 def get_status():
     try:
-        response = requests.get(SERVER_SERVICE_ADDRESS)
+        headers = {"If-None-Match": last_status["etag"]} if last_status["etag"] else {}
+        response = http_client.get(SERVER_SERVICE_ADDRESS, headers=headers)
+        if response.status_code == 304:
+            return last_status["target_temperature"]
         data = response.json()
         key = list(data.keys())[0]
         target_temperature = float(data[key])
+        last_status["etag"] = response.headers.get("ETag")
+        last_status["target_temperature"] = target_temperature
         return target_temperature
     except requests.exceptions.RequestException as e:
         print(f"Could not connect to {SERVER_SERVICE_ADDRESS}: {e}")
@@ -33,15 +48,26 @@ def gen_sensor_data(target_temperature, current_temperature):
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     return timestamp, current_temperature
 
+def patch_sensor_data(readings):
+    # Readings are {timestamp: temperature} dicts; the data service keys history by timestamp,
+    # so a batch that is sent twice is stored once
+    batch = {}
+    for reading in readings:
+        batch.update(reading)
+    response = http_client.patch(DATA_SERVICE_ADDRESS, json=batch)
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()
+
+sensor_buffer = ReadingBuffer(IOT_BUFFER_SIZE, IOT_SPOOL_FILE)
+uploader = Uploader(sensor_buffer, patch_sensor_data, IOT_UPLOAD_BATCH)
+
 def send_sensor_data(sensor_data):
-    try:
-        response = requests.patch(DATA_SERVICE_ADDRESS, json=sensor_data)
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Could not connect to {DATA_SERVICE_ADDRESS}: {e}")
-    except Exception as e:
-        print(f"Failed to send sensor data: {e}")
-    return {"Status":"Failed", "Message":"Data not sent"}
+    sensor_buffer.add(sensor_data)
+    sent = uploader.flush()
+    if uploader.failures:
+        print(f"Could not send sensor data to {DATA_SERVICE_ADDRESS}: {uploader.last_error}")
+        return {"Status":"Failed", "Message":f"Data not sent, {len(sensor_buffer)} readings buffered"}
+    return {"Status":"Success", "Sent":sent, "Buffered":len(sensor_buffer)}
 
 @app.route('/sensor')
 def get_sensor_data():
@@ -0,0 +1,241 @@
+import bisect
+import math
+import threading
+import time
+
+# Prometheus metrics for the services, served as text at /metrics.
+# Counters and histograms are sharded per thread: every thread updates its
+# own dict without taking a lock, and a scrape adds the shards up. Only a
+# thread's first update takes a lock, to register its shard, so recording on
+# the request and ingest paths costs a dict update.
+# The threaded development server starts a thread per request, so the
+# shards of threads that have exited are folded into one retired total from
+# time to time.
+# Values that are cheap to read when scraped (store size, cache counts) are
+# registered as functions instead of being updated as they change.
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+_FOLD_EVERY = 256  # New shards between folds of the shards of exited threads
+
+
+class Registry:
+    """
+    The metrics of one process. counter() and histogram() return metrics to
+    update; collect() registers a function read at every scrape.
+    render() returns all of them in the Prometheus text format.
+    Registering a counter or histogram again with the same definition
+    returns the same metric; any other reuse of a name raises ValueError.
+    """
+
+    def __init__(self):
+        self._metrics = {}  # name -> (help, type, labelnames, buckets or function)
+        self._local = threading.local()
+        self._shards = []   # (thread, shard): shard maps (name, labels) -> value
+        self._retired = {}
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _register(self, name, help, kind, labelnames, extra):
+        definition = (help, kind, tuple(labelnames), extra)
+        with self._lock:
+            existing = self._metrics.get(name)
+            if existing is not None:
+                if existing == definition and not callable(extra):
+                    return
+                raise ValueError(f"Metric {name!r} is already registered")
+            self._metrics[name] = definition
+
+    def counter(self, name, help, labelnames=()):
+        self._register(name, help, "counter", labelnames, None)
+        return Counter(self, name)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        buckets = tuple(sorted(buckets))
+        self._register(name, help, "histogram", labelnames, buckets)
+        return Histogram(self, name, buckets)
+
+    def collect(self, name, help, function, kind="gauge", labelnames=()):
+        """
+        Registers `function()`, returning the value, or with `labelnames` a
+        dict of {label values tuple: value}; `kind` is "gauge" or "counter".
+        """
+        self._register(name, help, kind, labelnames, function)
+
+    def _shard(self):
+        # Registers the calling thread's shard; metrics call this on a thread's first update only
+        shard = self._local.shard = {}
+        with self._lock:
+            self._shards.append((threading.current_thread(), shard))
+            self._created += 1
+            if self._created % _FOLD_EVERY == 0:
+                self._fold()
+        return shard
+
+    def _fold(self):
+        # Called with the lock held. An exited thread's shard never changes again.
+        alive = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _merge(self._retired, shard)
+        self._shards = alive
+
+    def _totals(self):
+        with self._lock:
+            self._fold()
+            totals = {}
+            _merge(totals, self._retired)
+            shards = [shard for _, shard in self._shards]
+        for shard in shards:
+            _merge(totals, shard.copy())  # copy() is atomic, so the owner can keep writing
+        return totals
+
+    def render(self):
+        totals = self._totals()
+        by_name = {}
+        for (name, labels), value in totals.items():
+            by_name.setdefault(name, []).append((labels, value))
+        with self._lock:
+            metrics = list(self._metrics.items())
+
+        lines = []
+        for name, (help, kind, labelnames, extra) in metrics:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for labels, entry in sorted(by_name.get(name, ())):
+                    count = 0
+                    for bound, bucket in zip(extra + (math.inf,), entry):
+                        count += bucket
+                        le = "+Inf" if bound == math.inf else repr(bound)
+                        lines.append(f"{name}_bucket{_labels(labelnames + ('le',), labels + (le,))} {count}")
+                    lines.append(f"{name}_sum{_labels(labelnames, labels)} {_number(entry[-1])}")
+                    lines.append(f"{name}_count{_labels(labelnames, labels)} {count}")
+            elif extra is not None:
+                value = extra()
+                samples = value.items() if isinstance(value, dict) else [((), value)]
+                for labels, sample in sorted(samples):
+                    lines.append(f"{name}{_labels(labelnames, labels)} {_number(sample)}")
+            else:
+                for labels, value in sorted(by_name.get(name, ())):
+                    lines.append(f"{name}{_labels(labelnames, labels)} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class Counter:
+    __slots__ = ("_registry", "_local", "_name")
+
+    def __init__(self, registry, name):
+        self._registry = registry
+        self._local = registry._local
+        self._name = name
+
+    def inc(self, amount=1, labels=()):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._registry._shard()
+        key = (self._name, labels)
+        shard[key] = shard.get(key, 0) + amount
+
+
+class Histogram:
+    __slots__ = ("_registry", "_local", "_name", "_buckets")
+
+    def __init__(self, registry, name, buckets):
+        self._registry = registry
+        self._local = registry._local
+        self._name = name
+        self._buckets = buckets
+
+    def observe(self, value, labels=()):
+        try:
+            shard = self._local.shard
+        except AttributeError:
+            shard = self._registry._shard()
+        key = (self._name, labels)
+        entry = shard.get(key)
+        if entry is None:
+            # One count per bucket (plus +Inf), then the sum
+            entry = shard[key] = [0] * (len(self._buckets) + 1) + [0.0]
+        entry[bisect.bisect_left(self._buckets, value)] += 1
+        entry[-1] += value
+
+    def time(self, labels=()):
+        """Returns a context manager that observes the seconds spent in its block."""
+        return _Timer(self, labels)
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_labels", "_started")
+
+    def __init__(self, histogram, labels):
+        self._histogram = histogram
+        self._labels = labels
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._started, self._labels)
+
+
+def _merge(totals, shard):
+    for key, value in shard.items():
+        if isinstance(value, list):
+            total = totals.get(key)
+            totals[key] = list(value) if total is None else [a + b for a, b in zip(total, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _number(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        return "NaN" if math.isnan(value) else ("+Inf" if value > 0 else "-Inf")
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+# The registry of this process, shared by the app and http_client
+REGISTRY = Registry()
+
+
+def instrument_app(app, registry=REGISTRY, path="/metrics"):
+    """
+    Counts the requests of Flask `app` by method, route and status, records
+    their latency (up to the response headers, for streamed responses) and
+    serves `registry` at `path`.
+    """
+    from flask import Response, g, request
+
+    requests_total = registry.counter("http_requests_total", "HTTP requests handled.",
+                                      ("method", "route", "status"))
+    duration = registry.histogram("http_request_duration_seconds", "Time to handle an HTTP request.",
+                                  ("method", "route"))
+
+    @app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        started = g.get("request_started")
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        requests_total.inc(labels=(request.method, route, str(response.status_code)))
+        if started is not None:
+            duration.observe(time.perf_counter() - started, (request.method, route))
+        return response
+
+    def serve_metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
+
+    app.add_url_rule(path, "metrics", serve_metrics)
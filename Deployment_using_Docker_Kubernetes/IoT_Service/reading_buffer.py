@@ -0,0 +1,146 @@
+import collections
+import itertools
+import json
+import os
+import random
+import threading
+import time
+
+# Store-and-forward for device readings.
+# Readings are queued with the time they were taken, so an outage of the
+# Data Service delays them instead of losing them. The queue is bounded (when
+# it is full the oldest reading is dropped) and can be spooled to a file so it
+# also survives a restart of the device.
+# An Uploader drains the queue oldest first in batches of at most
+# `batch_size`, with one batch in flight at a time, and removes a batch only
+# once it was delivered. After a failure it waits a random delay of up to an
+# exponentially growing backoff, so devices recovering from the same outage
+# spread their retries out instead of all arriving at once.
+# A batch can be delivered more than once (when a response is lost, or after
+# a restart from the spool); the services discard readings they already
+# have, keyed by device and timestamp.
+
+DEFAULT_CAPACITY = 10_000
+DEFAULT_BATCH_SIZE = 500
+_MIN_COMPACT_LINES = 1000
+
+
+class ReadingBuffer:
+    """
+    Bounded FIFO of JSON-serializable readings waiting to be uploaded,
+    appended to the spool file `path` (if given) as JSON lines.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, path=None):
+        self.capacity = capacity
+        self.path = path
+        self.dropped = 0
+        self._readings = collections.deque()
+        self._file = None
+        self._spooled = 0  # Lines in the spool file, including readings already removed from the queue
+        self._lock = threading.Lock()
+        if path is not None:
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        self._readings.append(json.loads(line))
+                    except ValueError:
+                        continue  # A line cut short by a crash
+        except FileNotFoundError:
+            pass
+        while len(self._readings) > self.capacity:
+            self._readings.popleft()
+            self.dropped += 1
+        self._rewrite()
+
+    def _rewrite(self):
+        # Replaces the spool file with the readings still queued
+        if self._file is not None:
+            self._file.close()
+        temporary = self.path + ".tmp"
+        with open(temporary, "w") as f:
+            f.writelines(json.dumps(reading) + "\n" for reading in self._readings)
+        os.replace(temporary, self.path)
+        self._file = open(self.path, "a")
+        self._spooled = len(self._readings)
+
+    def __len__(self):
+        return len(self._readings)
+
+    def add(self, reading):
+        with self._lock:
+            if len(self._readings) >= self.capacity:
+                self._readings.popleft()
+                self.dropped += 1
+            self._readings.append(reading)
+            if self._file is not None:
+                self._file.write(json.dumps(reading) + "\n")
+                self._file.flush()
+                self._spooled += 1
+                if self._spooled > max(2 * self.capacity, _MIN_COMPACT_LINES):
+                    self._rewrite()
+
+    def peek(self, count):
+        """Returns up to `count` of the oldest readings without removing them."""
+        with self._lock:
+            return list(itertools.islice(self._readings, count))
+
+    def remove(self, count):
+        """Removes the `count` oldest readings, once they have been delivered."""
+        with self._lock:
+            for _ in range(min(count, len(self._readings))):
+                self._readings.popleft()
+            # Delivered readings stay in the spool file until it is compacted; resending them is harmless
+            if self._file is not None and (not self._readings or self._spooled > max(2 * len(self._readings),
+                                                                                       _MIN_COMPACT_LINES)):
+                self._rewrite()
+
+
+class Uploader:
+    """
+    Drains `buffer` through `send(readings)`, which delivers a list of
+    readings and raises if they should be sent again later. A batch that
+    `send` returns from normally is removed, even if the service rejected
+    some of its readings.
+    """
+
+    def __init__(self, buffer, send, batch_size=DEFAULT_BATCH_SIZE, max_batches=10, backoff=1.0, max_backoff=60.0):
+        self.buffer = buffer
+        self.send = send
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.failures = 0
+        self.last_error = None
+        self._retry_at = 0.0
+
+    def flush(self):
+        """
+        Sends up to `max_batches` batches, stopping at the first failure.
+        Returns how many readings were delivered; while backing off after a
+        failure it sends nothing and returns 0.
+        """
+        if time.monotonic() < self._retry_at:
+            return 0
+        delivered = 0
+        for _ in range(self.max_batches):
+            batch = self.buffer.peek(self.batch_size)
+            if not batch:
+                break
+            try:
+                self.send(batch)
+            except Exception as e:
+                self.failures += 1
+                self.last_error = e
+                delay = min(self.max_backoff, self.backoff * 2 ** (self.failures - 1))
+                self._retry_at = time.monotonic() + random.uniform(0, delay)
+                break
+            self.failures = 0
+            self.buffer.remove(len(batch))
+            delivered += len(batch)
+        return delivered
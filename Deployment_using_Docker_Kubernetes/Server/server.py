@@ -1,10 +1,18 @@
 import os
-from flask import Flask, request, jsonify
+import threading
+from flask import Flask, Response, request, jsonify
 import requests
+import http_client
+from metrics import instrument_app
 
 app = Flask(__name__)
+instrument_app(app)  # Request counts and latencies, served at GET /metrics
 
 TARGET_TEMPERATURE = 20.0
+# Bumped on every change of the target and sent as the ETag of /status
+STATUS_VERSION = 1
+STATUS_MAX_WAIT_SECONDS = 30.0
+status_changed = threading.Condition()
 #DATA_SERVICE_ADDRESS = "http://127.0.0.1:5001/history"
 DATA_SERVICE_ADDRESS = os.getenv("DATA_SERVICE_ADDRESS", "http://data-service-service:80/history")
 
@@ -26,7 +34,7 @@ def get_index_page():
 def get_sensor_log():
     try:
         number_or_items = 10
-        response = requests.get(DATA_SERVICE_ADDRESS, params={"number_of_items": number_or_items})
+        response = http_client.get(DATA_SERVICE_ADDRESS, params={"number_of_items": number_or_items})
         data = response.json()
         return jsonify({"Status":"Success", "data":data})
     except requests.exceptions.RequestException as e:
@@ -35,17 +43,34 @@ def get_sensor_log():
 
 @app.route('/status')
 def send_status():
-    return jsonify({"target_value":TARGET_TEMPERATURE})
+    """
+    Returns the target temperature, with its version as the ETag. A request
+    whose If-None-Match matches gets an empty 304, after waiting up to 'wait'
+    seconds for the target to change (this needs a threaded worker).
+    """
+    with status_changed:
+        if request.if_none_match:
+            wait = request.args.get('wait', 0.0, type=float)
+            wait = min(max(wait, 0.0), STATUS_MAX_WAIT_SECONDS) if wait == wait else 0.0
+            status_changed.wait_for(lambda: not request.if_none_match.contains(str(STATUS_VERSION)), wait)
+        etag, target = str(STATUS_VERSION), TARGET_TEMPERATURE
+    response = Response(status=304) if request.if_none_match.contains(etag) else jsonify({"target_value": target})
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
 
 @app.route('/target_temperature', methods=['PATCH'])
 def get_target_temperature():
-    global TARGET_TEMPERATURE
+    global TARGET_TEMPERATURE, STATUS_VERSION
     value = request.get_json()
     if value is None:
         return jsonify({"Status":"Error!"})
     else:
         key = list(value.keys())[0]
-        TARGET_TEMPERATURE = float(value[key])
+        with status_changed:
+            TARGET_TEMPERATURE = float(value[key])
+            STATUS_VERSION += 1
+            status_changed.notify_all()
     return jsonify({"Status":"Success"})
 
 if __name__ == '__main__':
@@ -1,7 +1,54 @@
+import atexit
+import calendar
+import os
+import struct
+import threading
+import time
+from datetime import datetime
 from flask import Flask, request, jsonify
+from metrics import REGISTRY, instrument_app
+from segment_log import SegmentLog
 
 history = {}
 app = Flask(__name__)
+instrument_app(app)  # Request counts and latencies, served at GET /metrics
+
+# Timestamp format used as the key of every sensor reading
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+# Directory for the durable segment log. Without it the history lives only in memory.
+DATA_DIR = os.getenv("DATA_DIR")
+DATA_FSYNC_EVERY = int(os.getenv("DATA_FSYNC_EVERY", "100"))
+DATA_FSYNC_INTERVAL = float(os.getenv("DATA_FSYNC_INTERVAL", "1.0"))
+# On-disk record layout: timestamp in epoch nanoseconds, temperature
+LOG_RECORD_FORMAT = '<qd'
+
+sensor_log = None
+log_lock = threading.Lock()
+
+def to_nanoseconds(key):
+    return calendar.timegm(time.strptime(key, TIMESTAMP_FORMAT)) * 1_000_000_000
+
+def from_nanoseconds(timestamp_ns):
+    return datetime.utcfromtimestamp(timestamp_ns // 1_000_000_000).strftime(TIMESTAMP_FORMAT)
+
+def sync_periodically():
+    while True:
+        time.sleep(DATA_FSYNC_INTERVAL)
+        with log_lock:
+            sensor_log.sync()
+
+if DATA_DIR:
+    sensor_log = SegmentLog(DATA_DIR, LOG_RECORD_FORMAT, fsync_every=DATA_FSYNC_EVERY, fsync_interval=DATA_FSYNC_INTERVAL)
+    for timestamp_ns, value in sensor_log.read(0, len(sensor_log)):
+        history[from_nanoseconds(timestamp_ns)] = value
+    print(f"Loaded {len(sensor_log)} sensor readings from {DATA_DIR}")
+    threading.Thread(target=sync_periodically, daemon=True).start()
+    atexit.register(sensor_log.close)
+
+readings_ingested = REGISTRY.counter("readings_ingested_total", "Readings stored.")
+REGISTRY.collect("store_readings", "Readings held in memory.", lambda: len(history))
+REGISTRY.collect("store_log_bytes", "Bytes of readings in the segment log.",
+                 lambda: len(sensor_log) * struct.calcsize(LOG_RECORD_FORMAT) if sensor_log is not None else 0)
 
 @app.route('/sensor_data', methods=['PATCH'])
 def get_sensor_data():
@@ -10,8 +57,20 @@ def get_sensor_data():
         return jsonify({"Status":"Error!"})
     else:
         keys = value.keys()
+        records = []
         for key in keys:
+            if key in history and history[key] == value[key]:
+                continue  # Resent by a device after an outage; already stored
             history[key] = value[key]
+            readings_ingested.inc()
+            if sensor_log is not None:
+                try:
+                    records.append((to_nanoseconds(key), float(value[key])))
+                except (TypeError, ValueError):
+                    print(f"Not persisting reading with unrecognised timestamp {key!r}")
+        if records:
+            with log_lock:
+                sensor_log.append_many(records)
     return jsonify({"Status":"Success"})
 
 @app.route('/history', methods=['GET'])
@@ -23,4 +82,3 @@ def get_history():
 
 if __name__ == '__main__':
     app.run(debug=True, host="127.0.0.1", port=5001)
-
@@ -0,0 +1,194 @@
+import os
+import random
+import threading
+import time
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+from metrics import REGISTRY
+
+# Shared HTTP client for calls between services.
+# Each target (scheme://host:port) gets its own pooled keep-alive session, so
+# repeated calls reuse TCP connections instead of opening one per request.
+# Every call has connect and read timeouts, failed calls are retried with
+# jittered exponential backoff, and a circuit breaker stops calling a target
+# that keeps failing until it has had time to recover.
+# get()/post()/patch() are drop-in replacements for the `requests` functions.
+# Every attempt's latency and every failure are recorded per target in the
+# process's metrics.
+
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2.0"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5.0"))
+HTTP_RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+# The circuit opens after this many consecutive failures and stays open this many seconds.
+HTTP_BREAKER_FAILURES = int(os.getenv("HTTP_BREAKER_FAILURES", "5"))
+HTTP_BREAKER_RESET = float(os.getenv("HTTP_BREAKER_RESET", "10.0"))
+
+BACKOFF_BASE_SECONDS = 0.1
+BACKOFF_MAX_SECONDS = 2.0
+
+# Only these methods are retried after the request may have reached the server
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+RETRY_STATUSES = frozenset((502, 503, 504))
+
+UPSTREAM_DURATION = REGISTRY.histogram("upstream_request_duration_seconds",
+                                       "Time of each attempt at a call to another service.", ("target",))
+UPSTREAM_ERRORS = REGISTRY.counter("upstream_errors_total",
+                                   "Failed attempts at calls to other services, by reason.", ("target", "reason"))
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without calling the target while its circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of one target. Once `failure_threshold` is
+    reached the circuit opens and calls fail fast for `reset_timeout` seconds;
+    after that a single trial call is let through, and its outcome closes or
+    re-opens the circuit.
+    """
+
+    def __init__(self, failure_threshold=HTTP_BREAKER_FAILURES, reset_timeout=HTTP_BREAKER_RESET):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "open" if time.monotonic() - self._opened_at < self.reset_timeout else "half-open"
+
+    def allow(self):
+        """Returns True if a call may be made now."""
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() - self._opened_at < self.reset_timeout or self._trial_running:
+                return False
+            self._trial_running = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_running or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._trial_running = False
+
+
+def _never_sent(error):
+    # True if the request failed before reaching the server (the connection could not be opened)
+    if isinstance(error, requests.exceptions.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], "reason", None) if error.args else None
+    return isinstance(reason, NewConnectionError)
+
+
+class ServiceClient:
+    """
+    A pooled session to one target with timeouts, retries and a circuit breaker.
+    request() takes the same arguments as `requests.request` and returns the
+    final response; it raises a `requests` exception (CircuitOpenError when
+    the circuit is open) if no response could be obtained.
+    """
+
+    def __init__(self, connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=HTTP_READ_TIMEOUT,
+                 retries=HTTP_RETRIES, pool_size=HTTP_POOL_SIZE, breaker=None, name="upstream"):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                UPSTREAM_ERRORS.inc(labels=(self.name, "circuit_open"))
+                raise CircuitOpenError(f"Circuit open for {url}")
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                UPSTREAM_DURATION.observe(time.perf_counter() - started, (self.name,))
+                UPSTREAM_ERRORS.inc(labels=(self.name, "timeout" if isinstance(e, requests.exceptions.Timeout)
+                                            else "connection"))
+                self.breaker.record_failure()
+                # Non-idempotent calls are only retried if they never reached the server
+                if attempt >= self.retries or (method not in IDEMPOTENT_METHODS and not _never_sent(e)):
+                    raise
+            except requests.exceptions.RequestException:
+                # Anything else (bad redirects, a broken response body, an invalid URL) is not retried,
+                # but still counts, so that a half-open breaker's trial call is always settled
+                UPSTREAM_DURATION.observe(time.perf_counter() - started, (self.name,))
+                UPSTREAM_ERRORS.inc(labels=(self.name, "error"))
+                self.breaker.record_failure()
+                raise
+            else:
+                UPSTREAM_DURATION.observe(time.perf_counter() - started, (self.name,))
+                if response.status_code >= 500:
+                    UPSTREAM_ERRORS.inc(labels=(self.name, "status_5xx"))
+                    self.breaker.record_failure()
+                else:
+                    self.breaker.record_success()
+                if attempt >= self.retries or response.status_code not in RETRY_STATUSES \
+                        or method not in IDEMPOTENT_METHODS:
+                    return response
+            time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)))
+            attempt += 1
+
+
+_clients = {}  # (scheme, host, port) -> ServiceClient
+_clients_lock = threading.Lock()
+_DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def client_for(url):
+    """Returns the shared ServiceClient of the target `url` points at."""
+    parts = urlsplit(url)
+    scheme, host = parts.scheme.lower(), parts.hostname or ""
+    port = parts.port or _DEFAULT_PORTS.get(scheme)
+    # Spellings of the same target (case, explicit default port, credentials) share one client
+    origin = (scheme, host, port)
+    client = _clients.get(origin)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(origin)
+            if client is None:
+                client = _clients[origin] = ServiceClient(name=f"{host}:{port}")
+    return client
+
+
+def request(method, url, **kwargs):
+    return client_for(url).request(method, url, **kwargs)
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def patch(url, **kwargs):
+    return request("PATCH", url, **kwargs)
@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import uvicorn
+except ImportError:  # Only needed to serve in ASGI mode
+    uvicorn = None
+
+# Serves a Flask app over ASGI so one event loop can hold thousands of
+# concurrent connections instead of a thread per connection.
+# Requests are dispatched to the app's own routes, so URLs, status codes and
+# JSON bodies are exactly those of the Flask app:
+# - Views registered with coroutine() are awaited, so they can wait for
+#   upstream services without holding up other requests. They may return a
+#   response whose body is an async iterator, e.g. a long-lived event stream.
+# - Every other view runs on a thread pool, as does the iteration of a
+#   streamed response body, so a slow export or an fsync only takes a thread
+#   and the event loop keeps serving other connections meanwhile.
+
+DEFAULT_MAX_BODY_BYTES = 64 * 1024 * 1024
+DEFAULT_MAX_THREADS = 32  # Sync views running at once; more wait for a free thread
+
+
+def _environ(scope, body):
+    # Builds the WSGI environ of an ASGI HTTP request
+    server_name, server_port = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server_name,
+        "SERVER_PORT": str(server_port),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+        "asgi.scope": scope,  # Lets hooks tell requests served from the event loop apart
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if name == "CONTENT_TYPE":
+            environ["CONTENT_TYPE"] = value
+        elif name != "CONTENT_LENGTH":
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsgiAdapter:
+    """
+    ASGI application dispatching to the routes of `flask_app`.
+    coroutine(endpoint) registers a coroutine function to handle a Flask
+    endpoint in place of its view; it runs inside the request context, so it
+    can use `request` and `jsonify` like the view it replaces. Other views run
+    on a pool of `max_threads` threads.
+    """
+
+    def __init__(self, flask_app, max_body_bytes=DEFAULT_MAX_BODY_BYTES, max_threads=DEFAULT_MAX_THREADS):
+        self.flask_app = flask_app
+        self.max_body_bytes = max_body_bytes
+        self._coroutines = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix="asgi-view")
+
+    def coroutine(self, endpoint):
+        """Decorator registering the coroutine function that serves `endpoint`."""
+        def register(handler):
+            self._coroutines[endpoint] = handler
+            return handler
+        return register
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+        if scope["type"] != "http":
+            return
+
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body += message.get("body", b"")
+            if len(body) > self.max_body_bytes:
+                await self._send_plain(send, 413, b"Request body too large")
+                return
+            if not message.get("more_body"):
+                break
+
+        await self._serve(_environ(scope, bytes(body)), receive, send)
+
+    async def _serve(self, environ, receive, send):
+        app = self.flask_app
+        ctx = app.request_context(environ)
+        ctx.push()
+        # The pool's threads run in a copy of this context, so sync code sees
+        # the request; it is one copy per request, so a streamed body that
+        # pushes a context of its own also pops it there
+        context = contextvars.copy_context()
+
+        async def in_thread(func, *args):
+            return await asyncio.get_running_loop().run_in_executor(self._executor, context.run, func, *args)
+
+        try:
+            rule = ctx.request.url_rule
+            handler = self._coroutines.get(rule.endpoint) if rule is not None else None
+            try:
+                if handler is None:
+                    response = await in_thread(app.full_dispatch_request)
+                else:
+                    try:
+                        rv = app.preprocess_request()
+                        if rv is None:
+                            rv = await handler(**ctx.request.view_args)
+                    except Exception as e:
+                        rv = app.handle_user_exception(e)
+                    response = app.finalize_request(rv)
+            except Exception as e:
+                response = app.handle_exception(e)
+            await self._send_response(receive, send, response, in_thread)
+        finally:
+            ctx.pop()
+
+    async def _send_response(self, receive, send, response, in_thread):
+        headers = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                   for name, value in response.headers.items()]
+        await send({"type": "http.response.start", "status": response.status_code, "headers": headers})
+        if hasattr(response.response, "__aiter__"):
+            await self._send_async_body(receive, send, response.response)
+            return
+        try:
+            if not response.is_streamed:
+                await send({"type": "http.response.body", "body": response.get_data()})
+                return
+            # Streamed responses are produced on the pool and sent chunk by chunk
+            chunks = response.iter_encoded()
+            while (chunk := await in_thread(next, chunks, None)) is not None:
+                if chunk:
+                    await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            response.close()
+
+    @staticmethod
+    async def _send_async_body(receive, send, body):
+        # Streams until the body ends or the client goes away
+        async def disconnected():
+            while (await receive())["type"] != "http.disconnect":
+                pass
+
+        watcher = asyncio.ensure_future(disconnected())
+        try:
+            async for chunk in body:
+                if watcher.done():
+                    break
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            watcher.cancel()
+            await body.aclose()
+
+    @staticmethod
+    async def _send_plain(send, status, body):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"text/plain"), (b"content-length", str(len(body)).encode())]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def serve(asgi_app, host, port, fd=None):
+    """
+    Runs `asgi_app` with uvicorn, on the already bound socket `fd` if given.
+    Raises RuntimeError if uvicorn is not installed.
+    """
+    if uvicorn is None:
+        raise RuntimeError("ASGI mode needs uvicorn: pip install uvicorn")
+    uvicorn.run(asgi_app, host=host, port=port, fd=fd)
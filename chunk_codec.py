@@ -0,0 +1,166 @@
+import struct
+
+# Gorilla-style compression for sealed chunks of readings.
+# Sensors report at near-fixed intervals and temperatures change slowly, so
+# timestamps are stored as delta-of-deltas and values as the XOR with the
+# previous value, both in variable-length bit fields.
+
+# Delta-of-delta buckets: (control bits, control bit count, value bit count).
+# The last bucket stores the full 64-bit delta-of-delta.
+_TIME_BUCKETS = (
+    (0b10, 2, 7),
+    (0b110, 3, 9),
+    (0b1110, 4, 12),
+    (0b11110, 5, 20),
+)
+_TIME_ESCAPE = (0b11111, 5, 64)
+
+_MASK64 = (1 << 64) - 1
+
+
+def _float_bits(value):
+    return struct.unpack('<Q', struct.pack('<d', value))[0]
+
+
+def _bits_float(bits):
+    return struct.unpack('<d', struct.pack('<Q', bits))[0]
+
+
+class _BitWriter:
+    def __init__(self):
+        self._buffer = bytearray()
+        self._acc = 0
+        self._bits = 0
+
+    def write(self, value, bits):
+        self._acc = (self._acc << bits) | (value & ((1 << bits) - 1))
+        self._bits += bits
+        while self._bits >= 8:
+            self._bits -= 8
+            self._buffer.append((self._acc >> self._bits) & 0xFF)
+        self._acc &= (1 << self._bits) - 1
+
+    def getvalue(self):
+        if self._bits:
+            return bytes(self._buffer) + bytes([(self._acc << (8 - self._bits)) & 0xFF])
+        return bytes(self._buffer)
+
+
+class _BitReader:
+    def __init__(self, data):
+        self._data = data
+        self._pos = 0
+        self._acc = 0
+        self._bits = 0
+
+    def read(self, bits):
+        while self._bits < bits:
+            self._acc = (self._acc << 8) | self._data[self._pos]
+            self._pos += 1
+            self._bits += 8
+        self._bits -= bits
+        value = self._acc >> self._bits
+        self._acc &= (1 << self._bits) - 1
+        return value
+
+    def read_bit(self):
+        return self.read(1)
+
+
+def _signed(value, bits):
+    return value - (1 << bits) if value >= 1 << (bits - 1) else value
+
+
+def encode_chunk(timestamps, values):
+    """
+    Compresses parallel sequences of integer timestamps (strictly increasing)
+    and float values into bytes. The caller keeps the number of readings.
+    """
+    writer = _BitWriter()
+    if not timestamps:
+        return b''
+    writer.write(timestamps[0] & _MASK64, 64)
+    previous_bits = _float_bits(values[0])
+    writer.write(previous_bits, 64)
+    previous_time = timestamps[0]
+    previous_delta = 0
+    leading, trailing = 65, 0  # No XOR window yet
+
+    for i in range(1, len(timestamps)):
+        delta = timestamps[i] - previous_time
+        dod = delta - previous_delta
+        previous_time, previous_delta = timestamps[i], delta
+        if dod == 0:
+            writer.write(0, 1)
+        else:
+            for control, control_bits, bits in _TIME_BUCKETS:
+                if -(1 << (bits - 1)) < dod <= 1 << (bits - 1):
+                    writer.write(control, control_bits)
+                    writer.write(dod - 1 if dod > 0 else dod, bits)
+                    break
+            else:
+                control, control_bits, bits = _TIME_ESCAPE
+                writer.write(control, control_bits)
+                writer.write(dod & _MASK64, bits)
+
+        value_bits = _float_bits(values[i])
+        xor = value_bits ^ previous_bits
+        previous_bits = value_bits
+        if xor == 0:
+            writer.write(0, 1)
+            continue
+        writer.write(1, 1)
+        xor_leading = min(64 - xor.bit_length(), 63)
+        xor_trailing = (xor & -xor).bit_length() - 1
+        if xor_leading >= leading and xor_trailing >= trailing:
+            # Fits in the previous meaningful-bit window
+            writer.write(0, 1)
+            writer.write(xor >> trailing, 64 - leading - trailing)
+        else:
+            leading, trailing = xor_leading, xor_trailing
+            significant = 64 - leading - trailing
+            writer.write(1, 1)
+            writer.write(leading, 6)
+            writer.write(significant - 1, 6)
+            writer.write(xor >> trailing, significant)
+    return writer.getvalue()
+
+
+def decode_chunk(data, count):
+    """Decompresses `count` readings from encode_chunk() output into (timestamps, values) lists."""
+    if not count:
+        return [], []
+    reader = _BitReader(data)
+    previous_time = _signed(reader.read(64), 64)
+    previous_bits = reader.read(64)
+    timestamps = [previous_time]
+    values = [_bits_float(previous_bits)]
+    previous_delta = 0
+    leading, trailing = 0, 0
+
+    for _ in range(count - 1):
+        if reader.read_bit() == 0:
+            dod = 0
+        else:
+            for control_bits in range(2, 6):
+                if control_bits == 5 or reader.read_bit() == 0:
+                    break
+            if control_bits == 5 and reader.read_bit() == 1:
+                dod = _signed(reader.read(64), 64)
+            else:
+                bits = _TIME_BUCKETS[control_bits - 2][2]
+                dod = _signed(reader.read(bits), bits)
+                if dod >= 0:
+                    dod += 1
+        previous_delta += dod
+        previous_time += previous_delta
+        timestamps.append(previous_time)
+
+        if reader.read_bit() == 1:
+            if reader.read_bit() == 1:
+                leading = reader.read(6)
+                significant = reader.read(6) + 1
+                trailing = 64 - leading - significant
+            previous_bits ^= reader.read(64 - leading - trailing) << trailing
+        values.append(_bits_float(previous_bits))
+    return timestamps, values
@@ -1,47 +1,281 @@
+import asyncio
+import math
+import os
+import threading
+import time
 import requests
-from flask import Flask, jsonify, request
+import http_client
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+from asgi_support import AsgiAdapter, serve
+from controller import ZoneController, run_periodically
+from schedules import ScheduleBook, parse_time
+from state_versions import VersionTracker
+from latest_cache import LatestCache
+from metrics import REGISTRY, instrument_app
+from reading_store import parse_timestamp
+from service_profiling import install_profiling
 
 # This service manages the system's state, including the target temperature (setpoint).
 # It communicates with the Data Service to get the most recent temperature reading.
 
 app = Flask(__name__)
 CORS(app)
+instrument_app(app)  # Request counts and latencies, served at GET /metrics
+install_profiling(app, "Control Service")  # Only with PROFILING_ENABLED=1
 
-# URL for the Data Service
-DATA_SERVICE_URL = "http://127.0.0.1:5001/data"
+# URL of the Data Service's constant-time "latest reading" endpoint
+DATA_SERVICE_LATEST_URL = "http://127.0.0.1:5001/data/latest"
+# The Data Service pushes new readings to CONTROL_NOTIFY_URL once subscribed here.
+DATA_SERVICE_SUBSCRIPTIONS_URL = "http://127.0.0.1:5001/subscriptions"
+# Setpoint changes are announced to dashboards through the Data Service's live stream.
+DATA_SERVICE_EVENTS_URL = "http://127.0.0.1:5001/events"
+CONTROL_NOTIFY_URL = os.getenv("CONTROL_NOTIFY_URL", "http://127.0.0.1:5002/notifications/readings")
+SUBSCRIPTION_LEASE_SECONDS = 60
+
+# Cached readings are re-fetched once they are older than CONTROL_CACHE_TTL seconds
+# without a push; each fetch gives up after CONTROL_FETCH_TIMEOUT seconds.
+CONTROL_CACHE_TTL = float(os.getenv("CONTROL_CACHE_TTL", "5.0"))
+CONTROL_FETCH_TIMEOUT = float(os.getenv("CONTROL_FETCH_TIMEOUT", "2.0"))
+# At most CONTROL_CACHE_DEVICES devices are cached (readings and state versions);
+# the least recently used are dropped.
+CONTROL_CACHE_DEVICES = int(os.getenv("CONTROL_CACHE_DEVICES", "10000"))
+
+# Every zone (one per device) is controlled once per CONTROL_TICK_SECONDS; zones
+# without a reading for CONTROL_READING_TIMEOUT seconds are idled.
+CONTROL_TICK_SECONDS = float(os.getenv("CONTROL_TICK_SECONDS", "1.0"))
+CONTROL_READING_TIMEOUT = float(os.getenv("CONTROL_READING_TIMEOUT", "60.0"))
+
+# Setpoint schedules are written in local time, SCHEDULE_UTC_OFFSET_MINUTES ahead of UTC.
+SCHEDULE_UTC_OFFSET_MINUTES = int(os.getenv("SCHEDULE_UTC_OFFSET_MINUTES", "0"))
+
+# Long polls of /state (?wait=) block for at most STATE_MAX_WAIT_SECONDS, and
+# re-check every STATE_RECHECK_SECONDS since schedules move targets without an event.
+STATE_MAX_WAIT_SECONDS = 30.0
+STATE_RECHECK_SECONDS = 1.0
+
+# "flask" runs the threaded development server; "asgi" serves the same routes
+# from an event loop with uvicorn (see asgi_support.py).
+SERVING_MODE = os.getenv("SERVING_MODE", "flask")
 
 # In-memory state for the target temperature. Default is 21°C.
 system_state = {
     "target_temperature": 21.0
 }
 
-@app.route('/state', methods=['GET'])
-def get_state():
+def fetch_latest_reading(device_id):
     """
-    Returns the complete current state of the system, including
-    the latest temperature and the target temperature.
+    Fetches the newest reading of a device (or of any device for None) from
+    the Data Service. Returns None if there is none; raises if it is unreachable.
     """
-    latest_temp = None
+    params = {"device_id": device_id} if device_id else {}
     try:
-        # Fetch all data from the data service
-        response = requests.get(DATA_SERVICE_URL)
+        # Fetch only the newest reading; its cost does not depend on the history size
+        response = http_client.get(DATA_SERVICE_LATEST_URL, params=params, timeout=CONTROL_FETCH_TIMEOUT)
+        if response.status_code == 404:  # No data yet
+            return None
         response.raise_for_status()  # Raise an exception for bad status codes
-        all_data = response.json()
-        # The latest temperature is the first item if the list is not empty
-        if all_data:
-            latest_temp = all_data[0].get('temperature')
+        return response.json()
     except requests.exceptions.RequestException as e:
         print(f"Control Service: Could not connect to Data Service: {e}")
-    except (ValueError, IndexError):
-        print("Control Service: Could not parse data or no data available.")
-        
-    # Combine the latest known temperature with the target temperature
-    full_state = {
-        "current_temperature": latest_temp,
-        "target_temperature": system_state["target_temperature"]
+        raise
+    except ValueError:
+        print("Control Service: Could not parse data from the Data Service.")
+        raise
+
+# Newest reading per device, pushed by the Data Service and re-fetched when stale.
+# Versions of the state served by /state; bumped whenever a device's state changes
+state_versions = VersionTracker(max_keys=CONTROL_CACHE_DEVICES)
+
+latest_readings = LatestCache(fetch_latest_reading, ttl=CONTROL_CACHE_TTL, on_update=state_versions.changed,
+                              wait_timeout=CONTROL_FETCH_TIMEOUT, max_entries=CONTROL_CACHE_DEVICES)
+REGISTRY.collect("latest_cache_lookups_total", "Lookups of the latest-reading cache, by how they were answered.",
+                 lambda: {("hit",): latest_readings.hits, ("miss",): latest_readings.misses,
+                          ("coalesced",): latest_readings.coalesced},
+                 kind="counter", labelnames=("result",))
+
+def keep_subscribed():
+    """Keeps this service's webhook subscribed to new readings, renewing the lease well before it runs out."""
+    while True:
+        try:
+            response = http_client.post(DATA_SERVICE_SUBSCRIPTIONS_URL, timeout=CONTROL_FETCH_TIMEOUT,
+                                     json={"url": CONTROL_NOTIFY_URL, "lease": SUBSCRIPTION_LEASE_SECONDS})
+            response.raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Control Service: Could not subscribe to Data Service: {e}")
+        time.sleep(SUBSCRIPTION_LEASE_SECONDS / 3)
+
+def is_valid_reading(record):
+    """
+    True if a pushed record looks like a Data Service reading: a device id, a
+    finite numeric temperature and a parseable timestamp.
+    """
+    if not isinstance(record, dict):
+        return False
+    device_id, temperature = record.get('device_id'), record.get('temperature')
+    if not isinstance(device_id, str) or not device_id:
+        return False
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, float)) \
+            or not math.isfinite(temperature):
+        return False
+    try:
+        parse_timestamp(record.get('timestamp'))
+    except (TypeError, ValueError):
+        return False
+    return True
+
+@app.route('/notifications/readings', methods=['POST'])
+def receive_readings():
+    """
+    Webhook called by the Data Service with the newest reading of each
+    device that changed ("readings") and the newest reading overall ("latest").
+    Records that are not valid readings are skipped and counted in "skipped".
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request must be a JSON object"}), 400
+    readings = data.get('readings') or []
+    if not isinstance(readings, list):
+        return jsonify({"error": "'readings' must be a list"}), 400
+    skipped = 0
+    for record in readings:
+        if not is_valid_reading(record):
+            skipped += 1
+            continue
+        latest_readings.put(record['device_id'], record)
+        zone_controller.update_temperature(record['device_id'], float(record['temperature']))
+    latest = data.get('latest')
+    if latest is not None:
+        if is_valid_reading(latest):
+            latest_readings.put(None, latest)
+        else:
+            skipped += 1
+    if skipped:
+        print(f"Control Service: Skipped {skipped} invalid pushed readings")
+    return jsonify({"message": "OK", "skipped": skipped})
+
+# Started on import, so the webhook is subscribed however the app is served
+# (app.run(), uvicorn or a WSGI server)
+threading.Thread(target=keep_subscribed, daemon=True).start()
+
+# Weekly/daily setpoint schedules and override windows per zone
+schedule_book = ScheduleBook(utc_offset=SCHEDULE_UTC_OFFSET_MINUTES * 60)
+
+def scheduled_targets(zone_ids):
+    """Returns every zone's target now: its schedule's, or the system target if it has none."""
+    return schedule_book.targets(zone_ids, time.time(), default=system_state["target_temperature"])
+
+def current_target(zone_id):
+    """Returns (target, source) of one zone now; source is "override", "schedule" or "default"."""
+    target, source = schedule_book.target(zone_id, time.time()) if zone_id else (None, None)
+    if target is None:
+        return system_state["target_temperature"], "default"
+    return target, source
+
+# Per-zone PID / hysteresis controllers, fed by the pushed readings and ticked at a fixed rate
+zone_controller = ZoneController(reading_timeout=CONTROL_READING_TIMEOUT)
+threading.Thread(target=run_periodically, daemon=True,
+                 args=(zone_controller, CONTROL_TICK_SECONDS, scheduled_targets)).start()
+REGISTRY.collect("controller_zones", "Zones under control.", lambda: len(zone_controller))
+REGISTRY.collect("controller_tick_seconds", "Duration of the last controller tick.",
+                 lambda: zone_controller.last_tick_seconds)
+
+@app.route('/state', methods=['GET'])
+def get_state():
+    """
+    Returns the complete current state of the system, including
+    the latest temperature and the target temperature.
+    An optional 'device_id' query parameter selects the sensor; by default
+    the newest reading of any sensor is used.
+    The reading comes from memory. If the Data Service cannot be reached, the
+    last known reading is returned with 'stale' set, and 'reading_age_seconds'
+    tells how long ago the Data Service last confirmed it.
+    The state carries a 'version' that is also its ETag: a request with a
+    matching If-None-Match gets an empty 304, and with 'wait' (seconds) it
+    first waits for the state to change.
+    """
+    device_id = request.args.get('device_id') or None
+    deadline = time.monotonic() + requested_wait()
+    while True:
+        changes = state_versions.changes()
+        state = versioned_state(device_id, *latest_readings.get(device_id))
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not request.if_none_match.contains(str(state["version"])):
+            return state_response(state)
+        state_versions.wait(changes, min(remaining, STATE_RECHECK_SECONDS))
+
+def requested_wait():
+    """Returns how long a conditional /state request may wait for a change, in seconds."""
+    if not request.if_none_match:
+        return 0.0
+    wait = request.args.get('wait', 0.0, type=float)
+    return min(max(wait, 0.0), STATE_MAX_WAIT_SECONDS) if wait == wait else 0.0  # NaN: no wait
+
+def versioned_state(device_id, record, age, stale):
+    """build_state() plus the version of everything in it but the reading's age."""
+    state = build_state(device_id, record, age, stale)
+    snapshot = (state["current_temperature"], state["target_temperature"], state["reading_timestamp"], stale)
+    state["version"] = state_versions.version(device_id, snapshot)
+    return state
+
+def state_response(state):
+    """Returns the state, or an empty 304 if the client already has this version."""
+    etag = str(state["version"])
+    response = Response(status=304) if request.if_none_match.contains(etag) else jsonify(state)
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+def build_state(device_id, record, age, stale):
+    """Combines the latest known reading with the target temperature (the device's scheduled one, if any)."""
+    return {
+        "current_temperature": record.get('temperature') if record else None,
+        "target_temperature": current_target(device_id)[0],
+        "reading_timestamp": record.get('timestamp') if record else None,
+        "reading_age_seconds": round(age, 3) if age is not None else None,
+        "stale": stale
     }
-    return jsonify(full_state)
+
+# ASGI entry point, e.g. `uvicorn control_service:asgi_app --port 5002`
+asgi_app = AsgiAdapter(app)
+
+async def fetch_latest_reading_async(device_id):
+    # The blocking fetch runs on the loop's thread pool; the cache lets at most
+    # one run per device at a time, so this needs a thread per miss, not per request.
+    return await asyncio.get_running_loop().run_in_executor(None, fetch_latest_reading, device_id)
+
+@asgi_app.coroutine('get_state')
+async def get_state_async():
+    """Serves GET /state in ASGI mode without blocking the event loop on a cache miss."""
+    device_id = request.args.get('device_id') or None
+    deadline = time.monotonic() + requested_wait()
+    while True:
+        changes = state_versions.changes()
+        state = versioned_state(device_id, *await latest_readings.get_async(device_id, fetch_latest_reading_async))
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or not request.if_none_match.contains(str(state["version"])):
+            return state_response(state)
+        await state_versions.wait_async(changes, min(remaining, STATE_RECHECK_SECONDS))
+
+# Set whenever the setpoint changes; announce_setpoints() forwards the newest value
+setpoint_changed = threading.Event()
+
+def announce_setpoints():
+    """
+    Publishes setpoint changes to the Data Service's live stream. Runs on its
+    own thread so /setpoint never waits for it; changes made while a
+    publish is in flight are folded into the next one.
+    """
+    while True:
+        setpoint_changed.wait()
+        setpoint_changed.clear()
+        event = {"event": "setpoint", "data": {"target_temperature": system_state["target_temperature"]}}
+        try:
+            http_client.post(DATA_SERVICE_EVENTS_URL, json=event, timeout=CONTROL_FETCH_TIMEOUT).raise_for_status()
+        except requests.exceptions.RequestException as e:
+            print(f"Control Service: Could not announce setpoint: {e}")
+
+threading.Thread(target=announce_setpoints, daemon=True).start()
 
 @app.route('/setpoint', methods=['POST'])
 def set_target_temperature():
@@ -58,16 +292,119 @@ def set_target_temperature():
         return jsonify({"error": "Missing 'temperature' in request"}), 400
 
     try:
-        system_state["target_temperature"] = float(new_temp)
+        new_temp = float(new_temp)
+        if not math.isfinite(new_temp):
+            raise ValueError(f"Invalid temperature {new_temp!r}")
+        system_state["target_temperature"] = new_temp
         print(f"Control Service: New target temperature set to {system_state['target_temperature']}°C")
+        setpoint_changed.set()
+        state_versions.changed()
         return jsonify({
             "message": "Target temperature updated",
             "new_target": system_state["target_temperature"]
         })
-    except ValueError:
+    except (TypeError, ValueError):
         return jsonify({"error": "Invalid temperature format"}), 400
 
+@app.route('/commands', methods=['GET'])
+def get_commands():
+    """
+    Returns the heating/cooling commands of the zones given by repeated
+    'zone_id' query parameters, or of every zone. Each command has an
+    'output' in [-1, 1] (positive heats), an 'action' and the zone's target.
+    """
+    zone_ids = request.args.getlist('zone_id') or None
+    return jsonify({"commands": zone_controller.commands(zone_ids), "tick": zone_controller.ticks})
+
+@app.route('/zones/<zone_id>', methods=['GET', 'PUT'])
+def handle_zone(zone_id):
+    """
+    GET: Returns a zone's controller settings, latest reading and command.
+    PUT: Updates any of "mode" ("pid" or "hysteresis"), "setpoint" (null to
+    follow the system target), "kp", "ki", "kd" and "band".
+    """
+    if request.method == 'PUT':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({"error": "Request must be a JSON object"}), 400
+        settings = {}
+        try:
+            for name in ('setpoint', 'kp', 'ki', 'kd', 'band'):
+                if name in data:
+                    value = data[name]
+                    if name == 'setpoint' and value is None:
+                        settings[name] = float('nan')  # Follow the system target again
+                        continue
+                    settings[name] = float(value)
+                    if not math.isfinite(settings[name]):
+                        raise ValueError(f"Invalid {name} {value!r}")
+            zone_controller.configure(zone_id, mode=data.get('mode'), **settings)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid zone settings: {e}"}), 400
+    zone = zone_controller.zone(zone_id)
+    if zone is None:
+        return jsonify({"error": "Unknown zone"}), 404
+    return jsonify(zone)
+
+@app.route('/zones/<zone_id>/schedule', methods=['GET', 'PUT', 'DELETE'])
+def handle_zone_schedule(zone_id):
+    """
+    GET: Returns a zone's schedule.
+    PUT: Replaces it with {"weekly": [...], "overrides": [...]}. Weekly entries
+    are {"time": "HH:MM", "setpoint": x, "days": ["mon", ...]} and apply every
+    day without "days"; overrides are {"start": t, "end": t, "setpoint": x}
+    with ISO-8601 or epoch-second times, the last listed winning on overlap.
+    DELETE: Removes it, so the zone follows the system target again.
+    """
+    if request.method == 'PUT':
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('weekly', []), list) \
+                or not isinstance(data.get('overrides', []), list):
+            return jsonify({"error": "Request must be a JSON object with 'weekly' and 'overrides' lists"}), 400
+        try:
+            schedule_book.set(zone_id, data.get('weekly', []), data.get('overrides', []))
+        except (AttributeError, TypeError, ValueError) as e:
+            return jsonify({"error": f"Invalid schedule: {e}"}), 400
+        state_versions.changed()
+    elif request.method == 'DELETE':
+        if not schedule_book.remove(zone_id):
+            return jsonify({"error": "No schedule for this zone"}), 404
+        state_versions.changed()
+        return jsonify({"message": "Schedule removed"})
+    schedule = schedule_book.get(zone_id)
+    if schedule is None:
+        return jsonify({"error": "No schedule for this zone"}), 404
+    return jsonify(schedule)
+
+@app.route('/targets', methods=['GET'])
+def get_targets():
+    """
+    Returns the target temperature at time 'at' (ISO-8601 or epoch seconds,
+    default now) of the zones given by repeated 'zone_id' query parameters,
+    or of every known zone, in one vectorized lookup.
+    """
+    try:
+        at = parse_time(request.args['at']) if 'at' in request.args else time.time()
+    except ValueError:
+        return jsonify({"error": "Invalid 'at' time"}), 400
+    zone_ids = request.args.getlist('zone_id') or list(dict.fromkeys(zone_controller.zones() + schedule_book.zones()))
+    targets = schedule_book.targets(zone_ids, at, default=system_state["target_temperature"])
+    return jsonify({"targets": dict(zip(zone_ids, targets.tolist()))})
+
+@app.route('/controller', methods=['GET'])
+def get_controller_status():
+    """Returns the number of zones, the tick rate and the duration of the last tick."""
+    return jsonify({
+        "zones": len(zone_controller),
+        "tick_seconds": CONTROL_TICK_SECONDS,
+        "ticks": zone_controller.ticks,
+        "last_tick_ms": round(zone_controller.last_tick_seconds * 1000, 3)
+    })
+
 if __name__ == '__main__':
     # This service runs on port 5002
-    app.run(host='0.0.0.0', port=5002, debug=True)
+    if SERVING_MODE == "asgi":
+        serve(asgi_app, host='0.0.0.0', port=5002)
+    else:
+        app.run(host='0.0.0.0', port=5002, debug=True)
 
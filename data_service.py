@@ -1,50 +1,638 @@
-import datetime
-from flask import Flask, jsonify, request
+import atexit
+import base64
+import itertools
+import json
+import math
+import os
+import re
+import threading
+import time
+from flask import Flask, Response, jsonify, request
 from flask_cors import CORS
+from asgi_support import AsgiAdapter, serve
+from live_stream import LiveHub
+from metrics import REGISTRY, instrument_app
+from service_profiling import install_profiling
+from notifications import DEFAULT_LEASE_SECONDS, MAX_LEASE_SECONDS, WebhookNotifier
+from reading_store import DEFAULT_DEVICE_ID, LOG_RECORD_FORMAT, PartitionedStore, format_timestamp, parse_timestamp
+from rollups import RESOLUTIONS, RollupStore
+from segment_log import SegmentLog
+from shm_store import SharedStore
+from workers import WORKER_INDEX, listen_fd, run_workers, serve_worker
 
 # This service is the single source of truth for historical temperature data.
 # In a real-world application, this would be connected to a time-series database.
 
 app = Flask(__name__)
-CORS(app)  # Enable Cross-Origin Resource Sharing
+CORS(app, expose_headers=["X-Next-Cursor"])  # Enable Cross-Origin Resource Sharing
+instrument_app(app)  # Request counts and latencies, served at GET /metrics
+install_profiling(app, "Data Service")  # Only with PROFILING_ENABLED=1
 
-# Use a simple in-memory list to store data for this example.
-temperature_data_store = []
+# "flask" runs the threaded development server; "asgi" serves the same routes
+# from an event loop with uvicorn (see asgi_support.py).
+SERVING_MODE = os.getenv("SERVING_MODE", "flask")
+
+# Maximum number of readings kept in memory per device; the oldest ones are evicted first.
+DATA_STORE_CAPACITY = int(os.getenv("DATA_STORE_CAPACITY", "1000000"))
+# Maximum number of devices the registry accepts.
+DATA_MAX_DEVICES = int(os.getenv("DATA_MAX_DEVICES", "10000"))
+# In-memory temperature precision: 'f' (float32, 12 bytes per reading) or 'd' (float64, 16 bytes)
+DATA_VALUE_TYPECODE = os.getenv("DATA_VALUE_TYPECODE", "f")
+# Readings leaving the in-memory ring are compressed DATA_CHUNK_SIZE at a time;
+# up to DATA_COLD_BYTES of compressed history is kept per device (0 disables it).
+DATA_CHUNK_SIZE = int(os.getenv("DATA_CHUNK_SIZE", "1024"))
+DATA_COLD_BYTES = int(os.getenv("DATA_COLD_BYTES", str(16 * 1024 * 1024)))
+
+# Directory for the durable segment logs, one subdirectory per device.
+# Without it readings live only in memory.
+DATA_DIR = os.getenv("DATA_DIR")
+# The log is fsync'ed once this many readings are pending or this many seconds have passed.
+DATA_FSYNC_EVERY = int(os.getenv("DATA_FSYNC_EVERY", "1000"))
+DATA_FSYNC_INTERVAL = float(os.getenv("DATA_FSYNC_INTERVAL", "1.0"))
+DATA_SEGMENT_RECORDS = int(os.getenv("DATA_SEGMENT_RECORDS", "1048576"))
+
+# With DATA_WORKERS > 1 the API is served by that many processes, which share
+# one reading store of the newest DATA_SHARED_CAPACITY readings (of all
+# devices together) in shared memory; see shm_store.py and workers.py.
+# Segment logs (DATA_DIR) and compressed cold history are not available then.
+DATA_WORKERS = int(os.getenv("DATA_WORKERS", "1"))
+DATA_SHARED_CAPACITY = int(os.getenv("DATA_SHARED_CAPACITY", "1000000"))
+# Name of the shared memory block, set by the supervisor for its workers
+DATA_SHARED_STORE = os.getenv("DATA_SHARED_STORE")
+
+# Minute, hour and day aggregates, updated as readings are stored.
+temperature_rollups = RollupStore()
+
+# Device ids double as directory names for the segment logs.
+DEVICE_ID_PATTERN = re.compile(r"^[A-Za-z0-9][A-Za-z0-9._-]{0,63}$")
+
+def create_store():
+    """
+    Builds the per-device reading store, backed by segment logs when DATA_DIR
+    is set, and wires it to the rollups. With DATA_WORKERS > 1 the supervisor
+    creates the shared store and its workers open it.
+    """
+    if DATA_WORKERS > 1:
+        if DATA_DIR:
+            raise RuntimeError("DATA_DIR is not supported with DATA_WORKERS > 1")
+        if WORKER_INDEX is None:
+            # The supervisor only owns the block; it serves nothing, so it does not follow it
+            store = SharedStore(DATA_SHARED_CAPACITY, DATA_MAX_DEVICES, follow=False)
+            atexit.register(store.unlink)
+            return store
+        store = SharedStore.attach(DATA_SHARED_STORE)
+        store.add_listener(temperature_rollups.add, replay=True)
+        return store
+
+    if not DATA_DIR:
+        store = PartitionedStore(DATA_STORE_CAPACITY, max_devices=DATA_MAX_DEVICES,
+                                 value_typecode=DATA_VALUE_TYPECODE, chunk_size=DATA_CHUNK_SIZE,
+                                 cold_bytes=DATA_COLD_BYTES)
+        store.add_listener(temperature_rollups.add)
+        return store
+
+    def make_log(device_id):
+        return SegmentLog(os.path.join(DATA_DIR, device_id), LOG_RECORD_FORMAT,
+                          segment_records=DATA_SEGMENT_RECORDS,
+                          fsync_every=DATA_FSYNC_EVERY, fsync_interval=DATA_FSYNC_INTERVAL)
+
+    store = PartitionedStore(DATA_STORE_CAPACITY, make_log=make_log, max_devices=DATA_MAX_DEVICES,
+                             value_typecode=DATA_VALUE_TYPECODE, chunk_size=DATA_CHUNK_SIZE,
+                             cold_bytes=DATA_COLD_BYTES)
+    os.makedirs(DATA_DIR, exist_ok=True)
+    for name in sorted(os.listdir(DATA_DIR)):
+        if DEVICE_ID_PATTERN.match(name) and os.path.isdir(os.path.join(DATA_DIR, name)):
+            store.partition(name, create=True)
+    print(f"Data Service: Loaded {len(store.devices())} devices from {DATA_DIR}")
+
+    # Rebuild the rollups from the part of the logs they still cover
+    oldest_ns = time.time_ns() - max(width * retention for width, retention in RESOLUTIONS.values())
+    for timestamp_ns, record in store.scan(since_ns=oldest_ns, newest_first=False):
+        temperature_rollups.add(timestamp_ns, record["temperature"])
+    store.add_listener(temperature_rollups.add)
+
+    def sync_periodically():
+        # Bounds how long a reading can sit unsynced when ingest goes quiet
+        while True:
+            time.sleep(DATA_FSYNC_INTERVAL)
+            store.sync()
+
+    threading.Thread(target=sync_periodically, daemon=True).start()
+    atexit.register(store.sync)
+    return store
+
+# Each device's readings are kept in arrival order, which is also timestamp order.
+temperature_data_store = create_store()
+
+# Services such as the Control Service subscribe here to be pushed new readings.
+# DATA_NOTIFY_TIMEOUT bounds each webhook delivery, in seconds.
+DATA_NOTIFY_TIMEOUT = float(os.getenv("DATA_NOTIFY_TIMEOUT", "1.0"))
+# Every worker sees every reading, so with DATA_WORKERS > 1 only worker 0 delivers.
+reading_notifier = WebhookNotifier(temperature_data_store, timeout=DATA_NOTIFY_TIMEOUT,
+                                   deliver=WORKER_INDEX in (None, 0))
+temperature_data_store.add_listener(reading_notifier.listener)
+
+# Dashboards follow new readings and setpoint changes on GET /stream.
+live_hub = LiveHub()
+temperature_data_store.add_listener(live_hub.listener)
+
+# With DATA_WORKERS > 1, subscription changes and published events are posted
+# through the shared store, so every worker applies them, in the same order,
+# whichever worker took the request; a restarted worker replays the ones
+# still in the store's message ring.
+def broadcast(message):
+    """
+    Posts `message` to every worker. Returns False when the service is not
+    served by workers; raises ValueError if the message is too long.
+    """
+    if WORKER_INDEX is None:
+        return False
+    temperature_data_store.post(json.dumps(message).encode())
+    return True
+
+def apply_message(message):
+    message = json.loads(message)
+    kind = message.get("type")
+    if kind == "subscribe":
+        lease = message["lease"] - (time.time() - message["sent_at"])
+        if lease > 0:
+            reading_notifier.subscribe(message["url"], lease)
+    elif kind == "unsubscribe":
+        reading_notifier.unsubscribe(message["url"])
+    elif kind == "event":
+        live_hub.publish(message["event"], message["data"])
+
+if WORKER_INDEX is not None:
+    temperature_data_store.add_message_listener(apply_message, replay=True)
+
+# Ingest and store size metrics; the counter is per-thread, so the listener stays cheap
+readings_ingested = REGISTRY.counter("readings_ingested_total", "Readings stored.")
+
+def count_reading(timestamp_ns, temperature, device_id):
+    readings_ingested.inc()
+
+temperature_data_store.add_listener(count_reading)
+REGISTRY.collect("store_readings", "Readings held in memory.", lambda: len(temperature_data_store))
+REGISTRY.collect("store_bytes", "Bytes held by the in-memory store.", lambda: temperature_data_store.nbytes)
+REGISTRY.collect("store_devices", "Devices with a partition in the store.", lambda: len(temperature_data_store.devices()))
+EVENT_NAME_PATTERN = re.compile(r"^[a-z][a-z_]{0,31}$")
+
+# Client-supplied timestamps further in the future than this are rejected.
+MAX_CLOCK_SKEW_SECONDS = float(os.getenv("MAX_CLOCK_SKEW_SECONDS", "300"))
+
+# Limits for POST /data/batch
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "10000"))
+MAX_REPORTED_ERRORS = 100
+NDJSON_MIMETYPES = ("application/x-ndjson", "application/jsonl", "application/jsonlines")
+
+# Streamed history responses are flushed every this many rows, unless the
+# request asks for another 'flush_rows' value up to the maximum.
+DATA_STREAM_FLUSH_ROWS = int(os.getenv("DATA_STREAM_FLUSH_ROWS", "1000"))
+MAX_STREAM_FLUSH_ROWS = 100_000
+
+def parse_reading(row, now_ns):
+    """
+    Validates one incoming reading and returns (temperature, timestamp_ns, device_id).
+    'timestamp' and 'device_id' are optional; a missing timestamp is None and
+    the store stamps the reading on arrival.
+    Raises ValueError with a client-facing message if the reading is invalid.
+    """
+    if not isinstance(row, dict):
+        raise ValueError("Reading must be a JSON object")
+
+    temp = row.get('temperature')
+    if temp is None:
+        raise ValueError("Missing 'temperature' in request")
+    try:
+        if isinstance(temp, bool):
+            raise TypeError
+        temperature = float(temp)
+    except (TypeError, ValueError):
+        raise ValueError("Invalid temperature format")
+    if not math.isfinite(temperature):
+        raise ValueError("Invalid temperature format")
+
+    timestamp_ns = None
+    if row.get('timestamp') is not None:
+        try:
+            timestamp_ns = parse_timestamp(row['timestamp'])
+        except ValueError:
+            raise ValueError("Invalid 'timestamp' format")
+        if timestamp_ns > now_ns + MAX_CLOCK_SKEW_SECONDS * 1_000_000_000:
+            raise ValueError("'timestamp' is too far in the future")
+
+    device_id = row.get('device_id')
+    if device_id is not None and (not isinstance(device_id, str) or not DEVICE_ID_PATTERN.match(device_id)):
+        raise ValueError("'device_id' must be 1-64 letters, digits, '.', '_' or '-'")
+
+    return temperature, timestamp_ns, device_id
+
+def read_batch_rows():
+    """
+    Decodes a batch request body, either a JSON array or newline-delimited JSON.
+    Returns (rows, errors): NDJSON lines that are not valid JSON are reported in
+    `errors` and appear in `rows` as None so row indexes stay aligned.
+    Raises ValueError if the body cannot be read as a batch at all.
+    """
+    if request.mimetype in NDJSON_MIMETYPES:
+        rows, errors = [], []
+        for line in request.get_data().splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError:
+                errors.append({"index": len(rows), "error": "Invalid JSON"})
+                rows.append(None)
+        return rows, errors
+
+    if not request.is_json:
+        raise ValueError("Request must be a JSON array or NDJSON")
+    rows = request.get_json(silent=True)
+    if not isinstance(rows, list):
+        raise ValueError("Request body must be a JSON array of readings")
+    return rows, []
+
+def encode_cursor(position, newest_first):
+    """
+    Wraps a store position in an opaque, URL-safe pagination cursor. The position
+    is a sequence number for one device, or (timestamp_ns, device_id) across devices.
+    """
+    position = list(position) if isinstance(position, tuple) else [position]
+    raw = json.dumps(['d' if newest_first else 'a'] + position, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+def decode_cursor(cursor, newest_first, device_scoped):
+    """Turns a cursor back into a store position. Raises ValueError if it is invalid."""
+    try:
+        raw = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        direction, position = raw[0], raw[1:]
+    except (ValueError, TypeError, KeyError, IndexError):
+        raise ValueError("Invalid cursor")
+    if direction != ('d' if newest_first else 'a'):
+        raise ValueError("Cursor does not match the requested order")
+    if device_scoped and len(position) == 1 and isinstance(position[0], int):
+        return position[0]
+    if not device_scoped and len(position) == 2 and isinstance(position[0], int) and isinstance(position[1], str):
+        return tuple(position)
+    raise ValueError("Cursor does not match the requested device")
+
+def parse_query_args(args, device_scoped=False):
+    """
+    Parses the range query parameters of GET /data:
+    - since: only readings newer than this timestamp (ISO-8601 or epoch seconds)
+    - until: only readings at or before this timestamp
+    - limit: maximum number of readings to return
+    - order: 'desc' (newest first, the default) or 'asc'
+    - cursor: the X-Next-Cursor value of a previous response
+    Raises ValueError with a client-facing message on bad input.
+    """
+    order = args.get('order', 'desc')
+    if order not in ('asc', 'desc'):
+        raise ValueError("'order' must be 'asc' or 'desc'")
+    newest_first = order == 'desc'
+    query = {"newest_first": newest_first}
+    for name in ('since', 'until'):
+        if args.get(name):
+            try:
+                query[f"{name}_ns"] = parse_timestamp(args[name])
+            except ValueError:
+                raise ValueError(f"Invalid '{name}' timestamp")
+    if args.get('limit'):
+        try:
+            query["limit"] = int(args['limit'])
+        except ValueError:
+            raise ValueError("'limit' must be an integer")
+        if query["limit"] < 1:
+            raise ValueError("'limit' must be at least 1")
+    if args.get('cursor'):
+        query["cursor"] = decode_cursor(args['cursor'], newest_first, device_scoped)
+    return query
 
 @app.route('/data', methods=['GET', 'POST'])
 def handle_data():
     """
     Handles storing and retrieving temperature data.
     - POST: Receives a new temperature reading from the IoT device.
-    - GET: Returns the entire history of temperature readings.
+    - GET: Returns the stored history of temperature readings, newest first.
+      Supports 'device_id', 'since', 'until', 'limit', 'order' and 'cursor' query
+      parameters; when more readings match, the X-Next-Cursor header holds the
+      next page's cursor. 'format=ndjson' or 'stream=1' stream the response.
     """
     if request.method == 'POST':
         # Check if the request has a JSON body
         if not request.is_json:
             return jsonify({"error": "Request must be JSON"}), 400
 
-        data = request.get_json()
-        temp = data.get('temperature')
-
-        if temp is None:
-            return jsonify({"error": "Missing 'temperature' in request"}), 400
+        try:
+            reading = parse_reading(request.get_json(), time.time_ns())
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
-        # Create a new record with a timestamp
-        record = {
-            "temperature": float(temp),
-            "timestamp": datetime.datetime.utcnow().isoformat() + 'Z'
-        }
-        temperature_data_store.append(record)
+        temperature, timestamp_ns, device_id = reading
+        try:
+            partition = temperature_data_store.partition(device_id or DEFAULT_DEVICE_ID, create=True)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            # Without a client timestamp the store stamps the reading with the current time
+            record = partition.append(temperature, timestamp_ns)
+        except ValueError:
+            return jsonify({"error": "Reading is not newer than the device's newest stored reading"}), 409
         print(f"Data Service: Received new temperature reading: {record['temperature']}°C")
 
         return jsonify({"message": "Data received successfully"}), 201
 
     elif request.method == 'GET':
-        # Return all stored data, sorted with the newest first
-        sorted_data = sorted(temperature_data_store, key=lambda x: x['timestamp'], reverse=True)
-        return jsonify(sorted_data)
+        return query_readings(request.args.get('device_id'))
+
+def requested_stream_format():
+    """
+    Returns how a history response should be streamed: 'ndjson' for
+    'format=ndjson' or an Accept header preferring application/x-ndjson,
+    'json' for a streamed JSON array ('stream=1'), or None for a regular response.
+    """
+    fmt = request.args.get('format')
+    if fmt == 'ndjson':
+        return 'ndjson'
+    if fmt is None and request.accept_mimetypes.best_match(["application/json", "application/x-ndjson"]) == "application/x-ndjson":
+        return 'ndjson'
+    if request.args.get('stream') in ('1', 'true'):
+        return 'json'
+    return None
+
+def stream_records(entries, fmt, flush_rows):
+    """
+    Serializes `(timestamp_ns, record)` entries as NDJSON or as a JSON array,
+    yielding one chunk every `flush_rows` records so memory stays bounded.
+    """
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    entries = iter(entries)
+    if fmt == 'json':
+        yield '['
+    separator = ''
+    while True:
+        batch = [encode(record) for _, record in itertools.islice(entries, flush_rows)]
+        if not batch:
+            break
+        if fmt == 'ndjson':
+            yield '\n'.join(batch) + '\n'
+        else:
+            yield separator + ','.join(batch)
+            separator = ','
+    if fmt == 'json':
+        yield ']'
+
+def query_readings(device_id=None):
+    """
+    Answers a history query for one device, or for all devices if none is given.
+    Large exports can be streamed (see requested_stream_format()) so the
+    response starts right away and is never built in memory as a whole.
+    """
+    try:
+        query = parse_query_args(request.args, device_scoped=device_id is not None)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    fmt = requested_stream_format()
+    if fmt is not None:
+        flush_rows = request.args.get('flush_rows', DATA_STREAM_FLUSH_ROWS, type=int)
+        flush_rows = max(1, min(flush_rows, MAX_STREAM_FLUSH_ROWS))
+        limit = query.pop("limit", None)
+        entries = itertools.islice(temperature_data_store.scan(device_id=device_id, **query), limit)
+        mimetype = "application/x-ndjson" if fmt == 'ndjson' else "application/json"
+        return Response(stream_records(entries, fmt, flush_rows), mimetype=mimetype)
+
+    # Each partition is already time-ordered, so this is a binary search plus a slice
+    records, next_cursor = temperature_data_store.query(device_id=device_id, **query)
+    response = jsonify(records)
+    if next_cursor is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_cursor, query["newest_first"])
+    return response
+
+@app.route('/data/batch', methods=['POST'])
+def handle_data_batch():
+    """
+    Stores many readings in one request, sent as a JSON array or as NDJSON
+    (Content-Type: application/x-ndjson). Each reading has a 'temperature' and
+    optional 'timestamp' and 'device_id'. The batch is validated in one pass and
+    stored under a single lock acquisition; invalid rows are rejected individually.
+    """
+    try:
+        rows, errors = read_batch_rows()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if len(rows) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch exceeds the maximum of {MAX_BATCH_SIZE} readings"}), 413
+
+    now_ns = time.time_ns()
+    readings, indexes = [], []
+    registered = {}
+    for index, row in enumerate(rows):
+        if row is None:
+            continue
+        try:
+            reading = parse_reading(row, now_ns)
+            device_id = reading[2] or DEFAULT_DEVICE_ID
+            if device_id not in registered:
+                registered[device_id] = temperature_data_store.partition(device_id, create=True)
+            readings.append(reading)
+            indexes.append(index)
+        except ValueError as e:
+            errors.append({"index": index, "error": str(e)})
+
+    # Store client-stamped readings oldest first, then the ones stamped on arrival
+    order = sorted(range(len(readings)), key=lambda i: (readings[i][1] is None, readings[i][1] or 0))
+    stored = temperature_data_store.extend([readings[i] for i in order])
+    for i, timestamp_ns in zip(order, stored):
+        if timestamp_ns is None:
+            errors.append({"index": indexes[i], "error": "Reading is not newer than the device's newest stored reading"})
+
+    accepted = len(rows) - len(errors)
+    errors.sort(key=lambda error: error["index"])
+    print(f"Data Service: Received batch of {len(rows)} readings ({accepted} accepted, {len(errors)} rejected)")
+    return jsonify({
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": errors[:MAX_REPORTED_ERRORS]
+    })
+
+@app.route('/data/latest', methods=['GET'])
+def get_latest():
+    """
+    Returns the newest reading of the device given by 'device_id', or the
+    newest reading overall. This is constant-time, whatever the history size.
+    """
+    record = temperature_data_store.latest(request.args.get('device_id'))
+    if record is None:
+        return jsonify({"error": "No readings available"}), 404
+    return jsonify(record)
+
+@app.route('/data/rollup', methods=['GET'])
+def get_rollup():
+    """
+    Returns precomputed min/max/avg/count buckets for one 'resolution'
+    (minute, hour or day), newest first. Accepts the 'since', 'until', 'limit'
+    and 'order' parameters of GET /data; a bucket is included if it overlaps the range.
+    """
+    resolution = request.args.get('resolution', 'hour')
+    if resolution not in temperature_rollups.resolutions:
+        return jsonify({"error": f"'resolution' must be one of {', '.join(temperature_rollups.resolutions)}"}), 400
+    try:
+        query = parse_query_args(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    query.pop("cursor", None)
+
+    rows = temperature_rollups.query(resolution, **query)
+    return jsonify([{
+        "start": format_timestamp(start),
+        "min": minimum,
+        "max": maximum,
+        "avg": total / count,
+        "count": count
+    } for start, minimum, maximum, total, count in rows])
+
+@app.route('/devices', methods=['GET'])
+def list_devices():
+    """Lists the registered devices with their number of stored readings and latest reading."""
+    devices = []
+    for device_id in temperature_data_store.devices():
+        partition = temperature_data_store.partition(device_id)
+        devices.append({
+            "device_id": device_id,
+            "readings": len(partition),
+            "latest": partition.latest()
+        })
+    return jsonify(devices)
+
+@app.route('/devices/<device_id>/data', methods=['GET'])
+def get_device_data(device_id):
+    """Returns one device's history; takes the same query parameters as GET /data."""
+    if temperature_data_store.partition(device_id) is None:
+        return jsonify({"error": "Unknown device"}), 404
+    return query_readings(device_id)
+
+@app.route('/devices/<device_id>/latest', methods=['GET'])
+def get_device_latest(device_id):
+    """Returns one device's newest reading."""
+    record = temperature_data_store.latest(device_id)
+    if record is None:
+        return jsonify({"error": "No readings for this device"}), 404
+    return jsonify(record)
+
+@app.route('/subscriptions', methods=['GET', 'POST', 'DELETE'])
+def handle_subscriptions():
+    """
+    GET: Lists the active webhooks and the seconds left on their leases.
+    POST: Subscribes {"url": ..., "lease": seconds} to new readings, or renews
+    the lease of an existing subscription.
+    DELETE: Unsubscribes the webhook given by the 'url' query parameter.
+    """
+    if request.method == 'GET':
+        return jsonify(reading_notifier.subscriptions())
+
+    if request.method == 'DELETE':
+        url = request.args.get('url')
+        known = reading_notifier.unsubscribe(url)
+        if url:
+            try:
+                broadcast({"type": "unsubscribe", "url": url})
+            except ValueError:
+                pass  # Too long to have been subscribed
+        if not known:
+            return jsonify({"error": "Unknown subscription"}), 404
+        return jsonify({"message": "Unsubscribed"})
+
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 400
+    data = request.get_json()
+    url = data.get('url')
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        return jsonify({"error": "'url' must be an http(s) URL"}), 400
+    try:
+        lease = float(data.get('lease', DEFAULT_LEASE_SECONDS))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Invalid 'lease'"}), 400
+    if not math.isfinite(lease):
+        return jsonify({"error": "Invalid 'lease'"}), 400
+    lease = min(max(1, lease), MAX_LEASE_SECONDS)
+    try:
+        broadcast({"type": "subscribe", "url": url, "lease": lease, "sent_at": time.time()})
+    except ValueError:
+        return jsonify({"error": "'url' is too long"}), 400
+    lease = reading_notifier.subscribe(url, lease)
+    return jsonify({"url": url, "lease": lease}), 201
+
+def live_stream_args():
+    """Returns the device filter, resume point and initial events of a /stream request."""
+    device_id = request.args.get('device_id') or None
+    try:
+        last_event_id = int(request.headers.get('Last-Event-ID', ''))
+    except ValueError:
+        last_event_id = None
+    latest = temperature_data_store.latest(device_id)
+    return device_id, last_event_id, [("latest", latest)] if latest else []
+
+def event_stream_response(body):
+    return Response(body, mimetype='text/event-stream',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/stream', methods=['GET'])
+def live_stream():
+    """
+    Server-Sent Events stream of new readings ("reading" events, optionally
+    only those of 'device_id') and of setpoint changes ("setpoint" events).
+    It starts with the newest reading so far (a "latest" event) and the last
+    setpoint announced; a client resuming with Last-Event-ID instead gets
+    the events it missed.
+    """
+    device_id, last_event_id, initial_events = live_stream_args()
+    return event_stream_response(live_hub.stream(device_id, last_event_id, initial_events))
+
+@app.route('/events', methods=['POST'])
+def publish_event():
+    """
+    Publishes {"event": name, "data": {...}} to every live stream, e.g. the
+    Control Service announcing a new setpoint. Readings are published by the
+    store itself, so "reading" is not accepted here.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({"error": "Request must be a JSON object"}), 400
+    name = data.get('event')
+    if not isinstance(name, str) or not EVENT_NAME_PATTERN.match(name) or name == "reading":
+        return jsonify({"error": "Invalid 'event' name"}), 400
+    try:
+        if not broadcast({"type": "event", "event": name, "data": data.get('data')}):
+            live_hub.publish(name, data.get('data'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 413
+    return jsonify({"message": "Event published"})
+
+# ASGI entry point, e.g. `uvicorn data_service:asgi_app --port 5001`.
+# Handlers run on the adapter's thread pool; event streams wait on the loop
+# instead of holding a thread each.
+asgi_app = AsgiAdapter(app)
+
+@asgi_app.coroutine('live_stream')
+async def live_stream_async():
+    device_id, last_event_id, initial_events = live_stream_args()
+    return event_stream_response(live_hub.stream_async(device_id, last_event_id, initial_events))
 
 if __name__ == '__main__':
     # This service runs on port 5001
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    if DATA_WORKERS > 1 and WORKER_INDEX is None:
+        run_workers(__file__, DATA_WORKERS, '0.0.0.0', 5001,
+                    env={"DATA_SHARED_STORE": temperature_data_store.name}, name="Data Service")
+    elif WORKER_INDEX is not None:
+        print(f"Data Service: Worker {WORKER_INDEX} serving")
+        if SERVING_MODE == "asgi":
+            serve(asgi_app, host='0.0.0.0', port=5001, fd=listen_fd())
+        else:
+            serve_worker(app, '0.0.0.0', 5001)
+    elif SERVING_MODE == "asgi":
+        serve(asgi_app, host='0.0.0.0', port=5001)
+    else:
+        app.run(host='0.0.0.0', port=5001, debug=True)
 
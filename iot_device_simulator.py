@@ -1,42 +1,114 @@
+import asyncio
+import os
 import requests
+import http_client
 import time
 import random
+from datetime import datetime, timezone
+import device_fleet
+from reading_buffer import ReadingBuffer, Uploader
 
 # This script simulates an IoT device.
 # It periodically checks the target temperature from the Control Service
 # and sends its simulated sensor readings to the Data Service.
+# With SIMULATOR_DEVICES above 1 it simulates a whole fleet of devices
+# instead (see device_fleet.py).
 
 CONTROL_SERVICE_URL = "http://127.0.0.1:5002/state"
-DATA_SERVICE_URL = "http://127.0.0.1:5001/data"
+CONTROL_COMMANDS_URL = "http://127.0.0.1:5002/commands"
+DATA_BATCH_URL = "http://127.0.0.1:5001/data/batch"
+# Readings are sent without a device id, so they belong to the "default" device
+DEVICE_ID = "default"
+
+# Readings wait in a store-and-forward buffer until the Data Service has them:
+# how many to keep at most, the file to spool them to (kept in memory only if
+# unset) and how many to upload per batch request
+SIMULATOR_BUFFER_SIZE = int(os.getenv("SIMULATOR_BUFFER_SIZE", "10000"))
+SIMULATOR_SPOOL_FILE = os.getenv("SIMULATOR_SPOOL_FILE")
+SIMULATOR_UPLOAD_BATCH = int(os.getenv("SIMULATOR_UPLOAD_BATCH", "500"))
+
+# Fleet mode: number of devices, seconds between each device's readings,
+# requests in flight, readings per batch request, seed for the devices'
+# parameters and phases, and how long to run (0 runs until stopped)
+SIMULATOR_DEVICES = int(os.getenv("SIMULATOR_DEVICES", "1"))
+SIMULATOR_INTERVAL = float(os.getenv("SIMULATOR_INTERVAL", "5"))
+SIMULATOR_CONCURRENCY = int(os.getenv("SIMULATOR_CONCURRENCY", "32"))
+SIMULATOR_BATCH_SIZE = int(os.getenv("SIMULATOR_BATCH_SIZE", "1000"))
+SIMULATOR_SEED = int(os.getenv("SIMULATOR_SEED")) if os.getenv("SIMULATOR_SEED") else None
+SIMULATOR_DURATION = float(os.getenv("SIMULATOR_DURATION", "0"))
 
 # Initial simulated temperature
 current_temperature = 20.0
 
+# Last state received and its ETag; an unchanged state comes back as an empty 304
+last_state = {"etag": None, "target_temperature": None}
+
 def get_target_temperature():
     """Fetches the target temperature from the control service."""
     try:
-        response = requests.get(CONTROL_SERVICE_URL)
+        headers = {"If-None-Match": last_state["etag"]} if last_state["etag"] else {}
+        response = http_client.get(CONTROL_SERVICE_URL, headers=headers)
+        if response.status_code == 304:
+            return last_state["target_temperature"]
         response.raise_for_status()
-        return response.json().get('target_temperature')
+        last_state["etag"] = response.headers.get("ETag")
+        last_state["target_temperature"] = response.json().get('target_temperature')
+        return last_state["target_temperature"]
     except requests.exceptions.RequestException as e:
         print(f"SIMULATOR: Could not get target temperature: {e}")
         return None
 
-def post_temperature_reading(temp):
-    """Posts a new temperature reading to the data service."""
+def get_command():
+    """Fetches this device's heating/cooling output in [-1, 1] from the control service's controller."""
     try:
-        payload = {"temperature": temp}
-        response = requests.post(DATA_SERVICE_URL, json=payload)
+        response = http_client.get(CONTROL_COMMANDS_URL, params={"zone_id": DEVICE_ID})
         response.raise_for_status()
-        print(f"SIMULATOR: Successfully sent temperature reading: {temp:.2f}°C")
+        command = response.json().get('commands', {}).get(DEVICE_ID)
+        return command.get('output') if command else None
     except requests.exceptions.RequestException as e:
-        print(f"SIMULATOR: Could not send temperature reading: {e}")
+        print(f"SIMULATOR: Could not get command: {e}")
+        return None
 
-def simulate_temperature_change(current, target):
+def post_readings(readings):
+    """
+    Uploads buffered readings to the data service in one batch request.
+    Raises RequestException if they should be sent again later; readings the
+    service already has come back rejected and are not resent.
+    """
+    response = http_client.post(DATA_BATCH_URL, json=readings)
+    if response.status_code >= 500 or response.status_code == 429:
+        response.raise_for_status()
+    if response.status_code != 200:
+        print(f"SIMULATOR: Data service refused {len(readings)} readings: {response.text.strip()}")
+        return
+    result = response.json()
+    print(f"SIMULATOR: Successfully sent {result.get('accepted')} temperature readings "
+          f"({result.get('rejected')} already stored or invalid)")
+
+reading_buffer = ReadingBuffer(SIMULATOR_BUFFER_SIZE, SIMULATOR_SPOOL_FILE)
+uploader = Uploader(reading_buffer, post_readings, SIMULATOR_UPLOAD_BATCH)
+
+def post_temperature_reading(temp):
+    """
+    Queues a new temperature reading, stamped with the time it was taken,
+    and uploads the backlog to the data service. While the service is
+    unreachable the readings stay queued.
+    """
+    reading_buffer.add({"temperature": round(temp, 2), "timestamp": datetime.now(timezone.utc).isoformat()})
+    uploader.flush()
+    if uploader.failures:
+        print(f"SIMULATOR: Could not send temperature readings: {uploader.last_error}; "
+              f"{len(reading_buffer)} buffered, {reading_buffer.dropped} dropped")
+
+def simulate_temperature_change(current, target, output=None):
     """
     Simulates the room temperature slowly changing to meet the target.
+    With a controller `output` (positive heats, negative cools) the room
+    follows it; otherwise it nudges itself towards the target.
     Adds a little random noise to make it more realistic.
     """
+    if output is not None:
+        return current + output * 0.4 + random.uniform(-0.1, 0.1)
     if target is None:
         # If we can't get a target, just drift randomly
         return current + random.uniform(-0.2, 0.2)
@@ -52,7 +124,24 @@ def simulate_temperature_change(current, target):
     
     return current
 
-if __name__ == "__main__":
+def run_fleet():
+    """Simulates SIMULATOR_DEVICES devices until SIMULATOR_DURATION has passed or Ctrl+C."""
+    fleet = device_fleet.Fleet(SIMULATOR_DEVICES, interval=SIMULATOR_INTERVAL, seed=SIMULATOR_SEED)
+    print(f"--- IoT Device Simulator Started: fleet of {len(fleet)} devices ---")
+    print("Press Ctrl+C to stop.")
+    try:
+        asyncio.run(device_fleet.run(fleet, DATA_BATCH_URL, CONTROL_COMMANDS_URL, CONTROL_SERVICE_URL,
+                                     concurrency=SIMULATOR_CONCURRENCY, batch_size=SIMULATOR_BATCH_SIZE,
+                                     duration=SIMULATOR_DURATION or None))
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(f"SIMULATOR: {e}")
+    print("\n--- IoT Device Simulator Stopped ---")
+
+if __name__ == "__main__" and SIMULATOR_DEVICES > 1:
+    run_fleet()
+elif __name__ == "__main__":
     print("--- IoT Device Simulator Started ---")
     print("Press Ctrl+C to stop.")
     while True:
@@ -60,8 +149,8 @@ if __name__ == "__main__":
             # 1. Get the current setpoint
             target_temp = get_target_temperature()
 
-            # 2. Simulate the new temperature based on the target
-            current_temperature = simulate_temperature_change(current_temperature, target_temp)
+            # 2. Simulate the new temperature based on the controller's command, or the target
+            current_temperature = simulate_temperature_change(current_temperature, target_temp, get_command())
 
             # 3. Send the new reading to the data service
             post_temperature_reading(current_temperature)
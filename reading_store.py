@@ -0,0 +1,603 @@
+import bisect
+import datetime
+import functools
+import heapq
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from chunk_codec import decode_chunk, encode_chunk
+
+# In-memory store for temperature readings, partitioned by device.
+# Each device's readings arrive in timestamp order, so keeping them in arrival
+# order is enough to answer "newest first" without ever sorting the history,
+# and the timestamps form a sorted index that range queries can binary-search.
+
+DEFAULT_CAPACITY = 1_000_000
+DEFAULT_MAX_DEVICES = 10_000
+
+# Readings sent without a device_id belong to this device
+DEFAULT_DEVICE_ID = "default"
+
+# Array type code of the in-memory temperatures: 'f' (float32, 12 bytes per
+# reading with the int64 timestamp) or 'd' (float64, 16 bytes per reading)
+DEFAULT_VALUE_TYPECODE = 'f'
+
+# Readings leaving the ring are sealed into compressed chunks of this many
+# readings, and up to this many bytes of chunks are kept per device.
+DEFAULT_CHUNK_SIZE = 1024
+DEFAULT_COLD_BYTES = 16 * 1024 * 1024
+# Number of decoded chunks kept around for queries that revisit them
+_DECODED_CHUNK_CACHE = 8
+
+# On-disk record layout of a device's log: timestamp_ns, temperature
+LOG_RECORD_FORMAT = '<qd'
+
+# Scans read the ring in chunks that start small and double up to this size,
+# so merging many devices only touches the readings it actually returns.
+_SCAN_FIRST_CHUNK = 16
+_SCAN_MAX_CHUNK = 4096
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+@functools.lru_cache(maxsize=4096)
+def _format_seconds(seconds):
+    return (_EPOCH + datetime.timedelta(seconds=seconds)).isoformat()
+
+
+def format_timestamp(timestamp_ns):
+    """Formats epoch nanoseconds as the ISO-8601 UTC string used in the API."""
+    seconds, microseconds = divmod(timestamp_ns // 1000, 1_000_000)
+    # Readings cluster in time, so the date-and-time part is usually cached
+    if microseconds:
+        return f"{_format_seconds(seconds)}.{microseconds:06d}Z"
+    return _format_seconds(seconds) + 'Z'
+
+
+def parse_timestamp(value):
+    """
+    Parses an API timestamp into epoch nanoseconds.
+    Accepts ISO-8601 strings (with or without a trailing 'Z' or UTC offset)
+    and numbers of seconds since the epoch. Raises ValueError otherwise.
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid timestamp: {value!r}")
+    if isinstance(value, (int, float)):
+        return int(value * 1_000_000_000)
+    text = str(value).strip()
+    try:
+        return int(float(text) * 1_000_000_000)
+    except ValueError:
+        pass
+    if text.endswith('Z'):
+        text = text[:-1] + '+00:00'
+    parsed = datetime.datetime.fromisoformat(text)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    delta = parsed - _EPOCH
+    return (delta.days * 86_400 + delta.seconds) * 1_000_000_000 + delta.microseconds * 1000
+
+
+def _float32_value(value):
+    # float32 carries ~7 significant digits; drop the binary noise past them
+    return float(f"{value:.7g}")
+
+
+class _TimeIndex:
+    """Read-only sequence view of the ring's timestamps, oldest first, for bisect."""
+
+    def __init__(self, times, capacity, first_seq, count):
+        self._times = times
+        self._capacity = capacity
+        self._first_seq = first_seq
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, i):
+        return self._times[(self._first_seq + i) % self._capacity]
+
+
+class _Chunk:
+    """An immutable, compressed run of readings [first_seq, first_seq + count)."""
+
+    __slots__ = ("first_seq", "count", "first_ns", "last_ns", "data")
+
+    def __init__(self, first_seq, count, first_ns, last_ns, data):
+        self.first_seq = first_seq
+        self.count = count
+        self.first_ns = first_ns
+        self.last_ns = last_ns
+        self.data = data
+
+
+class ReadingStore:
+    """
+    A fixed-capacity ring buffer of one device's readings, kept in arrival
+    (= timestamp) order. Readings are held column-wise in two typed arrays,
+    int64 epoch-nanosecond timestamps and float32/float64 temperatures;
+    the JSON records are only built when readings are read back.
+    - append() is O(1); once the buffer is full the oldest reading is evicted.
+    - newest() returns readings newest-first by walking the ring backwards.
+    - query() binary-searches the timestamp index, so its cost depends on the
+      size of the result rather than on the size of the history.
+
+    Every reading gets a sequence number in arrival order; the reading with
+    sequence number `seq` lives in slot `seq % capacity`. The ring grows up to
+    its capacity as readings arrive rather than being allocated up front.
+
+    Listeners registered with add_listener() are called for every stored
+    reading, in timestamp order and with the store lock held.
+
+    Only this hot head of the history is kept uncompressed. With `cold_bytes`
+    set, readings leaving the ring are sealed `chunk_size` at a time into
+    immutable chunks compressed with chunk_codec (delta-of-delta timestamps,
+    XOR values); the oldest chunks are dropped once they exceed `cold_bytes`.
+    Queries only decode the chunks overlapping their range.
+
+    With a `log` (a SegmentLog using LOG_RECORD_FORMAT) every reading is also
+    written to disk. The ring is refilled from the log on startup and queries
+    reaching past the memory tiers are answered from the log, so memory acts
+    as a cache of the most recent part of the durable history.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, log=None, device_id=DEFAULT_DEVICE_ID,
+                 value_typecode=DEFAULT_VALUE_TYPECODE, chunk_size=DEFAULT_CHUNK_SIZE,
+                 cold_bytes=DEFAULT_COLD_BYTES):
+        if capacity <= 0:
+            raise ValueError("Store capacity must be a positive integer")
+        if value_typecode not in ('f', 'd'):
+            raise ValueError("Value type code must be 'f' or 'd'")
+        self.capacity = capacity
+        self.device_id = device_id
+        self.chunk_size = max(1, min(chunk_size, capacity))
+        self.cold_bytes = cold_bytes
+        self._chunks = []
+        self._chunk_firsts = []  # first_seq of each chunk, for bisect
+        self._chunk_lasts = []   # last_ns of each chunk, for bisect
+        self._cold_used = 0
+        self._cold_count = 0
+        self._decoded = OrderedDict()
+        self._times = array('q')
+        self._values = array(value_typecode)
+        self._decode = _float32_value if value_typecode == 'f' else float
+        self._next_seq = 0  # Sequence number of the next reading
+        self._count = 0     # Number of readings currently held
+        self._lock = threading.Lock()
+        self._log = log
+        self._unlogged = []
+        self._listeners = []
+        if log is not None:
+            self._load_log()
+
+    def __len__(self):
+        """Number of readings held in memory, hot and compressed."""
+        return self._count + self._cold_count
+
+    @property
+    def nbytes(self):
+        """Bytes held by the in-memory columns and compressed chunks."""
+        return (len(self._times) * self._times.itemsize + len(self._values) * self._values.itemsize
+                + self._cold_used)
+
+    def add_listener(self, listener):
+        """Registers `listener(timestamp_ns, temperature, device_id)`; it must be cheap."""
+        self._listeners.append(listener)
+
+    def _load_log(self):
+        # Refill the ring with the newest logged readings
+        total = len(self._log)
+        self._next_seq = max(0, total - self.capacity)
+        if self._next_seq:
+            self._times.frombytes(bytes(self.capacity * self._times.itemsize))
+            self._values.frombytes(bytes(self.capacity * self._values.itemsize))
+        for timestamp_ns, temperature in self._log.read(self._next_seq, total):
+            self._store(timestamp_ns, temperature)
+
+    def _record(self, timestamp_ns, temperature):
+        # Builds the API representation of a reading
+        return {
+            "device_id": self.device_id,
+            "temperature": temperature,
+            "timestamp": format_timestamp(timestamp_ns)
+        }
+
+    def _store(self, timestamp_ns, temperature):
+        # Must be called with the lock held (or before the store is shared)
+        if self._count == self.capacity and self.cold_bytes:
+            self._seal()
+        slot = self._next_seq % self.capacity
+        if slot == len(self._times):
+            self._times.append(timestamp_ns)
+            self._values.append(temperature)
+        else:
+            self._times[slot] = timestamp_ns
+            self._values[slot] = temperature
+        self._next_seq += 1
+        if self._count < self.capacity:
+            self._count += 1
+
+    def append(self, temperature, timestamp_ns=None):
+        """
+        Adds a reading, evicting the oldest one if the store is full.
+        Without an explicit timestamp the reading is stamped with the current
+        time, at the microsecond resolution of the API's ISO-8601 strings and
+        nudged forward if needed so timestamps stay strictly increasing.
+        Returns the stored record.
+        """
+        with self._lock:
+            timestamp_ns = self._append(temperature, timestamp_ns)
+            self._write_log()
+            if timestamp_ns is None:
+                raise ValueError("Readings must be appended in timestamp order")
+            return self._record(timestamp_ns, self._decode(self._values[(self._next_seq - 1) % self.capacity]))
+
+    def extend(self, readings):
+        """
+        Adds `(temperature, timestamp_ns)` pairs under a single lock acquisition.
+        Readings whose explicit timestamp is not newer than the newest stored
+        reading are skipped. Returns the timestamps the readings were stored
+        with, with None in place of every skipped reading.
+        """
+        with self._lock:
+            stored = [self._append(temperature, timestamp_ns) for temperature, timestamp_ns in readings]
+            self._write_log()
+            return stored
+
+    def _append(self, temperature, timestamp_ns):
+        # Must be called with the lock held. Returns the reading's timestamp,
+        # or None for out-of-order readings.
+        last = self._times[(self._next_seq - 1) % self.capacity] if self._count else None
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns() // 1000 * 1000
+            if last is not None and timestamp_ns <= last:
+                timestamp_ns = last + 1000
+        elif last is not None and timestamp_ns <= last:
+            return None
+        temperature = float(temperature)
+        self._store(timestamp_ns, temperature)
+        if self._log is not None:
+            self._unlogged.append((timestamp_ns, temperature))
+        for listener in self._listeners:
+            listener(timestamp_ns, temperature, self.device_id)
+        return timestamp_ns
+
+    def _seal(self):
+        # Compresses the oldest chunk_size hot readings into a cold chunk,
+        # freeing their slots, and drops the oldest chunks over the budget
+        count = self.chunk_size
+        first_seq = self._next_seq - self._count
+        slots = [(first_seq + i) % self.capacity for i in range(count)]
+        # Chunks keep whole microseconds, the API's resolution; the chunk bounds
+        # are truncated the same way so that they agree with the decoded timestamps
+        micros = [self._times[slot] // 1000 for slot in slots]
+        data = encode_chunk(micros, [self._values[slot] for slot in slots])
+        first_ns, last_ns = micros[0] * 1000, micros[-1] * 1000
+        self._chunks.append(_Chunk(first_seq, count, first_ns, last_ns, data))
+        self._chunk_firsts.append(first_seq)
+        self._chunk_lasts.append(last_ns)
+        self._cold_used += len(data)
+        self._cold_count += count
+        self._count -= count
+        while self._cold_used > self.cold_bytes:
+            dropped = self._chunks.pop(0)
+            del self._chunk_firsts[0], self._chunk_lasts[0]
+            self._decoded.pop(dropped.first_seq, None)
+            self._cold_used -= len(dropped.data)
+            self._cold_count -= dropped.count
+
+    def _decode_chunk(self, chunk):
+        # Returns (timestamps_ns, values) of a chunk, caching recent decodes
+        decoded = self._decoded.get(chunk.first_seq)
+        if decoded is None:
+            micros, values = decode_chunk(chunk.data, chunk.count)
+            decoded = ([t * 1000 for t in micros], values)
+            self._decoded[chunk.first_seq] = decoded
+            if len(self._decoded) > _DECODED_CHUNK_CACHE:
+                self._decoded.popitem(last=False)
+        else:
+            self._decoded.move_to_end(chunk.first_seq)
+        return decoded
+
+    def _write_log(self):
+        # Must be called with the lock held
+        if self._unlogged:
+            self._log.append_many(self._unlogged)
+            self._unlogged.clear()
+
+    def sync(self):
+        """Forces buffered readings to disk; a no-op without a log."""
+        if self._log is not None:
+            with self._lock:
+                self._log.sync()
+
+    def latest(self):
+        """Returns the newest reading, or None if there is none. O(1)."""
+        with self._lock:
+            if not self._count:
+                return None
+            slot = (self._next_seq - 1) % self.capacity
+            return self._record(self._times[slot], self._decode(self._values[slot]))
+
+    def latest_timestamp(self):
+        """Returns the timestamp of the newest reading, or None if there is none."""
+        with self._lock:
+            return self._times[(self._next_seq - 1) % self.capacity] if self._count else None
+
+    def newest(self, limit=None):
+        """Returns up to `limit` readings (all of them by default), newest first."""
+        records, _ = self.query(limit=limit)
+        return records
+
+    def query(self, since_ns=None, until_ns=None, limit=None, newest_first=True, cursor=None):
+        """
+        Returns `(records, next_cursor)` for readings with
+        `since_ns < timestamp <= until_ns`, at most `limit` of them.
+        `cursor` is the sequence number a previous call returned as
+        `next_cursor`; it is None once there are no more matching readings.
+        """
+        with self._lock:
+            lo, hi = self._bounds(since_ns, until_ns)
+            if cursor is not None:
+                if newest_first:
+                    hi = min(hi, cursor)
+                else:
+                    lo = max(lo, cursor)
+            available = max(0, hi - lo)
+            count = available if limit is None else min(limit, available)
+            if newest_first:
+                entries = self._read(hi - count, hi, reverse=True)
+                next_cursor = hi - count if count < available else None
+            else:
+                entries = self._read(lo, lo + count)
+                next_cursor = lo + count if count < available else None
+        return [record for _, record in entries], next_cursor
+
+    def scan(self, since_ns=None, until_ns=None, newest_first=True, cursor=None):
+        """
+        Lazily yields `(timestamp_ns, record)` for readings with
+        `since_ns < timestamp <= until_ns`, resuming at `cursor` (see query())
+        if given. The lock is only held while a chunk is copied, so a slow
+        consumer never blocks ingest.
+        """
+        with self._lock:
+            lo, hi = self._bounds(since_ns, until_ns)
+        if cursor is not None:
+            if newest_first:
+                hi = min(hi, cursor)
+            else:
+                lo = max(lo, cursor)
+        chunk = _SCAN_FIRST_CHUNK
+        while lo < hi:
+            with self._lock:
+                if newest_first:
+                    start = max(lo, hi - chunk)
+                    entries = self._read(start, hi, reverse=True)
+                    hi = start
+                else:
+                    stop = min(hi, lo + chunk)
+                    entries = self._read(lo, stop)
+                    lo = stop
+            yield from entries
+            chunk = min(chunk * 2, _SCAN_MAX_CHUNK)
+
+    def _oldest_seq(self):
+        # Sequence number of the oldest reading held in memory
+        return self._chunks[0].first_seq if self._chunks else self._next_seq - self._count
+
+    def _bounds(self, since_ns, until_ns):
+        # Sequence range [lo, hi) of the readings in (since_ns, until_ns]
+        lo = 0 if self._log is not None else self._oldest_seq()
+        hi = self._next_seq
+        if since_ns is not None:
+            lo = self._find(since_ns)
+        if until_ns is not None:
+            hi = self._find(until_ns)
+        return lo, hi
+
+    def _find(self, timestamp_ns):
+        # Sequence number of the first reading newer than `timestamp_ns`
+        first_seq = self._next_seq - self._count
+        index = _TimeIndex(self._times, self.capacity, first_seq, self._count)
+        if self._count and timestamp_ns >= index[0]:
+            return first_seq + bisect.bisect_right(index, timestamp_ns)
+        if self._chunks and timestamp_ns >= self._chunks[0].first_ns:
+            i = bisect.bisect_right(self._chunk_lasts, timestamp_ns)
+            if i == len(self._chunks):
+                return first_seq
+            chunk = self._chunks[i]
+            times, _ = self._decode_chunk(chunk)
+            return chunk.first_seq + bisect.bisect_right(times, timestamp_ns)
+        if self._log is not None:
+            return self._log.find(timestamp_ns)
+        return self._oldest_seq()
+
+    def _read(self, start, stop, reverse=False):
+        # (timestamp_ns, record) pairs for sequence numbers in [start, stop);
+        # readings that have left memory come from the log, if there is one
+        first_seq = self._next_seq - self._count
+        cold_seq = self._oldest_seq()
+        entries = []
+        if start < cold_seq and self._log is not None:
+            entries = [(timestamp_ns, self._record(timestamp_ns, temperature))
+                       for timestamp_ns, temperature in self._log.read(start, min(stop, cold_seq))]
+        decode = self._decode
+        if start < first_seq and self._chunks:
+            i = max(0, bisect.bisect_right(self._chunk_firsts, start) - 1)
+            while i < len(self._chunks) and self._chunks[i].first_seq < min(stop, first_seq):
+                chunk = self._chunks[i]
+                times, values = self._decode_chunk(chunk)
+                lo = max(start, chunk.first_seq) - chunk.first_seq
+                hi = min(stop, chunk.first_seq + chunk.count) - chunk.first_seq
+                entries.extend((times[j], self._record(times[j], decode(values[j]))) for j in range(lo, hi))
+                i += 1
+        times, values = self._times, self._values
+        for seq in range(max(start, first_seq), stop):
+            slot = seq % self.capacity
+            timestamp_ns = times[slot]
+            entries.append((timestamp_ns, self._record(timestamp_ns, decode(values[slot]))))
+        if reverse:
+            entries.reverse()
+        return entries
+
+
+class PartitionedStore:
+    """
+    The device registry: one ReadingStore partition per device, created on the
+    first reading from that device. Device-scoped queries only touch their own
+    partition; queries across all devices merge the partitions lazily by
+    (timestamp, device_id), so they only read the readings they return.
+
+    `make_log(device_id)` returns the SegmentLog for a device's partition, or
+    None to keep it in memory only. Other keyword arguments are passed on to
+    every ReadingStore.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, make_log=None, max_devices=DEFAULT_MAX_DEVICES,
+                 **store_options):
+        self.capacity = capacity
+        self.max_devices = max_devices
+        self._store_options = store_options
+        self._make_log = make_log
+        self._partitions = {}
+        self._listeners = []
+        self._lock = threading.Lock()
+        self._latest = None  # (timestamp_ns, device_id) of the newest reading overall
+        self._latest_lock = threading.Lock()
+
+    def __len__(self):
+        return sum(len(partition) for partition in list(self._partitions.values()))
+
+    @property
+    def nbytes(self):
+        """Bytes held by the in-memory columns of all partitions."""
+        return sum(partition.nbytes for partition in list(self._partitions.values()))
+
+    def add_listener(self, listener):
+        """Registers `listener(timestamp_ns, temperature, device_id)` on every partition."""
+        with self._lock:
+            self._listeners.append(listener)
+            for partition in self._partitions.values():
+                partition.add_listener(listener)
+
+    def devices(self):
+        """Returns the registered device ids, sorted."""
+        return sorted(self._partitions)
+
+    def partition(self, device_id, create=False):
+        """
+        Returns the partition of `device_id`, creating it if `create` is set.
+        Returns None for unknown devices; raises ValueError when creating one
+        would exceed `max_devices`.
+        """
+        partition = self._partitions.get(device_id)
+        if partition is not None or not create:
+            return partition
+        with self._lock:
+            partition = self._partitions.get(device_id)
+            if partition is None:
+                if len(self._partitions) >= self.max_devices:
+                    raise ValueError("Too many devices")
+                log = self._make_log(device_id) if self._make_log else None
+                partition = ReadingStore(self.capacity, log=log, device_id=device_id, **self._store_options)
+                timestamp_ns = partition.latest_timestamp()
+                if timestamp_ns is not None:
+                    self._track_latest(timestamp_ns, None, device_id)
+                partition.add_listener(self._track_latest)
+                for listener in self._listeners:
+                    partition.add_listener(listener)
+                self._partitions[device_id] = partition
+            return partition
+
+    def _track_latest(self, timestamp_ns, temperature, device_id):
+        # Partition listener remembering which device holds the newest reading
+        with self._latest_lock:
+            if self._latest is None or timestamp_ns >= self._latest[0]:
+                self._latest = (timestamp_ns, device_id)
+
+    def append(self, temperature, timestamp_ns=None, device_id=None):
+        """Adds a reading to its device's partition. See ReadingStore.append()."""
+        return self.partition(device_id or DEFAULT_DEVICE_ID, create=True).append(temperature, timestamp_ns)
+
+    def extend(self, readings):
+        """
+        Adds `(temperature, timestamp_ns, device_id)` tuples, with one lock
+        acquisition per device. Returns the stored timestamps in input order,
+        with None for readings that were out of order for their device.
+        Raises ValueError if a new device cannot be registered.
+        """
+        by_device = {}
+        for i, (temperature, timestamp_ns, device_id) in enumerate(readings):
+            by_device.setdefault(device_id or DEFAULT_DEVICE_ID, []).append((i, temperature, timestamp_ns))
+        stored = [None] * len(readings)
+        for device_id, rows in by_device.items():
+            timestamps = self.partition(device_id, create=True).extend((t, ts) for _, t, ts in rows)
+            for (i, _, _), timestamp_ns in zip(rows, timestamps):
+                stored[i] = timestamp_ns
+        return stored
+
+    def sync(self):
+        for partition in list(self._partitions.values()):
+            partition.sync()
+
+    def latest(self, device_id=None):
+        """
+        Returns the newest reading of one device, or of all devices if none is
+        given, or None if there is no such reading. O(1) either way.
+        """
+        if device_id is None:
+            latest = self._latest
+            if latest is None:
+                return None
+            device_id = latest[1]
+        partition = self._partitions.get(device_id)
+        return partition.latest() if partition is not None else None
+
+    def query(self, since_ns=None, until_ns=None, limit=None, newest_first=True, cursor=None, device_id=None):
+        """
+        Returns `(records, next_cursor)` like ReadingStore.query(). With a
+        `device_id` only that partition is read and the cursor is its sequence
+        number; otherwise the cursor is the `(timestamp_ns, device_id)` of the
+        last reading returned.
+        """
+        if device_id is not None:
+            partition = self._partitions.get(device_id)
+            if partition is None:
+                return [], None
+            return partition.query(since_ns, until_ns, limit, newest_first, cursor)
+
+        merged = self.scan(since_ns, until_ns, newest_first, cursor)
+        records, last = [], None
+        for timestamp_ns, record in merged:
+            if limit is not None and len(records) == limit:
+                return records, (last, records[-1]["device_id"])
+            records.append(record)
+            last = timestamp_ns
+        return records, None
+
+    def scan(self, since_ns=None, until_ns=None, newest_first=True, cursor=None, device_id=None):
+        """
+        Lazily yields `(timestamp_ns, record)` across all devices, ordered by
+        timestamp and then device id, resuming after `cursor` if given.
+        With a `device_id` only that partition is scanned, as in query().
+        """
+        if device_id is not None:
+            partition = self._partitions.get(device_id)
+            return partition.scan(since_ns, until_ns, newest_first, cursor) if partition is not None else iter(())
+
+        streams = []
+        for device_id, partition in list(self._partitions.items()):
+            lo, hi = since_ns, until_ns
+            if cursor is not None:
+                # Skip everything up to and including the cursor's reading
+                cursor_ns, cursor_device = cursor
+                if newest_first:
+                    bound = cursor_ns if device_id < cursor_device else cursor_ns - 1
+                    hi = bound if hi is None else min(hi, bound)
+                else:
+                    bound = cursor_ns - 1 if device_id > cursor_device else cursor_ns
+                    lo = bound if lo is None else max(lo, bound)
+            streams.append(partition.scan(lo, hi, newest_first))
+        return heapq.merge(*streams, key=lambda entry: (entry[0], entry[1]["device_id"]), reverse=newest_first)
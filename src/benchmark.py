@@ -0,0 +1,315 @@
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+import numpy as np
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Load-test harness for the Data Service and the Control Service.
+# It starts both services (or uses already running ones), then drives a mix of
+# endpoints each at its own fixed rate. The load is open-loop: requests are
+# sent on schedule whether or not earlier ones have completed, and latency is
+# measured from the scheduled send time, so a slow server shows up as latency
+# instead of quietly lowering the load (no coordinated omission).
+# Throughput and p50/p95/p99/p99.9 latency per endpoint and the services'
+# resident memory over time are written to a JSON results file.
+# Given the results file of an earlier run, it compares the two and exits
+# with status 1 if any endpoint regressed.
+#
+#   python benchmark.py                      # run, write benchmark_results.json
+#   python benchmark.py baseline.json        # run and compare with baseline.json
+
+DATA_SERVICE_URL = "http://127.0.0.1:5001"
+CONTROL_SERVICE_URL = "http://127.0.0.1:5002"
+
+# Requests per second per endpoint, e.g. "ingest=200,history=50,state=100"
+BENCH_RATES = os.getenv("BENCH_RATES", "ingest=200,history=50,state=100")
+BENCH_DURATION = float(os.getenv("BENCH_DURATION", "30"))
+BENCH_WARMUP = float(os.getenv("BENCH_WARMUP", "5"))      # Seconds of results discarded at the start
+BENCH_DEVICES = int(os.getenv("BENCH_DEVICES", "100"))    # Device ids the load is spread over
+BENCH_HISTORY_LIMIT = int(os.getenv("BENCH_HISTORY_LIMIT", "100"))
+BENCH_CONNECTIONS = int(os.getenv("BENCH_CONNECTIONS", "256"))
+BENCH_TIMEOUT = float(os.getenv("BENCH_TIMEOUT", "10"))
+BENCH_RSS_INTERVAL = float(os.getenv("BENCH_RSS_INTERVAL", "1"))
+BENCH_OUTPUT = os.getenv("BENCH_OUTPUT", "benchmark_results.json")
+# Set to 0 to benchmark services that are already running
+BENCH_START_SERVICES = os.getenv("BENCH_START_SERVICES", "1") != "0"
+# Services are started as they are deployed, not on Flask's debug server: with
+# SERVING_MODE=flask (the default) under gunicorn with this many threads, as in
+# the Docker images; with SERVING_MODE=asgi under uvicorn; and with
+# DATA_WORKERS > 1 the Data Service runs its own worker processes.
+BENCH_GUNICORN_THREADS = int(os.getenv("BENCH_GUNICORN_THREADS", "8"))
+SERVING_MODE = os.getenv("SERVING_MODE", "flask")
+DATA_WORKERS = int(os.getenv("DATA_WORKERS", "1"))
+# Allowed increase, in percent, of an endpoint's p99 latency or error rate over the baseline
+BENCH_MAX_REGRESSION = float(os.getenv("BENCH_MAX_REGRESSION", "20"))
+
+# Service -> (module, port, URL polled until it is up)
+SERVICES = {
+    "data_service": ("data_service", 5001, DATA_SERVICE_URL + "/data/latest"),
+    "control_service": ("control_service", 5002, CONTROL_SERVICE_URL + "/controller"),
+}
+PERCENTILES = {"p50": 50, "p95": 95, "p99": 99, "p999": 99.9}
+
+
+def device_id():
+    return f"bench-{random.randrange(BENCH_DEVICES):04d}"
+
+
+# Endpoint name -> function returning (method, url, params, json body) for one request
+ENDPOINTS = {
+    "ingest": lambda: ("POST", DATA_SERVICE_URL + "/data", None,
+                       {"device_id": device_id(), "temperature": round(random.uniform(15, 30), 2)}),
+    "history": lambda: ("GET", DATA_SERVICE_URL + "/data",
+                        {"device_id": device_id(), "limit": str(BENCH_HISTORY_LIMIT)}, None),
+    "latest": lambda: ("GET", DATA_SERVICE_URL + "/data/latest", {"device_id": device_id()}, None),
+    "state": lambda: ("GET", CONTROL_SERVICE_URL + "/state", {"device_id": device_id()}, None),
+}
+
+
+def parse_rates(value):
+    """Parses "name=rate,..." into {name: requests per second}. Raises ValueError."""
+    rates = {}
+    for part in value.split(","):
+        name, _, rate = part.strip().partition("=")
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint {name!r}; expected one of {', '.join(ENDPOINTS)}")
+        rates[name] = float(rate)
+        if not rates[name] > 0:
+            raise ValueError(f"Invalid rate for {name!r}")
+    return rates
+
+
+def process_group_rss(pgid):
+    """Returns the resident memory in bytes of all processes in group `pgid` (Linux only), or None."""
+    total, found = 0, False
+    page_size = os.sysconf("SC_PAGE_SIZE")
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return None
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            if int(fields[2]) != pgid:
+                continue
+            with open(f"/proc/{pid}/statm") as f:
+                total += int(f.read().split()[1]) * page_size
+            found = True
+        except (OSError, IndexError, ValueError):
+            continue  # The process exited meanwhile
+    return total if found else None
+
+
+def service_command(module, port):
+    """The command that serves `module` on `port` the way it is deployed."""
+    if SERVING_MODE == "asgi" or (module == "data_service" and DATA_WORKERS > 1):
+        # The script serves itself with uvicorn, or with the worker processes of workers.py
+        return [sys.executable, module + ".py"]
+    # One gunicorn worker: each process would otherwise hold its own readings and state
+    return [sys.executable, "-m", "gunicorn", "--bind", f"0.0.0.0:{port}", "--workers", "1",
+            "--threads", str(BENCH_GUNICORN_THREADS), f"{module}:app"]
+
+
+def start_services():
+    """Starts the services, each in its own process group so its children can be measured and stopped too. Returns {name: Popen}."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    processes = {}
+    for name, (module, port, _) in SERVICES.items():
+        processes[name] = subprocess.Popen(service_command(module, port), cwd=here, start_new_session=True,
+                                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return processes
+
+
+def stop_services(processes):
+    for process in processes.values():
+        try:
+            os.killpg(process.pid, 15)
+        except ProcessLookupError:
+            pass
+        process.wait()
+
+
+async def wait_until_ready(session, timeout=30.0):
+    deadline = time.monotonic() + timeout
+    for name, (_, _, url) in SERVICES.items():
+        while True:
+            try:
+                async with session.get(url) as response:
+                    await response.read()
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"{name} did not start within {timeout:.0f} seconds")
+                await asyncio.sleep(0.2)
+
+
+class _Results:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+
+
+async def _send(session, endpoint, scheduled, measure_from, results):
+    method, url, params, body = ENDPOINTS[endpoint]()
+    try:
+        async with session.request(method, url, params=params, json=body) as response:
+            await response.read()
+            status = str(response.status)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        status = type(e).__name__
+    latency = asyncio.get_running_loop().time() - scheduled
+    if scheduled >= measure_from:
+        results.statuses[status] = results.statuses.get(status, 0) + 1
+        if status.startswith(("2", "3")):
+            results.latencies.append(latency)
+        else:
+            results.errors += 1
+
+
+async def _drive(session, endpoint, rate, start, end, measure_from, results, pending):
+    # Open loop: the n-th request is due at start + n / rate, however long earlier ones take
+    loop = asyncio.get_running_loop()
+    n = 0
+    while True:
+        scheduled = start + n / rate
+        if scheduled >= end:
+            return
+        delay = scheduled - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        task = asyncio.create_task(_send(session, endpoint, scheduled, measure_from, results))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+        n += 1
+
+
+async def _sample_rss(processes, start, samples):
+    loop = asyncio.get_running_loop()
+    while True:
+        elapsed = round(loop.time() - start, 3)
+        for name, process in processes.items():
+            rss = process_group_rss(process.pid)
+            if rss is not None:
+                samples.setdefault(name, []).append([elapsed, rss])
+        await asyncio.sleep(BENCH_RSS_INTERVAL)
+
+
+def summarize(rate, results, seconds):
+    latencies = np.array(results.latencies) * 1000
+    summary = {
+        "target_rate": rate,
+        "requests": sum(results.statuses.values()),
+        "errors": results.errors,
+        "throughput": round(len(latencies) / seconds, 2),
+        "statuses": results.statuses,
+        "latency_ms": None,
+    }
+    if len(latencies):
+        summary["latency_ms"] = {name: round(float(np.percentile(latencies, q)), 3) for name, q in PERCENTILES.items()}
+        summary["latency_ms"]["mean"] = round(float(latencies.mean()), 3)
+        summary["latency_ms"]["max"] = round(float(latencies.max()), 3)
+    return summary
+
+
+async def run(rates, processes):
+    """Runs the benchmark and returns the results document."""
+    started_at = datetime.now(timezone.utc).isoformat()
+    connector = aiohttp.TCPConnector(limit=BENCH_CONNECTIONS)
+    timeout = aiohttp.ClientTimeout(total=BENCH_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        await wait_until_ready(session)
+        loop = asyncio.get_running_loop()
+        start = loop.time() + 0.1
+        end = start + BENCH_WARMUP + BENCH_DURATION
+        measure_from = start + BENCH_WARMUP
+        results = {endpoint: _Results() for endpoint in rates}
+        rss, pending = {}, set()
+        sampler = asyncio.create_task(_sample_rss(processes, start, rss))
+        await asyncio.gather(*(_drive(session, endpoint, rate, start, end, measure_from, results[endpoint], pending)
+                               for endpoint, rate in rates.items()))
+        if pending:
+            await asyncio.wait(pending)
+        sampler.cancel()
+
+    return {
+        "started_at": started_at,
+        "config": {"rates": rates, "duration": BENCH_DURATION, "warmup": BENCH_WARMUP, "devices": BENCH_DEVICES,
+                   "history_limit": BENCH_HISTORY_LIMIT, "connections": BENCH_CONNECTIONS,
+                   "serving_mode": SERVING_MODE, "data_workers": DATA_WORKERS,
+                   "gunicorn_threads": BENCH_GUNICORN_THREADS},
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpus": os.cpu_count()},
+        "endpoints": {endpoint: summarize(rate, results[endpoint], BENCH_DURATION) for endpoint, rate in rates.items()},
+        "rss_bytes": rss,
+    }
+
+
+def compare(baseline, current):
+    """Prints how `current` differs from `baseline` per endpoint. Returns the endpoints that regressed."""
+    regressed = []
+    limit = 1 + BENCH_MAX_REGRESSION / 100
+    for endpoint, now in current["endpoints"].items():
+        before = baseline.get("endpoints", {}).get(endpoint)
+        if before is None or not before.get("latency_ms") or not now["latency_ms"]:
+            continue
+        p99_before, p99_now = before["latency_ms"]["p99"], now["latency_ms"]["p99"]
+        errors_before = before["errors"] / max(before["requests"], 1)
+        errors_now = now["errors"] / max(now["requests"], 1)
+        worse = p99_now > p99_before * limit or errors_now > errors_before * limit + 0.001
+        print(f"BENCHMARK: {endpoint}: p99 {p99_before:.2f} -> {p99_now:.2f} ms, "
+              f"errors {errors_before:.2%} -> {errors_now:.2%}{'  REGRESSED' if worse else ''}")
+        if worse:
+            regressed.append(endpoint)
+    return regressed
+
+
+def report(results):
+    for endpoint, summary in results["endpoints"].items():
+        latency = summary["latency_ms"]
+        percentiles = ", ".join(f"{name} {latency[name]:.2f}" for name in PERCENTILES) if latency else "no responses"
+        print(f"BENCHMARK: {endpoint}: {summary['throughput']:.1f}/s of {summary['target_rate']:g}/s, "
+              f"{summary['errors']} errors, latency ms {percentiles}")
+    for name, samples in results["rss_bytes"].items():
+        peak = max(rss for _, rss in samples)
+        print(f"BENCHMARK: {name}: RSS {samples[0][1] / 2**20:.1f} MiB at start, {peak / 2**20:.1f} MiB peak")
+
+
+if __name__ == "__main__":
+    if aiohttp is None:
+        sys.exit("BENCHMARK: The benchmark needs aiohttp: pip install aiohttp")
+    try:
+        rates = parse_rates(BENCH_RATES)
+    except ValueError as e:
+        sys.exit(f"BENCHMARK: {e}")
+    baseline = None
+    if len(sys.argv) > 1:
+        with open(sys.argv[1]) as f:
+            baseline = json.load(f)
+
+    processes = start_services() if BENCH_START_SERVICES else {}
+    print(f"--- Benchmark: {BENCH_WARMUP:g} s warm-up, then {BENCH_DURATION:g} s at {BENCH_RATES} ---")
+    try:
+        results = asyncio.run(run(rates, processes))
+    except RuntimeError as e:
+        sys.exit(f"BENCHMARK: {e}")
+    finally:
+        stop_services(processes)
+
+    with open(BENCH_OUTPUT, "w") as f:
+        json.dump(results, f, indent=2)
+    report(results)
+    print(f"BENCHMARK: Results written to {BENCH_OUTPUT}")
+    if baseline is not None and compare(baseline, results):
+        sys.exit(1)
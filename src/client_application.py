@@ -1,13 +1,28 @@
-from flask import Flask, render_template_string
+import os
+import requests
+from flask import Flask, Response, jsonify, render_template_string, request
+import http_client
+from metrics import instrument_app
+from static_assets import StaticAsset, serve_asset
 
 # This is the user-facing web application.
 # It provides a dashboard to see the current state and control the target temperature.
 # It runs on the default Flask port, 5000.
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None)  # Assets are served from memory, see below
+instrument_app(app)  # Request counts and latencies, served at GET /metrics
 
-# The entire front-end is contained in this single HTML string.
-# It uses Tailwind CSS for styling and vanilla JavaScript for interactivity.
+# The dashboard loads its history through GET /api/history, which asks the Data Service.
+DATA_SERVICE_HISTORY_URL = "http://127.0.0.1:5001/data"
+CLIENT_FETCH_TIMEOUT = float(os.getenv("CLIENT_FETCH_TIMEOUT", "5.0"))
+# Readings per history request: the default, and the most a request may ask for
+HISTORY_DEFAULT_LIMIT = 1000
+HISTORY_MAX_LIMIT = int(os.getenv("CLIENT_HISTORY_MAX_LIMIT", "5000"))
+HISTORY_PARAMS = ('device_id', 'since', 'until', 'order', 'cursor')
+
+# The page is this HTML string; its stylesheet (a vendored subset of Tailwind
+# CSS) and its vanilla JavaScript are in static/, so nothing is loaded from a CDN.
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
 HTML_TEMPLATE = """
 <!DOCTYPE html>
 <html lang="en">
@@ -15,13 +30,8 @@ HTML_TEMPLATE = """
     <meta charset="UTF-8">
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>IoT Temperature Control</title>
-    <script src="https://cdn.tailwindcss.com"></script>
-    <style>
-        body { font-family: 'Inter', sans-serif; }
-        @import url('https://rsms.me/inter/inter.css');
-        .temp-display { font-size: 5rem; line-height: 1; font-weight: 700; }
-        .status-dot { width: 12px; height: 12px; }
-    </style>
+    <link rel="stylesheet" href="{{ stylesheet_url }}">
+    <script src="{{ script_url }}" defer></script>
 </head>
 <body class="bg-gray-100 text-gray-800">
 
@@ -67,132 +77,71 @@ HTML_TEMPLATE = """
             <div class="bg-white rounded-xl shadow-md p-6">
                 <div class="flex justify-between items-center mb-4">
                     <h2 class="text-xl font-semibold">History</h2>
-                    <button onclick="fetchHistory()" class="text-sm text-blue-600 hover:underline">Refresh</button>
+                    <button onclick="syncHistory()" class="text-sm text-blue-600 hover:underline">Refresh</button>
                 </div>
-                <div id="history-container" class="space-y-2 max-h-80 overflow-y-auto pr-2">
-                    <p class="text-gray-500">No historical data loaded.</p>
+                <div id="history-container" class="relative h-80 overflow-y-auto pr-2">
+                    <p id="history-message" class="text-gray-500">No historical data loaded.</p>
+                    <div id="history-rows" class="relative"></div>
                 </div>
             </div>
         </main>
     </div>
-
-    <script>
-        const CONTROL_API_URL = 'http://127.0.0.1:5002';
-        const DATA_API_URL = 'http://127.0.0.1:5001';
-
-        const currentTempEl = document.getElementById('current-temp');
-        const targetTempEl = document.getElementById('target-temp');
-        const statusDotEl = document.getElementById('status-dot');
-        const statusTextEl = document.getElementById('status-text');
-        const historyContainerEl = document.getElementById('history-container');
-        const errorMessageEl = document.getElementById('error-message');
-
-        // Fetch the current state from the control service
-        async function fetchCurrentState() {
-            try {
-                const response = await fetch(`${CONTROL_API_URL}/state`);
-                if (!response.ok) throw new Error('Network response was not ok');
-                const data = await response.json();
-
-                // Update current temperature display
-                if (data.current_temperature !== null) {
-                    currentTempEl.textContent = `${data.current_temperature.toFixed(1)} °C`;
-                    statusDotEl.classList.remove('bg-gray-400', 'bg-red-500');
-                    statusDotEl.classList.add('bg-green-500');
-                    statusTextEl.textContent = 'Connected';
-                } else {
-                    currentTempEl.textContent = '--.- °C';
-                    statusDotEl.classList.remove('bg-green-500');
-                    statusDotEl.classList.add('bg-red-500');
-                    statusTextEl.textContent = 'No sensor data';
-                }
-
-                // Update target temperature display
-                if (data.target_temperature !== null) {
-                    targetTempEl.textContent = `${data.target_temperature.toFixed(1)} °C`;
-                }
-
-                errorMessageEl.textContent = ''; // Clear previous errors
-            } catch (error) {
-                console.error('Failed to fetch state:', error);
-                statusDotEl.classList.remove('bg-green-500');
-                statusDotEl.classList.add('bg-red-500');
-                statusTextEl.textContent = 'Service Unreachable';
-                errorMessageEl.textContent = 'Error: Could not connect to services. Are they running?';
-            }
-        }
-        
-        // Set a new target temperature
-        async function setTemperature() {
-            const input = document.getElementById('new-temp-input');
-            const newTemp = parseFloat(input.value);
-
-            if (isNaN(newTemp)) {
-                alert('Please enter a valid number.');
-                return;
-            }
-
-            try {
-                const response = await fetch(`${CONTROL_API_URL}/setpoint`, {
-                    method: 'POST',
-                    headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ temperature: newTemp })
-                });
-                if (!response.ok) throw new Error('Failed to set temperature');
-                
-                await response.json();
-                input.value = ''; // Clear input on success
-                fetchCurrentState(); // Refresh state immediately
-            } catch (error) {
-                console.error('Error setting temperature:', error);
-                alert('Failed to set new temperature.');
-            }
-        }
-        
-        // Fetch historical data from the data service
-        async function fetchHistory() {
-            historyContainerEl.innerHTML = '<p class="text-gray-500">Loading history...</p>';
-            try {
-                const response = await fetch(`${DATA_API_URL}/data`);
-                 if (!response.ok) throw new Error('Network response was not ok');
-                const data = await response.json();
-
-                if (data.length === 0) {
-                     historyContainerEl.innerHTML = '<p class="text-gray-500">No historical data found.</p>';
-                     return;
-                }
-
-                let historyHtml = '';
-                data.forEach(record => {
-                    const date = new Date(record.timestamp);
-                    historyHtml += `
-                        <div class="flex justify-between text-sm p-1 rounded">
-                            <span>${record.temperature.toFixed(1)} °C</span>
-                            <span class="text-gray-500">${date.toLocaleTimeString()}</span>
-                        </div>
-                    `;
-                });
-                historyContainerEl.innerHTML = historyHtml;
-            } catch (error) {
-                console.error('Failed to fetch history:', error);
-                historyContainerEl.innerHTML = '<p class="text-red-500">Could not load history.</p>';
-            }
-        }
-        
-        // On page load, fetch initial data and set up polling
-        document.addEventListener('DOMContentLoaded', () => {
-            fetchCurrentState();
-            fetchHistory();
-            setInterval(fetchCurrentState, 5000); // Poll for new state every 5 seconds
-        });
-    </script>
 </body>
 </html>
 """
 
+# The assets are served under URLs containing their hash, so they can be
+# cached forever; the page is rendered once, here, and revalidated by ETag.
+assets = {}  # URL file name -> StaticAsset
+
+def load_asset(filename):
+    """Loads a file from STATIC_DIR and returns its fingerprinted URL."""
+    asset = StaticAsset.from_file(os.path.join(STATIC_DIR, filename))
+    stem, extension = os.path.splitext(filename)
+    name = f"{stem}.{asset.digest[:12]}{extension}"
+    assets[name] = asset
+    return f"/assets/{name}"
+
+with app.app_context():
+    dashboard_page = StaticAsset(render_template_string(HTML_TEMPLATE,
+                                                        stylesheet_url=load_asset("dashboard.css"),
+                                                        script_url=load_asset("dashboard.js")).encode(),
+                                 "text/html; charset=utf-8")
+
 @app.route('/')
 def index():
-    return render_template_string(HTML_TEMPLATE)
+    return serve_asset(dashboard_page)
+
+@app.route('/assets/<name>')
+def static_asset(name):
+    asset = assets.get(name)
+    if asset is None:
+        return jsonify({"error": "Unknown asset"}), 404
+    return serve_asset(asset)
+
+@app.route('/api/history', methods=['GET'])
+def history():
+    """
+    Answers the dashboard's history queries from the Data Service.
+    'since', 'until', 'order', 'cursor' and 'device_id' are passed on and
+    'limit' is capped at HISTORY_MAX_LIMIT; the X-Next-Cursor header of the
+    answer is kept, so pages can be followed.
+    """
+    params = {name: request.args[name] for name in HISTORY_PARAMS if request.args.get(name)}
+    try:
+        limit = int(request.args.get('limit', HISTORY_DEFAULT_LIMIT))
+    except ValueError:
+        return jsonify({"error": "'limit' must be an integer"}), 400
+    params["limit"] = max(1, min(limit, HISTORY_MAX_LIMIT))
+    try:
+        upstream = http_client.get(DATA_SERVICE_HISTORY_URL, params=params, timeout=CLIENT_FETCH_TIMEOUT)
+    except requests.exceptions.RequestException as e:
+        print(f"Client Application: Could not connect to Data Service: {e}")
+        return jsonify({"error": "Data Service unreachable"}), 502
+    response = Response(upstream.content, status=upstream.status_code, mimetype="application/json")
+    if "X-Next-Cursor" in upstream.headers:
+        response.headers["X-Next-Cursor"] = upstream.headers["X-Next-Cursor"]
+    return response
 
 if __name__ == '__main__':
     # This service runs on port 5000
@@ -0,0 +1,248 @@
+import math
+import threading
+import time
+import numpy as np
+
+# Closed-loop temperature control for many zones (one zone per device).
+# Every zone's state lives in parallel NumPy arrays, so one tick evaluates all
+# zones with a handful of vector operations instead of a Python loop.
+# Each zone runs either a PID controller or a hysteresis (on/off) thermostat;
+# its command is an output in [-1, 1]: positive heats, negative cools.
+
+MODES = ("pid", "hysteresis")
+PID, HYSTERESIS = range(len(MODES))
+
+DEFAULT_GAINS = {"kp": 0.5, "ki": 0.01, "kd": 0.0}
+DEFAULT_BAND = 0.5           # Hysteresis half-width in °C
+INTEGRAL_LIMIT = 100.0       # Anti-windup bound on the integral term, in °C·s
+IDLE_OUTPUT = 0.01           # Outputs smaller than this are reported as "idle"
+_ACTIONS = np.array(["cool", "idle", "heat"], dtype=object)
+_INITIAL_CAPACITY = 1024
+
+
+class ZoneController:
+    """
+    Per-zone controllers evaluated together by tick().
+    - update_temperature() records a zone's latest reading, adding the zone if needed.
+    - configure() sets a zone's mode, gains, band and optional own setpoint;
+      zones without one follow the setpoint passed to tick().
+    - commands() returns the outputs of the last tick.
+    Zones whose reading is older than `reading_timeout` seconds are idled.
+    """
+
+    def __init__(self, reading_timeout=60.0):
+        self.reading_timeout = reading_timeout
+        self._index = {}  # zone_id -> row
+        self._zone_ids = []
+        self._lock = threading.Lock()
+        self._allocate(_INITIAL_CAPACITY)
+        self.ticks = 0
+        self.last_tick_seconds = 0.0
+        self._all_commands = None  # (ticks, zone count, commands of all zones), built once per tick
+
+    def _allocate(self, capacity):
+        def grow(name, fill, dtype=np.float64):
+            array = np.full(capacity, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                array[:len(old)] = old
+            setattr(self, name, array)
+
+        grow("_temperature", np.nan)
+        grow("_updated_at", -np.inf)
+        grow("_setpoint", np.nan)  # NaN: follow the setpoint given to tick()
+        grow("_mode", PID, np.int8)
+        grow("_kp", DEFAULT_GAINS["kp"])
+        grow("_ki", DEFAULT_GAINS["ki"])
+        grow("_kd", DEFAULT_GAINS["kd"])
+        grow("_band", DEFAULT_BAND)
+        grow("_integral", 0.0)
+        grow("_previous_error", np.nan)
+        grow("_relay", 0.0)  # Hysteresis state: 1 heating, -1 cooling, 0 off
+        grow("_output", 0.0)
+        grow("_target", np.nan)
+
+    def _row(self, zone_id):
+        # Returns the zone's row, adding the zone if it is new. Called with the lock held.
+        row = self._index.get(zone_id)
+        if row is None:
+            row = len(self._zone_ids)
+            if row == len(self._temperature):
+                self._allocate(2 * row)
+            self._index[zone_id] = row
+            self._zone_ids.append(zone_id)
+        return row
+
+    def __len__(self):
+        return len(self._zone_ids)
+
+    def zones(self):
+        with self._lock:
+            return list(self._zone_ids)
+
+    def update_temperature(self, zone_id, temperature):
+        with self._lock:
+            row = self._row(zone_id)
+            self._temperature[row] = temperature
+            self._updated_at[row] = time.monotonic()
+
+    def configure(self, zone_id, mode=None, setpoint=None, kp=None, ki=None, kd=None, band=None):
+        """
+        Updates the given settings of a zone, adding it if needed. A setpoint
+        of NaN makes the zone follow the shared setpoint again.
+        Raises ValueError for an unknown mode, non-finite gains or band, a
+        negative band or an infinite setpoint; nothing is changed then.
+        """
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}; expected one of {', '.join(MODES)}")
+        for name, value in (("kp", kp), ("ki", ki), ("kd", kd), ("band", band)):
+            if value is not None and not math.isfinite(value):
+                raise ValueError(f"Invalid {name} {value!r}")
+        if band is not None and band < 0:
+            raise ValueError(f"Invalid band {band!r}; it must not be negative")
+        if setpoint is not None and math.isinf(setpoint):
+            raise ValueError(f"Invalid setpoint {setpoint!r}")
+        with self._lock:
+            row = self._row(zone_id)
+            if mode is not None and MODES.index(mode) != self._mode[row]:
+                self._mode[row] = MODES.index(mode)
+                self._integral[row] = 0.0
+                self._relay[row] = 0.0
+            for array, value in ((self._setpoint, setpoint), (self._kp, kp), (self._ki, ki),
+                                 (self._kd, kd), (self._band, band)):
+                if value is not None:
+                    array[row] = value
+
+    def zone(self, zone_id):
+        """Returns a zone's settings and state, or None if it is unknown."""
+        with self._lock:
+            row = self._index.get(zone_id)
+            if row is None:
+                return None
+            age = time.monotonic() - self._updated_at[row]
+            return {
+                "zone_id": zone_id,
+                "mode": MODES[self._mode[row]],
+                "setpoint": _optional(self._setpoint[row]),
+                "kp": float(self._kp[row]), "ki": float(self._ki[row]), "kd": float(self._kd[row]),
+                "band": float(self._band[row]),
+                "temperature": _optional(self._temperature[row]),
+                "reading_age_seconds": round(float(age), 3) if np.isfinite(age) else None,
+                **_command(self._output[row], self._target[row]),
+            }
+
+    def tick(self, dt, setpoint):
+        """
+        Computes every zone's output from its latest reading. `dt` is the time
+        since the previous tick in seconds; `setpoint` is the target of zones
+        without their own: a number, or a function taking the list of zone ids
+        and returning one value per zone. The list only ever grows, so the
+        function may cache per-zone work between ticks.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            n = len(self._zone_ids)
+            if n:
+                if callable(setpoint):
+                    setpoint = setpoint(self._zone_ids)
+                self._tick(n, dt, setpoint)
+            self.ticks += 1
+        self.last_tick_seconds = time.perf_counter() - started
+
+    def _tick(self, n, dt, setpoint):
+        # Works on views of the first n rows, updating state in place
+        target = self._target[:n]
+        target[:] = setpoint
+        np.copyto(target, self._setpoint[:n], where=~np.isnan(self._setpoint[:n]))
+        valid = self._updated_at[:n] >= time.monotonic() - self.reading_timeout  # False for NaN readings too
+        valid &= self._temperature[:n] == self._temperature[:n]
+        error = target - self._temperature[:n]
+        error[~valid] = 0.0
+
+        # PID, with the integral clamped against wind-up and no derivative kick on the first tick
+        is_pid = self._mode[:n] == PID
+        integral = self._integral[:n]
+        np.add(integral, error * dt, out=integral, where=valid & is_pid)
+        np.clip(integral, -INTEGRAL_LIMIT, INTEGRAL_LIMIT, out=integral)
+        previous = self._previous_error[:n]
+        output = self._kp[:n] * error
+        output += self._ki[:n] * integral
+        if dt > 0:
+            derivative = (error - previous) / dt
+            derivative[np.isnan(derivative)] = 0.0
+            output += self._kd[:n] * derivative
+        np.clip(output, -1.0, 1.0, out=output)
+        previous[:] = error
+        previous[~valid] = np.nan
+
+        # Hysteresis: switch on outside the band, switch off once the setpoint is reached
+        relay = self._relay[:n]
+        band = self._band[:n]
+        relay[error > band] = 1.0
+        relay[error < -band] = -1.0
+        relay[((relay > 0) & (error <= 0)) | ((relay < 0) & (error >= 0)) | ~valid] = 0.0
+
+        np.copyto(output, relay, where=~is_pid)
+        output[~valid] = 0.0
+        self._output[:n] = output
+
+    def commands(self, zone_ids=None):
+        """
+        Returns {zone_id: {"output", "action", "target_temperature"}} from the
+        last tick for the given zones (all zones by default); unknown zones are left out.
+        The commands of all zones are built once per tick and shared between
+        callers, so they must not be modified.
+        """
+        with self._lock:
+            if zone_ids is None:
+                cached = self._all_commands
+                if cached is not None and cached[0] == self.ticks and cached[1] == len(self._zone_ids):
+                    return cached[2]
+                key = (self.ticks, len(self._zone_ids))
+                zone_ids = list(self._zone_ids)
+                rows = slice(0, len(zone_ids))
+            else:
+                key = None
+                zone_ids = [zone_id for zone_id in zone_ids if zone_id in self._index]
+                rows = [self._index[zone_id] for zone_id in zone_ids]
+            outputs = self._output[rows]
+            targets = self._target[rows].tolist()
+        actions = _ACTIONS[(outputs >= IDLE_OUTPUT).astype(np.int8) - (outputs <= -IDLE_OUTPUT) + 1].tolist()
+        commands = {zone_id: {"output": output, "action": action,
+                              "target_temperature": target if target == target else None}  # NaN: no setpoint
+                    for zone_id, output, action, target in zip(zone_ids, outputs.round(4).tolist(), actions, targets)}
+        if key is not None:
+            self._all_commands = key + (commands,)
+        return commands
+
+
+def _optional(value):
+    return None if np.isnan(value) else float(value)
+
+
+def _command(output, target):
+    output = float(output)
+    action = "heat" if output >= IDLE_OUTPUT else "cool" if output <= -IDLE_OUTPUT else "idle"
+    return {"output": round(output, 4), "action": action, "target_temperature": _optional(target)}
+
+
+def run_periodically(controller, period, setpoint):
+    """
+    Ticks `controller` every `period` seconds on fixed-rate deadlines with
+    `setpoint` (see ZoneController.tick()). Ticks that are overrun are skipped
+    rather than queued; a tick that fails is logged and the next one runs
+    as scheduled. Never returns.
+    """
+    previous = time.monotonic()
+    deadline = previous + period
+    while True:
+        time.sleep(max(0.0, deadline - time.monotonic()))
+        now = time.monotonic()
+        try:
+            controller.tick(now - previous, setpoint)
+        except Exception as e:
+            print(f"Control Service: Controller tick failed: {e!r}")
+        previous = now
+        deadline += period
+        if deadline < now:
+            deadline = now + period
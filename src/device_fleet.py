@@ -0,0 +1,220 @@
+import asyncio
+import time
+import numpy as np
+
+try:
+    import aiohttp
+except ImportError:  # Only fleet mode needs it
+    aiohttp = None
+
+# Many simulated devices in one process, for reproducing production scale locally.
+# Every device's room is one element of a few NumPy arrays, so a tick advances
+# the whole fleet with a handful of vector operations.
+# Each device reports once per interval at its own start phase, so the
+# readings are spread evenly over the interval instead of arriving in bursts.
+# The readings that fall due in one tick are posted together to the Data
+# Service's /data/batch over asyncio, with at most `concurrency` requests in flight.
+# Heating/cooling outputs come from the Control Service's /commands; devices it
+# has no command for fall back to a simple local thermostat on the shared target.
+
+DEFAULT_TICK_SECONDS = 0.5
+LOCAL_GAIN = 0.5           # Output per °C of error for devices without a command
+REQUEST_TIMEOUT = 10.0
+
+
+class ThermalModel:
+    """
+    First-order thermal model of n rooms. Each room relaxes towards its own
+    ambient temperature with its own time constant, is heated (or cooled) by
+    its output in [-1, 1] scaled by its own power, and has its own sensor noise.
+    """
+
+    def __init__(self, n, seed=None):
+        rng = self.rng = np.random.default_rng(seed)
+        self.ambient = rng.uniform(10.0, 26.0, n)
+        self.time_constant = rng.uniform(600.0, 3600.0, n)  # Seconds
+        self.power = rng.uniform(0.04, 0.12, n)              # °C per second at full output
+        self.noise = rng.uniform(0.02, 0.1, n)               # Sensor noise standard deviation, °C
+        self.temperature = self.ambient + rng.normal(0.0, 2.0, n)
+        self.output = np.zeros(n)
+
+    def step(self, dt):
+        """Advances every room by `dt` seconds, in place."""
+        temperature = self.temperature
+        temperature -= self.ambient
+        temperature *= np.exp(-dt / self.time_constant)
+        temperature += self.ambient
+        temperature += self.power * self.output * dt
+
+    def readings(self, rows):
+        """Returns what the sensors of the rooms in `rows` read now."""
+        return self.temperature[rows] + self.noise[rows] * self.rng.standard_normal(len(rows))
+
+
+class Fleet:
+    """
+    `size` simulated devices with ids `prefix`00000, `prefix`00001, ...
+    reporting every `interval` seconds, each in one of `interval / tick`
+    phases drawn at random.
+    """
+
+    def __init__(self, size, interval=5.0, tick=DEFAULT_TICK_SECONDS, prefix="sim-", seed=None):
+        self.device_ids = [f"{prefix}{i:05d}" for i in range(size)]
+        self.index = {device_id: row for row, device_id in enumerate(self.device_ids)}
+        self.model = ThermalModel(size, seed)
+        self.interval = interval
+        self.tick = tick
+        slots = max(1, round(interval / tick))
+        phase = self.model.rng.integers(0, slots, size)
+        self.due = [np.flatnonzero(phase == slot) for slot in range(slots)]
+        self.commanded = np.zeros(size, dtype=bool)
+        self.target = None
+        # Each reading is encoded as prefix + temperature + "}", so only the number is formatted per tick
+        self._prefixes = [f'{{"device_id":"{device_id}","temperature":' for device_id in self.device_ids]
+
+    def __len__(self):
+        return len(self.device_ids)
+
+    def apply_commands(self, commands):
+        """Takes the outputs of {device_id: {"output": ...}} from the Control Service's /commands."""
+        rows, outputs = [], []
+        for device_id, command in commands.items():
+            row = self.index.get(device_id)
+            if row is not None and command.get("output") is not None:
+                rows.append(row)
+                outputs.append(command["output"])
+        self.commanded[:] = False
+        self.commanded[rows] = True
+        self.model.output[rows] = outputs
+
+    def step(self, dt):
+        model = self.model
+        local = ~self.commanded
+        if self.target is None:
+            model.output[local] = 0.0
+        else:
+            model.output[local] = np.clip((self.target - model.temperature[local]) * LOCAL_GAIN, -1.0, 1.0)
+        model.step(dt)
+
+    def encode(self, slot, batch_size):
+        """Returns (body, count) for JSON arrays of the readings due in `slot`, at most `batch_size` readings each."""
+        rows = self.due[slot % len(self.due)]
+        temperatures = self.model.readings(rows).round(2).tolist()
+        prefixes = self._prefixes
+        readings = [prefixes[row] + repr(temperature) + "}" for row, temperature in zip(rows.tolist(), temperatures)]
+        return [(("[" + ",".join(readings[i:i + batch_size]) + "]").encode(), len(readings[i:i + batch_size]))
+                for i in range(0, len(readings), batch_size)]
+
+
+class _Stats:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.monotonic()
+        self.readings = self.accepted = self.failed_requests = self.skipped_ticks = 0
+        self.latencies = []
+
+    def report(self, fleet):
+        elapsed = time.monotonic() - self.started
+        if self.latencies:
+            p50, p99 = np.percentile(self.latencies, [50, 99]) * 1000
+            latency = f"p50 {p50:.1f} ms, p99 {p99:.1f} ms"
+        else:
+            latency = "no responses"
+        print(f"SIMULATOR: {len(fleet)} devices, {self.readings / elapsed:.0f} readings/s sent "
+              f"({self.accepted} accepted), {latency}, {self.failed_requests} failed requests, "
+              f"{self.skipped_ticks} ticks skipped, mean temperature {fleet.model.temperature.mean():.2f}°C")
+        self.reset()
+
+
+async def _post_batch(session, url, body, count, stats):
+    started = time.monotonic()
+    try:
+        async with session.post(url, data=body, headers={"Content-Type": "application/json"}) as response:
+            result = await response.json() if response.status == 200 else None
+        stats.latencies.append(time.monotonic() - started)
+        if result is None:
+            stats.failed_requests += 1
+        else:
+            stats.accepted += result.get("accepted", 0)
+    except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+        stats.failed_requests += 1
+        if stats.failed_requests == 1:
+            print(f"SIMULATOR: Could not send batch of {count} readings: {e!r}")
+
+
+async def _follow_controller(session, fleet, commands_url, state_url):
+    # Refreshes every device's output and the shared target once per interval
+    etag = None
+    while True:
+        try:
+            async with session.get(commands_url) as response:
+                if response.status == 200:
+                    fleet.apply_commands((await response.json()).get("commands", {}))
+            headers = {"If-None-Match": etag} if etag else {}
+            async with session.get(state_url, headers=headers) as response:
+                if response.status == 200:
+                    etag = response.headers.get("ETag")
+                    fleet.target = (await response.json()).get("target_temperature")
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            print(f"SIMULATOR: Could not get commands: {e!r}")
+        await asyncio.sleep(fleet.interval)
+
+
+async def run(fleet, batch_url, commands_url, state_url, concurrency=32, batch_size=1000, duration=None):
+    """
+    Drives `fleet` until `duration` seconds have passed (forever if None),
+    posting its readings to `batch_url` with at most `concurrency` requests
+    in flight. Ticks that are overrun are skipped rather than queued, like
+    the controller's. Raises RuntimeError if aiohttp is not installed.
+    """
+    if aiohttp is None:
+        raise RuntimeError("Fleet mode needs aiohttp: pip install aiohttp")
+    loop = asyncio.get_running_loop()
+    stats = _Stats()
+    slots = asyncio.Semaphore(concurrency)
+    pending = set()
+
+    async def post(body, count):
+        try:
+            await _post_batch(session, batch_url, body, count, stats)
+        finally:
+            slots.release()
+
+    connector = aiohttp.TCPConnector(limit=concurrency + 2)  # Plus the controller follower's connection
+    timeout = aiohttp.ClientTimeout(total=REQUEST_TIMEOUT)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        follower = asyncio.create_task(_follow_controller(session, fleet, commands_url, state_url))
+        started = previous = loop.time()
+        next_report = started + fleet.interval
+        tick = 0
+        try:
+            while duration is None or previous - started < duration:
+                now = loop.time()
+                fleet.step(now - previous)
+                previous = now
+                for body, count in fleet.encode(tick, batch_size):
+                    stats.readings += count
+                    await slots.acquire()
+                    task = asyncio.create_task(post(body, count))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                if now >= next_report:
+                    stats.report(fleet)
+                    next_report += fleet.interval
+                # Fixed-rate deadlines: the tick number follows the clock, so phases stay put
+                tick += 1
+                deadline = started + tick * fleet.tick
+                now = loop.time()
+                if deadline < now:
+                    behind = int((now - deadline) / fleet.tick) + 1
+                    stats.skipped_ticks += behind
+                    tick += behind
+                    deadline += behind * fleet.tick
+                await asyncio.sleep(deadline - now)
+            if pending:
+                await asyncio.wait(pending)
+            stats.report(fleet)
+        finally:
+            follower.cancel()
@@ -0,0 +1,159 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+# In-memory cache of the newest reading per device, kept fresh by pushes from
+# the Data Service and, between pushes, by re-fetching entries older than a
+# short TTL. Concurrent misses for the same device share one upstream fetch.
+# Entries are kept in least-recently-used order and the cache holds at most
+# `max_entries` devices, so lookups of arbitrary device ids cannot grow it
+# without bound.
+# get() is for threaded servers and get_async() for coroutines on an event loop.
+
+
+class _Entry:
+    __slots__ = ("record", "confirmed_at", "checked_at", "failed")
+
+    def __init__(self, record, now):
+        self.record = record
+        self.confirmed_at = now  # When the Data Service last vouched for the record
+        self.checked_at = now    # When the record was last pushed or fetched (successfully or not)
+        self.failed = False      # Whether the last fetch failed
+
+
+class LatestCache:
+    """
+    Maps a device id (None for "any device") to its newest reading.
+    - put() stores a pushed reading.
+    - get() answers from memory while the entry is younger than `ttl` seconds,
+      otherwise calls `fetch(device_id)` (which returns the record or None,
+      and raises on failure). Only one caller fetches a given device at a time;
+      the others wait up to `wait_timeout` seconds for its result.
+    When a fetch fails the last known record is kept and reported as stale,
+    and the next fetch is attempted only once the TTL has passed again.
+    `on_update()`, if given, is called after every put or failed fetch.
+    Beyond `max_entries` devices the least recently used entry is dropped.
+    `hits`, `misses` and `coalesced` count the lookups answered from memory,
+    by a fetch, and by waiting for another caller's fetch.
+    """
+
+    def __init__(self, fetch, ttl=5.0, wait_timeout=5.0, on_update=None, max_entries=10_000):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.on_update = on_update
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # device_id -> _Entry, least recently used first
+        self._inflight = {}  # device_id -> Event set when the running fetch completes
+        self._async_inflight = {}  # device_id -> Future resolved when the running fetch completes
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.coalesced = 0
+
+    def put(self, device_id, record):
+        now = time.monotonic()
+        with self._lock:
+            self._store(device_id, _Entry(record, now))
+        if self.on_update is not None:
+            self.on_update()
+
+    def get(self, device_id=None):
+        """
+        Returns `(record, age_seconds, stale)`: the newest known reading (or
+        None), how long ago the Data Service last confirmed it (None if it
+        never did), and whether the last attempt to refresh it failed.
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(device_id)
+                return self._result(entry)
+            done = self._inflight.get(device_id)
+            leader = done is None
+            if leader:
+                done = self._inflight[device_id] = threading.Event()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            done.wait(self.wait_timeout)
+        else:
+            try:
+                record = self.fetch(device_id)
+            except Exception:
+                self._fetch_failed(device_id)
+            else:
+                self.put(device_id, record)
+            finally:
+                with self._lock:
+                    del self._inflight[device_id]
+                done.set()
+        return self._current(device_id)
+
+    async def get_async(self, device_id, fetch):
+        """
+        Coroutine version of get(), fetching with the coroutine function
+        `fetch(device_id)`. Waiting callers do not block the event loop.
+        """
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is not None and time.monotonic() - entry.checked_at < self.ttl:
+                self.hits += 1
+                self._entries.move_to_end(device_id)
+                return self._result(entry)
+            done = self._async_inflight.get(device_id)
+            leader = done is None
+            if leader:
+                done = self._async_inflight[device_id] = asyncio.get_running_loop().create_future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            try:
+                await asyncio.wait_for(asyncio.shield(done), self.wait_timeout)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            try:
+                record = await fetch(device_id)
+            except Exception:
+                self._fetch_failed(device_id)
+            else:
+                self.put(device_id, record)
+            finally:
+                with self._lock:
+                    del self._async_inflight[device_id]
+                done.set_result(None)
+        return self._current(device_id)
+
+    def _fetch_failed(self, device_id):
+        with self._lock:
+            entry = self._entries.get(device_id)
+            if entry is None:
+                entry = _Entry(None, time.monotonic())
+                entry.confirmed_at = None
+                self._store(device_id, entry)
+            entry.checked_at = time.monotonic()
+            entry.failed = True
+        if self.on_update is not None:
+            self.on_update()
+
+    def _store(self, device_id, entry):
+        # Must be called with the lock held
+        self._entries[device_id] = entry
+        self._entries.move_to_end(device_id)
+        if len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _current(self, device_id):
+        with self._lock:
+            entry = self._entries.get(device_id)
+            return self._result(entry) if entry is not None else (None, None, True)
+
+    @staticmethod
+    def _result(entry):
+        age = None if entry.confirmed_at is None else time.monotonic() - entry.confirmed_at
+        return entry.record, age, entry.failed
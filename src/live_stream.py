@@ -0,0 +1,151 @@
+import asyncio
+import collections
+import json
+import threading
+from reading_store import format_timestamp
+
+# Live push channel for dashboards, delivered as Server-Sent Events.
+# Each event is encoded once when it is published and kept in a short ring
+# of recent events; every open stream reads the same encoded bytes from the
+# ring, so N listeners cost one broadcast per reading rather than N polls.
+# Streams can filter readings by device; other events (such as setpoint
+# changes) go to every stream. A reconnecting EventSource resumes from its
+# Last-Event-ID as long as that event is still in the ring.
+
+DEFAULT_BUFFER_EVENTS = 4096
+HEARTBEAT_SECONDS = 15.0
+
+
+class _Event:
+    __slots__ = ("seq", "device_id", "frame")
+
+    def __init__(self, seq, device_id, frame):
+        self.seq = seq
+        self.device_id = device_id  # None for events that are not readings
+        self.frame = frame
+
+
+class LiveHub:
+    """
+    Ring of recently published events shared by all SSE streams.
+    listener() matches the store listener signature and publishes readings;
+    publish() publishes any other named event, remembering the last one of
+    each name so new streams start with it.
+    stream() is the generator for threaded servers, stream_async() the async
+    generator for an event loop.
+    """
+
+    def __init__(self, buffer_events=DEFAULT_BUFFER_EVENTS, heartbeat=HEARTBEAT_SECONDS):
+        self.heartbeat = heartbeat
+        self._events = collections.deque(maxlen=buffer_events)
+        self._next_seq = 1
+        self._sticky = {}  # Event name -> frame of the last event with that name
+        self._listeners = 0
+        self._condition = threading.Condition()
+        self._loops = {}  # Event loop -> future resolved on the next publish
+
+    def listener(self, timestamp_ns, temperature, device_id):
+        # Runs under the store's partition lock; skips the encoding while nobody listens
+        if self._listeners:
+            record = {"device_id": device_id, "temperature": temperature, "timestamp": format_timestamp(timestamp_ns)}
+            self._publish("reading", record, device_id)
+
+    def publish(self, name, data):
+        """Publishes event `name` with JSON-serializable `data` to every stream."""
+        self._publish(name, data, None, sticky=True)
+
+    def _publish(self, name, data, device_id, sticky=False):
+        with self._condition:
+            seq = self._next_seq
+            self._next_seq += 1
+            frame = f"id: {seq}\nevent: {name}\ndata: {json.dumps(data)}\n\n".encode()
+            self._events.append(_Event(seq, device_id, frame))
+            if sticky:
+                self._sticky[name] = frame
+            self._condition.notify_all()
+            loops = list(self._loops)
+        for loop in loops:
+            loop.call_soon_threadsafe(self._wake, loop)
+
+    def _wake(self, loop):
+        # Runs on `loop`: wakes all of its streams at once
+        with self._condition:
+            waiter = self._loops.get(loop)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def _waiter(self, loop):
+        with self._condition:
+            waiter = self._loops.get(loop)
+            if waiter is None or waiter.done():
+                waiter = self._loops[loop] = loop.create_future()
+            return waiter
+
+    def _collect(self, next_seq, device_id):
+        # Returns the frames published since next_seq that pass the filter, and the new next_seq.
+        # Walks back from the newest event, so the cost is the number of new events;
+        # a stream that fell behind the ring skips what was dropped.
+        frames = []
+        with self._condition:
+            for event in reversed(self._events):
+                if event.seq < next_seq:
+                    break
+                if device_id is None or event.device_id is None or event.device_id == device_id:
+                    frames.append(event.frame)
+            frames.reverse()
+            return frames, self._next_seq
+
+    def _start(self, last_event_id, initial_events):
+        with self._condition:
+            self._listeners += 1
+            if last_event_id is not None and last_event_id < self._next_seq:
+                return [], last_event_id + 1
+            frames = list(self._sticky.values())
+            frames += [f"event: {name}\ndata: {json.dumps(data)}\n\n".encode() for name, data in initial_events]
+            return frames, self._next_seq
+
+    def stream(self, device_id=None, last_event_id=None, initial_events=()):
+        """
+        Yields SSE frames for one stream: the sticky events and the
+        `(name, data)` pairs of `initial_events` (or, when resuming, what was
+        missed since `last_event_id`), then new events as they are published,
+        with a comment line as heartbeat.
+        """
+        frames, next_seq = self._start(last_event_id, initial_events)
+        try:
+            yield b"retry: 3000\n\n" + b"".join(frames)
+            while True:
+                frames, next_seq = self._collect(next_seq, device_id)
+                if frames:
+                    yield b"".join(frames)
+                    continue
+                with self._condition:
+                    idle = self._next_seq == next_seq and not self._condition.wait(self.heartbeat)
+                if idle:
+                    yield b": keepalive\n\n"
+        finally:
+            with self._condition:
+                self._listeners -= 1
+
+    async def stream_async(self, device_id=None, last_event_id=None, initial_events=()):
+        """Async generator version of stream() for an event loop."""
+        loop = asyncio.get_running_loop()
+        frames, next_seq = self._start(last_event_id, initial_events)
+        try:
+            yield b"retry: 3000\n\n" + b"".join(frames)
+            while True:
+                frames, next_seq = self._collect(next_seq, device_id)
+                if frames:
+                    yield b"".join(frames)
+                    continue
+                # All streams of a loop share one future; taking it before the check
+                # means a publish right after the check still wakes this stream
+                waiter = self._waiter(loop)
+                if self._next_seq == next_seq:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(waiter), self.heartbeat)
+                    except asyncio.TimeoutError:
+                        yield b": keepalive\n\n"
+        finally:
+            with self._condition:
+                self._listeners -= 1
@@ -0,0 +1,89 @@
+import threading
+import time
+import requests
+import http_client
+from reading_store import format_timestamp
+
+# Pushes new readings to subscribed services over HTTP (webhooks).
+# Subscriptions are leases: a subscriber re-registers before its lease runs out,
+# so one that disappears stops receiving notifications on its own.
+# Only the newest reading of each device is pushed; bursts of readings that
+# arrive while a delivery is in flight are coalesced into the next one.
+
+DEFAULT_LEASE_SECONDS = 60
+MAX_LEASE_SECONDS = 3600
+
+
+class WebhookNotifier:
+    """
+    Delivers `{"readings": [...], "latest": {...}}` to every subscribed URL
+    whenever readings are stored. "readings" holds the newest reading of each
+    device that changed and "latest" the newest reading overall.
+    listener() matches the store listener signature and only records which
+    devices changed; delivery happens on a background thread. With `deliver`
+    unset the notifier only keeps the subscriptions, for a process whose
+    readings another process delivers.
+    """
+
+    def __init__(self, store, timeout=1.0, deliver=True):
+        self.store = store
+        self.timeout = timeout
+        self.deliver = deliver
+        self._subscribers = {}  # URL -> lease expiry (monotonic seconds)
+        self._pending = {}      # device_id -> (timestamp_ns, temperature)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+
+    def subscribe(self, url, lease=DEFAULT_LEASE_SECONDS):
+        """Registers or renews a webhook for `lease` seconds. Returns the granted lease."""
+        lease = min(max(1, lease), MAX_LEASE_SECONDS)
+        with self._lock:
+            self._subscribers[url] = time.monotonic() + lease
+            if self.deliver and self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return lease
+
+    def unsubscribe(self, url):
+        """Removes a webhook. Returns False if it was not registered."""
+        with self._lock:
+            return self._subscribers.pop(url, None) is not None
+
+    def subscriptions(self):
+        """Returns the active webhooks as a dict of URL -> seconds left on the lease."""
+        now = time.monotonic()
+        with self._lock:
+            return {url: round(expiry - now, 3) for url, expiry in self._subscribers.items() if expiry > now}
+
+    def listener(self, timestamp_ns, temperature, device_id):
+        # Runs under the store's partition lock, so it only marks the device as changed
+        if not self.deliver or not self._subscribers:
+            return
+        with self._lock:
+            pending = self._pending.get(device_id)
+            if pending is None or timestamp_ns >= pending[0]:
+                self._pending[device_id] = (timestamp_ns, temperature)
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            now = time.monotonic()
+            with self._lock:
+                pending, self._pending = self._pending, {}
+                for url in [url for url, expiry in self._subscribers.items() if expiry <= now]:
+                    del self._subscribers[url]
+                urls = list(self._subscribers)
+            if not pending or not urls:
+                continue
+            readings = [{"device_id": device_id, "temperature": temperature,
+                         "timestamp": format_timestamp(timestamp_ns)}
+                        for device_id, (timestamp_ns, temperature) in sorted(pending.items(), key=lambda item: item[1])]
+            payload = {"readings": readings, "latest": self.store.latest()}
+            for url in urls:
+                try:
+                    http_client.post(url, json=payload, timeout=self.timeout).raise_for_status()
+                except requests.exceptions.RequestException as e:
+                    print(f"Data Service: Could not notify {url}: {e}")
@@ -0,0 +1,120 @@
+import bisect
+import threading
+
+# Precomputed min/max/sum/count aggregates of temperature readings.
+# Buckets are maintained incrementally as readings are stored, so serving a
+# chart of a day or a week costs a few hundred rows instead of every raw reading.
+
+NANOSECONDS = 1_000_000_000
+
+# Resolution name -> (bucket width in nanoseconds, number of buckets retained)
+RESOLUTIONS = {
+    "minute": (60 * NANOSECONDS, 7 * 24 * 60),  # One week of minutes
+    "hour": (3600 * NANOSECONDS, 366 * 24),     # One year of hours
+    "day": (86400 * NANOSECONDS, 10 * 366),     # Ten years of days
+}
+
+
+class _Series:
+    """Buckets of one resolution, stored as parallel lists ordered by bucket start."""
+
+    def __init__(self, width, retention):
+        self.width = width
+        self.retention = retention
+        self.starts = []
+        self.mins = []
+        self.maxs = []
+        self.sums = []
+        self.counts = []
+
+    def add(self, timestamp_ns, temperature):
+        start = timestamp_ns - timestamp_ns % self.width
+        if self.starts and start == self.starts[-1]:
+            i = -1  # Common case: the reading falls in the newest bucket
+        elif not self.starts or start > self.starts[-1]:
+            self._insert(len(self.starts), start, temperature)
+            self._trim()
+            return
+        else:
+            i = bisect.bisect_left(self.starts, start)
+            if i == len(self.starts) or self.starts[i] != start:
+                if i == 0 and len(self.starts) >= self.retention:
+                    return  # Older than anything retained
+                self._insert(i, start, temperature)
+                self._trim()
+                return
+        if temperature < self.mins[i]:
+            self.mins[i] = temperature
+        if temperature > self.maxs[i]:
+            self.maxs[i] = temperature
+        self.sums[i] += temperature
+        self.counts[i] += 1
+
+    def _insert(self, i, start, temperature):
+        self.starts.insert(i, start)
+        self.mins.insert(i, temperature)
+        self.maxs.insert(i, temperature)
+        self.sums.insert(i, temperature)
+        self.counts.insert(i, 1)
+
+    def _trim(self):
+        # Drop expired buckets in chunks so trimming stays amortized O(1)
+        excess = len(self.starts) - self.retention
+        if excess >= max(1, self.retention // 8):
+            for values in (self.starts, self.mins, self.maxs, self.sums, self.counts):
+                del values[:excess]
+
+    def range(self, since_ns, until_ns):
+        # Indexes of the retained buckets overlapping (since_ns, until_ns]
+        lo = self._retained_start()
+        hi = len(self.starts)
+        if since_ns is not None:
+            lo = max(lo, bisect.bisect_right(self.starts, since_ns - self.width))
+        if until_ns is not None:
+            hi = bisect.bisect_right(self.starts, until_ns)
+        return lo, max(lo, hi)
+
+    def _retained_start(self):
+        return max(0, len(self.starts) - self.retention)
+
+
+class RollupStore:
+    """
+    Multi-resolution rollups (see RESOLUTIONS) of a stream of readings.
+    add() does O(1) work per resolution for in-order readings; readings that
+    arrive late are merged into their bucket with a binary search.
+    """
+
+    def __init__(self, resolutions=RESOLUTIONS):
+        self._series = {name: _Series(width, retention) for name, (width, retention) in resolutions.items()}
+        self._lock = threading.Lock()
+
+    @property
+    def resolutions(self):
+        return list(self._series)
+
+    def add(self, timestamp_ns, temperature, device_id=None):
+        """Folds one reading into every resolution. Matches the store listener signature."""
+        with self._lock:
+            for series in self._series.values():
+                series.add(timestamp_ns, temperature)
+
+    def query(self, resolution, since_ns=None, until_ns=None, limit=None, newest_first=True):
+        """
+        Returns `(start_ns, min, max, sum, count)` tuples for the buckets of
+        `resolution` overlapping `(since_ns, until_ns]`, at most `limit` of them.
+        Raises KeyError for an unknown resolution.
+        """
+        series = self._series[resolution]
+        with self._lock:
+            lo, hi = series.range(since_ns, until_ns)
+            if limit is not None:
+                if newest_first:
+                    lo = max(lo, hi - limit)
+                else:
+                    hi = min(hi, lo + limit)
+            rows = list(zip(series.starts[lo:hi], series.mins[lo:hi], series.maxs[lo:hi],
+                            series.sums[lo:hi], series.counts[lo:hi]))
+        if newest_first:
+            rows.reverse()
+        return rows
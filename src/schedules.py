@@ -0,0 +1,268 @@
+import bisect
+import math
+import threading
+from datetime import datetime, timezone
+import numpy as np
+
+# Time-of-day setpoint schedules per zone.
+# A zone's schedule has weekly entries ("from 07:30 on weekdays, 21.5 °C";
+# entries without days apply every day) and override windows ("22 °C from
+# this start to that end"). Each schedule is compiled into sorted transition
+# tables when it is set, so the target at any time is a binary search:
+# - weekly transitions as seconds since Monday 00:00, wrapping around the week;
+# - override transitions as absolute times, already resolved so that the
+#   override listed last wins where windows overlap.
+# For the batch form all zones' tables are concatenated into one array, keyed
+# so that a single numpy.searchsorted call answers every zone at once. The
+# same search finds each zone's next transition, so the answer is kept until
+# the earliest of them and the controller's ticks in between reuse it.
+
+DAYS = ("mon", "tue", "wed", "thu", "fri", "sat", "sun")
+DAY_SECONDS = 86400
+WEEK_SECONDS = 7 * DAY_SECONDS
+_EPOCH_WEEKDAY = 3  # 1970-01-01 was a Thursday, three days into its week
+_ZONE_SHIFT = 34    # Override keys are (row << _ZONE_SHIFT) + epoch seconds; 2**34 s is past the year 2500
+MAX_TIME = 1 << _ZONE_SHIFT  # Times must be in [0, MAX_TIME) epoch seconds to fit in a key
+
+
+def parse_time(value):
+    """
+    Returns epoch seconds from epoch seconds or an ISO-8601 string (UTC if no
+    offset). Raises ValueError for invalid times and for times outside
+    [0, MAX_TIME), which the schedule tables cannot hold.
+    """
+    try:
+        seconds = float(value)
+    except (TypeError, ValueError):
+        if not isinstance(value, str):
+            raise ValueError(f"Invalid time {value!r}")
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        if moment.tzinfo is None:
+            moment = moment.replace(tzinfo=timezone.utc)
+        seconds = moment.timestamp()
+    if not (math.isfinite(seconds) and 0 <= seconds < MAX_TIME):
+        raise ValueError(f"Time {value!r} is out of range")
+    return seconds
+
+
+def _time_of_day(value):
+    try:
+        hours, minutes = value.split(":")
+        seconds = int(hours) * 3600 + int(minutes) * 60
+    except (AttributeError, ValueError):
+        raise ValueError(f"Invalid time of day {value!r}; expected HH:MM")
+    if not 0 <= seconds < DAY_SECONDS:
+        raise ValueError(f"Invalid time of day {value!r}; expected HH:MM")
+    return seconds
+
+
+def _setpoint(value):
+    try:
+        setpoint = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid setpoint {value!r}")
+    if not math.isfinite(setpoint):
+        raise ValueError(f"Invalid setpoint {value!r}")
+    return setpoint
+
+
+class ZoneSchedule:
+    """One zone's schedule, compiled into transition tables. Raises ValueError for invalid entries."""
+
+    def __init__(self, weekly=(), overrides=()):
+        self.weekly = [dict(entry) for entry in weekly]
+        self.overrides = [dict(entry) for entry in overrides]
+
+        transitions = {}
+        for entry in self.weekly:
+            offset = _time_of_day(entry.get("time"))
+            days = entry.get("days") or DAYS
+            setpoint = _setpoint(entry.get("setpoint"))
+            for day in days:
+                if day not in DAYS:
+                    raise ValueError(f"Invalid day {day!r}; expected one of {', '.join(DAYS)}")
+                transitions[DAYS.index(day) * DAY_SECONDS + offset] = setpoint
+        self.week_offsets = sorted(transitions)
+        self.week_setpoints = [transitions[offset] for offset in self.week_offsets]
+
+        windows = []
+        for entry in self.overrides:
+            start, end = parse_time(entry.get("start")), parse_time(entry.get("end"))
+            if not start < end:
+                raise ValueError("An override must end after it starts")
+            windows.append((int(start), int(end), _setpoint(entry.get("setpoint"))))
+        # Elementary intervals between all boundaries, each taking the last window covering it
+        self.override_times = sorted({time for start, end, _ in windows for time in (start, end)})
+        self.override_setpoints = []
+        for time in self.override_times:
+            value = math.nan
+            for start, end, setpoint in windows:
+                if start <= time < end:
+                    value = setpoint
+            self.override_setpoints.append(value)
+
+    def definition(self):
+        return {"weekly": self.weekly, "overrides": self.overrides}
+
+    def lookup(self, week_offset, t):
+        """Returns (setpoint, source) at epoch seconds `t`, `week_offset` into the local week, or (None, None)."""
+        i = bisect.bisect_right(self.override_times, t) - 1
+        if i >= 0 and not math.isnan(self.override_setpoints[i]):
+            return self.override_setpoints[i], "override"
+        if self.week_offsets:
+            # Before the week's first transition the last one of the previous week still holds
+            i = bisect.bisect_right(self.week_offsets, week_offset) - 1
+            return self.week_setpoints[i], "schedule"
+        return None, None
+
+
+class ScheduleBook:
+    """
+    Setpoint schedules of all zones, with local time `utc_offset` seconds ahead of UTC.
+    target() answers for one zone in O(log n); targets() answers for many
+    zones with one vectorized search over the concatenated tables.
+    """
+
+    def __init__(self, utc_offset=0):
+        self.utc_offset = utc_offset
+        self._schedules = {}
+        self._rows = {}  # zone_id -> row in the flat tables; rows are never reused
+        self._version = 0
+        self._flat = None
+        self._row_cache = None
+        self._targets_cache = None  # (version, zone_ids, count, default, valid_from, valid_until, targets)
+        self._lock = threading.Lock()
+
+    def _week_offset(self, t):
+        return (t + self.utc_offset + _EPOCH_WEEKDAY * DAY_SECONDS) % WEEK_SECONDS
+
+    def set(self, zone_id, weekly=(), overrides=()):
+        """Replaces a zone's schedule. Raises ValueError if it is invalid."""
+        schedule = ZoneSchedule(weekly, overrides)
+        with self._lock:
+            self._rows.setdefault(zone_id, len(self._rows))
+            self._schedules[zone_id] = schedule
+            self._version += 1
+
+    def remove(self, zone_id):
+        """Removes a zone's schedule. Returns False if it had none."""
+        with self._lock:
+            if self._schedules.pop(zone_id, None) is None:
+                return False
+            self._version += 1
+            return True
+
+    def get(self, zone_id):
+        schedule = self._schedules.get(zone_id)
+        return schedule.definition() if schedule is not None else None
+
+    def zones(self):
+        return list(self._schedules)
+
+    def target(self, zone_id, t):
+        """Returns (setpoint, source) for a zone at epoch seconds `t`; (None, None) if nothing is scheduled."""
+        schedule = self._schedules.get(zone_id)
+        if schedule is None:
+            return None, None
+        return schedule.lookup(self._week_offset(t), t)
+
+    def targets(self, zone_ids, t, default=math.nan):
+        """
+        Returns a float array with the setpoint of every zone in `zone_ids` at
+        epoch seconds `t`, and `default` for zones with nothing scheduled.
+        Passing the same, only ever growing, list object again (as the
+        controller does with its zones) reuses the zone lookups of the last call,
+        and until the next transition of any of the zones, the targets too.
+        """
+        with self._lock:
+            cached = self._targets_cache
+            if cached is not None and cached[0] == self._version and cached[1] is zone_ids \
+                    and cached[2] == len(zone_ids) and cached[3] == default and cached[4] <= t < cached[5]:
+                return cached[6].copy()
+            version = self._version
+            flat = self._compile()
+            rows = self._zone_rows(zone_ids)
+        week_keys, week_values, week_start, week_end, override_keys, override_values, override_start = flat
+        result = np.full(len(rows), default, dtype=np.float64)
+        valid_until = math.inf
+        known = rows >= 0
+        if not known.any():
+            return result
+        rows = np.where(known, rows, 0)
+
+        if len(week_keys):
+            # Weekly: the last transition at or before this time of week, wrapping to the zone's last one
+            start, end = week_start[rows], week_end[rows]
+            week_offset = self._week_offset(t)
+            i = np.searchsorted(week_keys, rows * WEEK_SECONDS + int(week_offset), side="right") - 1
+            np.copyto(i, end - 1, where=i < start)
+            scheduled = known & (end > start)
+            np.copyto(result, week_values[np.maximum(i, 0)], where=scheduled)
+            if scheduled.any():
+                # The next transition is the following entry, wrapping to the zone's first
+                following = i + 1
+                np.copyto(following, start, where=following >= end)
+                following = np.minimum(following, len(week_keys) - 1)
+                wait = (week_keys[following] - rows * WEEK_SECONDS - week_offset) % WEEK_SECONDS
+                wait[wait <= 0] = WEEK_SECONDS
+                valid_until = min(valid_until, t + float(wait[scheduled].min()))
+
+        if len(override_keys):
+            # Overrides: the elementary interval containing t, if any
+            assert 0 <= int(t) < MAX_TIME, "time does not fit in an override key"
+            keys = (rows << _ZONE_SHIFT) + int(t)
+            i = np.searchsorted(override_keys, keys, side="right") - 1
+            values = override_values[np.maximum(i, 0)]
+            np.copyto(result, values, where=known & (i >= override_start[rows]) & ~np.isnan(values))
+            # The next boundary is the following key, if it belongs to the same zone
+            following = np.minimum(i + 1, len(override_keys) - 1)
+            boundaries = override_keys[following] - (rows << _ZONE_SHIFT)
+            upcoming = known & (i + 1 < len(override_keys)) & (boundaries < MAX_TIME) & (boundaries > int(t))
+            if upcoming.any():
+                valid_until = min(valid_until, float(boundaries[upcoming].min()))
+
+        with self._lock:
+            if self._version == version:
+                self._targets_cache = (version, zone_ids, len(zone_ids), default, t, valid_until, result.copy())
+        return result
+
+    def _compile(self):
+        # Concatenates every zone's tables, keyed by row so one search covers all zones
+        if self._flat is not None and self._flat[0] == self._version:
+            return self._flat[1]
+        count = len(self._rows)
+        week_keys, week_values, override_keys, override_values = [], [], [], []
+        week_start = np.zeros(count, dtype=np.int64)
+        week_end = np.zeros(count, dtype=np.int64)
+        override_start = np.zeros(count, dtype=np.int64)
+        for zone_id, row in sorted(self._rows.items(), key=lambda item: item[1]):
+            schedule = self._schedules.get(zone_id)
+            week_start[row] = len(week_keys)
+            override_start[row] = len(override_keys)
+            if schedule is not None:
+                assert all(0 <= time < MAX_TIME for time in schedule.override_times)
+                week_keys += [row * WEEK_SECONDS + offset for offset in schedule.week_offsets]
+                week_values += schedule.week_setpoints
+                override_keys += [(row << _ZONE_SHIFT) + time for time in schedule.override_times]
+                override_values += schedule.override_setpoints
+            week_end[row] = len(week_keys)
+            if len(override_keys) == override_start[row]:
+                override_start[row] = len(override_keys) + 1  # No overrides: never matches
+        flat = (np.array(week_keys, dtype=np.int64), np.array(week_values, dtype=np.float64), week_start, week_end,
+                np.array(override_keys, dtype=np.int64), np.array(override_values, dtype=np.float64), override_start)
+        self._flat = (self._version, flat)
+        return flat
+
+    def _zone_rows(self, zone_ids):
+        # The cached rows stay valid until a zone gets its first schedule
+        cache = self._row_cache
+        if cache is not None and cache[0] is zone_ids and cache[1] == len(self._rows) \
+                and len(cache[2]) <= len(zone_ids):
+            rows = cache[2]
+            if len(rows) < len(zone_ids):
+                added = [self._rows.get(zone_id, -1) for zone_id in zone_ids[len(rows):]]
+                rows = np.concatenate((rows, np.array(added, dtype=np.int64)))
+        else:
+            rows = np.array([self._rows.get(zone_id, -1) for zone_id in zone_ids], dtype=np.int64)
+        self._row_cache = (zone_ids, len(self._rows), rows)
+        return rows
@@ -0,0 +1,186 @@
+import bisect
+import mmap
+import os
+import struct
+import time
+
+# Durable, append-only log of fixed-size binary records.
+# Records are written to rolling segment files named after the sequence number
+# of their first record, so any record can be located from its sequence number
+# alone. Writes go through a buffered file and are fsync'ed in batches; reads
+# go through mmap so history queries never copy whole files into memory.
+
+DEFAULT_SEGMENT_RECORDS = 1_048_576
+SEGMENT_SUFFIX = ".seg"
+
+
+class _Segment:
+    """One segment file holding records [first_seq, first_seq + count)."""
+
+    def __init__(self, path, first_seq, count):
+        self.path = path
+        self.first_seq = first_seq
+        self.count = count
+        self._mmap = None
+        self._mapped_count = 0
+
+    def view(self, record_size):
+        """Returns a memoryview over the segment's records, remapping if the file grew."""
+        if self._mmap is None or self._mapped_count != self.count:
+            # Older maps are left to the garbage collector: readers may still hold views of them
+            with open(self.path, 'rb') as f:
+                self._mmap = mmap.mmap(f.fileno(), self.count * record_size, access=mmap.ACCESS_READ)
+            self._mapped_count = self.count
+        return memoryview(self._mmap)
+
+    def close(self):
+        self._mmap = None
+
+
+class _KeyIndex:
+    """Sequence view of the first field of every record in a segment, for bisect."""
+
+    def __init__(self, view, record):
+        self._view = view
+        self._record = record
+
+    def __len__(self):
+        return len(self._view) // self._record.size
+
+    def __getitem__(self, i):
+        return self._record.unpack_from(self._view, i * self._record.size)[0]
+
+
+class SegmentLog:
+    """
+    An append-only log of `struct`-packed records split into rolling segments.
+    - append() writes through a buffered file; the log is fsync'ed once
+      `fsync_every` records are pending or `fsync_interval` seconds have passed.
+    - read() and find() work on mmap'ed segments.
+    The first field of each record is treated as a sort key (the timestamp)
+    by find(), so records must be appended in key order for it to be useful.
+    The log is not thread-safe; callers serialize access.
+    """
+
+    def __init__(self, directory, record_format, segment_records=DEFAULT_SEGMENT_RECORDS,
+                 fsync_every=1000, fsync_interval=1.0):
+        self.directory = directory
+        self.record = struct.Struct(record_format)
+        self.segment_records = segment_records
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self._segments = []
+        self._file = None
+        self._pending = 0
+        self._last_sync = time.monotonic()
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+
+    def __len__(self):
+        """Total number of records in the log, i.e. the next sequence number."""
+        if not self._segments:
+            return 0
+        last = self._segments[-1]
+        return last.first_seq + last.count
+
+    def _load(self):
+        # Discover existing segments and drop any partial record left by a crash
+        names = sorted(name for name in os.listdir(self.directory) if name.endswith(SEGMENT_SUFFIX))
+        for name in names:
+            path = os.path.join(self.directory, name)
+            size = os.path.getsize(path)
+            count, partial = divmod(size, self.record.size)
+            if partial:
+                with open(path, 'r+b') as f:
+                    f.truncate(count * self.record.size)
+            self._segments.append(_Segment(path, int(name[:-len(SEGMENT_SUFFIX)]), count))
+
+    def _open_segment(self):
+        first_seq = len(self)
+        path = os.path.join(self.directory, f"{first_seq:020d}{SEGMENT_SUFFIX}")
+        self._segments.append(_Segment(path, first_seq, 0))
+        self._file = open(path, 'ab')
+
+    def append(self, values):
+        """Appends one record, given as a tuple of its fields."""
+        self.append_many((values,))
+
+    def append_many(self, records):
+        """Appends records, rolling to a new segment whenever the current one is full."""
+        for values in records:
+            if self._file is None or self._segments[-1].count >= self.segment_records:
+                self._roll()
+            self._file.write(self.record.pack(*values))
+            self._segments[-1].count += 1
+            self._pending += 1
+        if self._pending >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+
+    def _roll(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+        active = self._segments[-1] if self._segments else None
+        if active is not None and active.count < self.segment_records:
+            self._file = open(active.path, 'ab')
+        else:
+            self._open_segment()
+
+    def flush(self):
+        """Pushes buffered records to the OS so mmap readers can see them."""
+        if self._file is not None:
+            self._file.flush()
+
+    def sync(self):
+        """Flushes buffered records and fsyncs them to disk."""
+        if self._file is not None and self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        self._pending = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for segment in self._segments:
+            segment.close()
+
+    def _segment_index(self, seq):
+        firsts = [segment.first_seq for segment in self._segments]
+        return bisect.bisect_right(firsts, seq) - 1
+
+    def read(self, start, stop, reverse=False):
+        """Yields the records with sequence numbers in [start, stop) as tuples."""
+        self.flush()
+        start = max(0, start)
+        stop = min(len(self), stop)
+        if start >= stop:
+            return
+        first = self._segment_index(start)
+        last = self._segment_index(stop - 1)
+        indexes = range(last, first - 1, -1) if reverse else range(first, last + 1)
+        size = self.record.size
+        for i in indexes:
+            segment = self._segments[i]
+            lo = max(start, segment.first_seq) - segment.first_seq
+            hi = min(stop, segment.first_seq + segment.count) - segment.first_seq
+            view = segment.view(size)
+            if reverse:
+                for j in range(hi - 1, lo - 1, -1):
+                    yield self.record.unpack_from(view, j * size)
+            else:
+                yield from self.record.iter_unpack(view[lo * size:hi * size])
+
+    def find(self, key):
+        """Returns the sequence number of the first record whose key is greater than `key`."""
+        self.flush()
+        for segment in reversed(self._segments):
+            if segment.count == 0:
+                continue
+            index = _KeyIndex(segment.view(self.record.size), self.record)
+            if index[0] <= key:
+                return segment.first_seq + bisect.bisect_right(index, key)
+        return 0 if not self._segments else self._segments[0].first_seq
@@ -0,0 +1,228 @@
+import collections
+import cProfile
+import io
+import os
+import pstats
+import signal
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+# On-demand profiling for live services, switched on with PROFILING_ENABLED=1.
+# - A sampling profiler records the stacks of every thread every few
+#   milliseconds for a given number of seconds, started with
+#   POST /debug/profile?seconds=N or by sending the process SIGUSR2. The
+#   result is in collapsed-stack format ("root;caller;callee count" lines),
+#   which flamegraph.pl and speedscope read directly.
+# - A request carrying "X-Profile: 1" runs under cProfile; the response
+#   gets an X-Profile-Id header, and GET /debug/profile/requests/<id> returns
+#   the statistics. Only one request is profiled at a time. Requests served
+#   through asgi_support are not profiled this way: the event loop runs other
+#   clients' requests while one is in progress, so the session would not be
+#   that request's alone. The sampling profiler works in both modes.
+# When profiling is not enabled nothing is installed, so it costs nothing;
+# when enabled but idle, each request pays one header lookup.
+
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "0") == "1"
+# If set, the /debug/profile endpoints require it in the X-Profile-Token header
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN")
+PROFILING_INTERVAL = float(os.getenv("PROFILING_INTERVAL", "0.005"))
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+# Profiles started by SIGUSR2 run this long and are written to PROFILING_DIR
+PROFILING_SIGNAL_SECONDS = float(os.getenv("PROFILING_SIGNAL_SECONDS", "10"))
+PROFILING_DIR = os.getenv("PROFILING_DIR", tempfile.gettempdir())
+REQUEST_PROFILES_KEPT = 32
+REQUEST_PROFILE_LINES = 60
+
+
+def _frame_name(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of all other threads every `interval` seconds on a
+    background thread while a run is active. One run at a time.
+    """
+
+    def __init__(self, interval=PROFILING_INTERVAL):
+        self.interval = interval
+        self.result = None      # Collapsed stacks of the last completed run
+        self.samples = 0
+        self._running = False
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._running
+
+    def start(self, seconds, on_done=None):
+        """
+        Starts a run of `seconds`; `on_done(collapsed)` is called when it ends.
+        Returns False if a run is already active.
+        """
+        with self._lock:
+            if self._running:
+                return False
+            self._running = True
+        threading.Thread(target=self._run, args=(seconds, on_done), daemon=True,
+                         name="sampling-profiler").start()
+        return True
+
+    def _run(self, seconds, on_done):
+        counts = collections.Counter()
+        samples = 0
+        own = threading.get_ident()
+        names = {}  # Code object -> frame name, so each is formatted once per run
+        deadline = time.monotonic() + seconds
+        try:
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        name = names.get(code)
+                        if name is None:
+                            name = names[code] = _frame_name(code)
+                        stack.append(name)
+                        frame = frame.f_back
+                    stack.reverse()
+                    counts[";".join(stack)] += 1
+                frame = None  # Drop the last frame reference before sleeping
+                samples += 1
+                time.sleep(self.interval)
+        finally:
+            collapsed = "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+            with self._lock:
+                self.result = collapsed
+                self.samples = samples
+                self._running = False
+        if on_done is not None:
+            on_done(collapsed)
+
+
+class RequestProfiler:
+    """Runs single requests under cProfile and keeps the statistics of the last few."""
+
+    def __init__(self, kept=REQUEST_PROFILES_KEPT):
+        self._busy = threading.Lock()
+        self._results = collections.OrderedDict()
+        self._kept = kept
+        self._lock = threading.Lock()
+
+    def begin(self):
+        """Returns an enabled profile, or None if another request is being profiled."""
+        if not self._busy.acquire(blocking=False):
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:  # Another profiler is active in this process
+            self._busy.release()
+            return None
+        return profile
+
+    def end(self, profile, description):
+        """Stops `profile` and stores its statistics. Returns their id."""
+        profile.disable()
+        self._busy.release()
+        out = io.StringIO()
+        out.write(description + "\n\n")
+        pstats.Stats(profile, stream=out).sort_stats("cumulative").print_stats(REQUEST_PROFILE_LINES)
+        profile_id = uuid.uuid4().hex[:12]
+        with self._lock:
+            self._results[profile_id] = out.getvalue()
+            while len(self._results) > self._kept:
+                self._results.popitem(last=False)
+        return profile_id
+
+    def get(self, profile_id):
+        with self._lock:
+            return self._results.get(profile_id)
+
+
+def _write_profile(collapsed):
+    path = os.path.join(PROFILING_DIR, f"profile-{os.getpid()}-{int(time.time())}.folded")
+    with open(path, "w") as f:
+        f.write(collapsed)
+    print(f"Profiling: Wrote {path}")
+
+
+def install_profiling(app, name="service"):
+    """
+    Adds the profiling hooks and /debug/profile endpoints to Flask `app` if
+    PROFILING_ENABLED is set, and starts a sampling run on SIGUSR2 (when
+    called from the main thread on a platform that has it). `name` labels
+    the output. Returns the SamplingProfiler, or None when disabled.
+    """
+    if not PROFILING_ENABLED:
+        return None
+    from flask import Response, g, jsonify, request
+
+    sampler = SamplingProfiler()
+    request_profiler = RequestProfiler()
+
+    def authorized():
+        return PROFILING_TOKEN is None or request.headers.get("X-Profile-Token") == PROFILING_TOKEN
+
+    @app.before_request
+    def start_request_profile():
+        if (request.headers.get("X-Profile") == "1" and "asgi.scope" not in request.environ
+                and authorized()):
+            g.profile = request_profiler.begin()
+
+    @app.after_request
+    def finish_request_profile(response):
+        profile = g.pop("profile", None)
+        if profile is not None:
+            description = f"{name}: {request.method} {request.full_path} -> {response.status_code}"
+            response.headers["X-Profile-Id"] = request_profiler.end(profile, description)
+        return response
+
+    @app.teardown_request
+    def abandon_request_profile(exc):
+        # after_request is skipped when a request fails with an unhandled error
+        profile = g.pop("profile", None)
+        if profile is not None:
+            request_profiler.end(profile, f"{name}: {request.method} {request.full_path} -> failed: {exc!r}")
+
+    def profile():
+        if not authorized():
+            return jsonify({"error": "Invalid or missing X-Profile-Token"}), 403
+        if request.method == 'POST':
+            try:
+                seconds = float(request.args.get('seconds', 10))
+            except ValueError:
+                return jsonify({"error": "Invalid 'seconds'"}), 400
+            if not 0 < seconds <= PROFILING_MAX_SECONDS:
+                return jsonify({"error": f"'seconds' must be between 0 and {PROFILING_MAX_SECONDS:g}"}), 400
+            if not sampler.start(seconds):
+                return jsonify({"error": "A profile is already running"}), 409
+            return jsonify({"seconds": seconds, "interval": sampler.interval}), 202
+        if sampler.running:
+            return jsonify({"error": "The profile is still running"}), 409
+        if sampler.result is None:
+            return jsonify({"error": "No profile has been taken"}), 404
+        return Response(sampler.result, mimetype="text/plain",
+                        headers={"X-Profile-Samples": str(sampler.samples)})
+
+    def request_profile(profile_id):
+        if not authorized():
+            return jsonify({"error": "Invalid or missing X-Profile-Token"}), 403
+        stats = request_profiler.get(profile_id)
+        if stats is None:
+            return jsonify({"error": "Unknown profile id"}), 404
+        return Response(stats, mimetype="text/plain")
+
+    app.add_url_rule("/debug/profile", "debug_profile", profile, methods=["GET", "POST"])
+    app.add_url_rule("/debug/profile/requests/<profile_id>", "debug_request_profile", request_profile)
+
+    if hasattr(signal, "SIGUSR2") and threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGUSR2,
+                      lambda signum, frame: sampler.start(PROFILING_SIGNAL_SECONDS, on_done=_write_profile))
+    print(f"Profiling: Enabled for {name}")
+    return sampler
@@ -0,0 +1,616 @@
+import contextlib
+import fcntl
+import heapq
+import os
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+from reading_store import DEFAULT_DEVICE_ID, format_timestamp
+
+# Reading store in shared memory, so that several worker processes serve one
+# history. It offers the subset of PartitionedStore that the Data Service uses.
+#
+# The block holds a ring of the newest `capacity` readings of all devices in
+# arrival order, plus one spare slot for the reading being written. Reading i
+# lives in slot i % (capacity + 1) and links to the previous and following
+# readings of the same device, so a device's history is walked in either
+# direction without looking at any other device's readings. Each reading also
+# has a jump pointer further back along its device's chain (Myers' skew-binary
+# jump pointers), so the newest reading at or before a timestamp is found in
+# O(log n) steps. Queries across devices merge the devices' chains lazily, as
+# PartitionedStore merges its partitions. A device table next to the ring
+# holds each device's id, oldest and newest reading and number of readings in
+# the ring.
+#
+# Appends are serialized by a lock shared by all processes (a flock on a lock
+# file), so there is a single writer at a time. The writer fills the slot,
+# links it, updates the device table and only then advances `head`, the
+# number of readings ever written. Readers take no lock: they read what they
+# need and then check `head` again. Reading i is intact as long as the writer
+# has not come back around to its slot, i.e. while i >= head - capacity; if
+# it has, the reader treats the reading as evicted. This relies on the stores
+# of the writer becoming visible in the order they were made, which x86
+# guarantees; weaker memory models (ARM) would need explicit barriers.
+#
+# Every process follows the ring on a background thread and passes new
+# readings to its listeners, whichever process wrote them, so rollups and
+# live streams in each worker see every reading (with up to `poll_interval`
+# seconds of delay).
+#
+# A second, small ring carries messages between the processes: post() writes
+# a message under the same lock and every process's follower passes it to its
+# message listeners, the poster's included. The Data Service uses it for
+# webhook subscriptions and published events.
+
+DEFAULT_CAPACITY = 1_000_000
+DEFAULT_MAX_DEVICES = 10_000
+DEVICE_ID_BYTES = 64
+_MAGIC = 0x52454144494E4753  # "READINGS"
+_FOLLOW_BATCH = 10_000
+MESSAGE_SLOTS = 256      # Messages kept for processes that start late
+MESSAGE_BYTES = 4096     # Longest message
+
+# Header fields (int64)
+(_H_MAGIC, _H_CAPACITY, _H_MAX_DEVICES, _H_HEAD, _H_DEVICES, _H_LATEST_DEVICE, _H_LATEST_NS,
+ _H_MESSAGES) = range(8)
+_HEADER_FIELDS = 8
+
+
+def _layout(capacity, max_devices):
+    # (name, dtype, length) of each array, in block order
+    slots = capacity + 1
+    return [
+        ("header", np.int64, _HEADER_FIELDS),
+        ("times", np.int64, slots),
+        ("values", np.float64, slots),
+        ("previous", np.int64, slots),           # Index of the device's previous reading, or -1
+        ("following", np.int64, slots),          # Index of the device's next reading, or -1
+        ("jumps", np.int64, slots),              # Index of an earlier reading of the device, or -1
+        ("devices", np.int32, slots),            # Device slot of each reading
+        ("device_oldest", np.int64, max_devices),  # Index of each device's oldest reading in the ring, or -1
+        ("device_latest", np.int64, max_devices),  # Index of each device's newest reading, or -1
+        ("device_sequence", np.int64, max_devices),  # Readings each device has ever written
+        ("device_latest_ns", np.int64, max_devices),
+        ("device_latest_value", np.float64, max_devices),
+        ("device_count", np.int64, max_devices),   # Readings of each device in the ring
+        ("device_ids", f"S{DEVICE_ID_BYTES}", max_devices),
+        ("messages", f"S{MESSAGE_BYTES}", MESSAGE_SLOTS),  # Message n in slot n % MESSAGE_SLOTS
+    ]
+
+
+def _jump_length(depth):
+    # How far back reading number `depth` of a device jumps: the smallest term
+    # of the greedy decomposition of `depth` into numbers 2**k - 1
+    while True:
+        term = (1 << depth.bit_length()) - 1
+        if term > depth:
+            term >>= 1
+        if term == depth:
+            return term
+        depth -= term
+
+
+def _size(capacity, max_devices):
+    return sum(np.dtype(dtype).itemsize * length for _, dtype, length in _layout(capacity, max_devices))
+
+
+class SharedStore:
+    """
+    A ring of the newest `capacity` readings across at most `max_devices`
+    devices, in a new shared memory block. Other processes open it with
+    SharedStore.attach(store.name). With `follow` set, a background thread
+    passes every new reading to the listeners of this process.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, max_devices=DEFAULT_MAX_DEVICES, follow=True,
+                 poll_interval=0.02, _shm=None):
+        if _shm is None:
+            _shm = shared_memory.SharedMemory(create=True, size=_size(capacity, max_devices))
+            self._owner = True
+        else:
+            self._owner = False
+        self._shm = _shm
+        self.name = _shm.name
+        self.capacity = capacity
+        self._ring = capacity + 1
+        self.max_devices = max_devices
+        self.poll_interval = poll_interval
+        offset = 0
+        for field, dtype, length in _layout(capacity, max_devices):
+            array = np.ndarray((length,), dtype=dtype, buffer=_shm.buf, offset=offset)
+            setattr(self, "_" + field, array)
+            offset += array.nbytes
+        if self._owner:
+            self._device_oldest[:] = -1
+            self._device_latest[:] = -1
+            header = self._header
+            header[_H_CAPACITY] = capacity
+            header[_H_MAX_DEVICES] = max_devices
+            header[_H_LATEST_DEVICE] = -1
+            header[_H_MAGIC] = _MAGIC
+
+        self._lock_path = os.path.join(tempfile.gettempdir(), self.name.lstrip("/") + ".lock")
+        self._lock_file = open(self._lock_path, "a")
+        self._thread_lock = threading.Lock()  # flock does not exclude threads sharing the file
+        self._ids = []        # Device ids by slot, as far as this process has read the table
+        self._slots = {}      # device_id -> slot
+        self._ids_lock = threading.Lock()
+        self._listeners = []
+        self._follow_lock = threading.Lock()
+        self._position = int(self._header[_H_HEAD])  # Next reading to pass to the listeners
+        self._message_listeners = []
+        self._message_position = int(self._header[_H_MESSAGES])  # Next message to pass on
+        self.missed = 0  # Readings evicted before the follower got to them
+        self.missed_messages = 0  # Likewise for messages
+        if follow:
+            threading.Thread(target=self._follow, daemon=True, name="shared-store-follower").start()
+
+    @classmethod
+    def attach(cls, name, follow=True, poll_interval=0.02):
+        """Opens the store another process created under `name`."""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)  # Python 3.13+
+        except TypeError:
+            shm = shared_memory.SharedMemory(name=name)
+            # Otherwise this process's resource tracker would remove the block when it exits
+            resource_tracker.unregister(shm._name, "shared_memory")
+        header = np.ndarray((_HEADER_FIELDS,), dtype=np.int64, buffer=shm.buf)
+        if header[_H_MAGIC] != _MAGIC:
+            raise ValueError(f"{name} is not a shared reading store")
+        capacity, max_devices = int(header[_H_CAPACITY]), int(header[_H_MAX_DEVICES])
+        del header
+        return cls(capacity, max_devices, follow=follow, poll_interval=poll_interval, _shm=shm)
+
+    def unlink(self):
+        """Removes the shared memory block and lock file; called by the process that created them."""
+        self._shm.unlink()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._lock_path)
+
+    def __len__(self):
+        return min(int(self._header[_H_HEAD]), self.capacity)
+
+    @property
+    def nbytes(self):
+        """Size of the shared memory block."""
+        return self._shm.size
+
+    def sync(self):
+        pass  # Nothing is persisted
+
+    @contextlib.contextmanager
+    def _writing(self):
+        with self._thread_lock:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+
+    def _oldest(self):
+        # Index of the oldest reading a reader may still use; the one before
+        # it shares its slot with the reading being written
+        return int(self._header[_H_HEAD]) - self.capacity
+
+    # Device table
+
+    def _refresh_ids(self):
+        # Reads the device ids registered since the last call
+        with self._ids_lock:
+            count = int(self._header[_H_DEVICES])
+            for slot in range(len(self._ids), count):
+                device_id = self._device_ids[slot].decode()
+                self._ids.append(device_id)
+                self._slots[device_id] = slot
+
+    def _slot(self, device_id, create=False):
+        slot = self._slots.get(device_id)
+        if slot is None:
+            self._refresh_ids()
+            slot = self._slots.get(device_id)
+        if slot is None and create:
+            encoded = device_id.encode()
+            if len(encoded) > DEVICE_ID_BYTES:
+                raise ValueError(f"Device ids are limited to {DEVICE_ID_BYTES} bytes")
+            with self._writing():
+                self._refresh_ids()
+                slot = self._slots.get(device_id)
+                if slot is None:
+                    slot = int(self._header[_H_DEVICES])
+                    if slot >= self.max_devices:
+                        raise ValueError("Too many devices")
+                    self._device_ids[slot] = encoded
+                    self._device_oldest[slot] = -1
+                    self._device_latest[slot] = -1
+                    self._device_sequence[slot] = 0
+                    self._device_count[slot] = 0
+                    self._header[_H_DEVICES] = slot + 1  # Publishes the device
+                    self._refresh_ids()
+        return slot
+
+    def devices(self):
+        """Returns the registered device ids, sorted."""
+        self._refresh_ids()
+        return sorted(self._ids)
+
+    def partition(self, device_id, create=False):
+        """
+        Returns a view of one device's readings, registering the device if
+        `create` is set. Returns None for unknown devices; raises ValueError
+        when registering one would exceed `max_devices`.
+        """
+        slot = self._slot(device_id, create)
+        return _Partition(self, device_id, slot) if slot is not None else None
+
+    # Writes
+
+    def _append(self, temperature, timestamp_ns, slot):
+        # Must be called with the write lock held. Returns the reading's
+        # timestamp, or None for out-of-order readings (see ReadingStore.append()).
+        last = int(self._device_latest_ns[slot]) if self._device_latest[slot] >= 0 else None
+        if timestamp_ns is None:
+            timestamp_ns = time.time_ns() // 1000 * 1000
+            if last is not None and timestamp_ns <= last:
+                timestamp_ns = last + 1000
+        elif last is not None and timestamp_ns <= last:
+            return None
+        temperature = float(temperature)
+        header = self._header
+        index = int(header[_H_HEAD])
+        ring = self._ring
+        position = index % ring
+        alive = max(0, index - self.capacity + 1)  # Oldest reading left once this one is published
+        if index >= self.capacity:
+            # Writing this reading makes reading `index - capacity` unreadable
+            evicted = (index - self.capacity) % ring
+            owner = self._devices[evicted]
+            self._device_count[owner] -= 1
+            self._device_oldest[owner] = self._following[evicted]
+        parent = int(self._device_latest[slot])
+        jump = -1
+        if parent >= alive:
+            # Reading number n jumps to its parent or to the target of its parent's
+            # jump's jump; a target that has been evicted is left out (-1)
+            jump = parent
+            if _jump_length(int(self._device_sequence[slot])) > 1:
+                through = int(self._jumps[parent % ring])
+                jump = int(self._jumps[through % ring]) if through >= alive else -1
+        else:
+            parent = -1
+        self._times[position] = timestamp_ns
+        self._values[position] = temperature
+        self._previous[position] = parent
+        self._following[position] = -1
+        self._jumps[position] = jump
+        self._devices[position] = slot
+        if parent >= 0:
+            self._following[parent % ring] = index
+        if self._device_oldest[slot] < 0:
+            self._device_oldest[slot] = index
+        self._device_sequence[slot] += 1
+        self._device_latest[slot] = index
+        self._device_latest_ns[slot] = timestamp_ns
+        self._device_latest_value[slot] = temperature
+        self._device_count[slot] += 1
+        if header[_H_LATEST_DEVICE] < 0 or timestamp_ns >= header[_H_LATEST_NS]:
+            header[_H_LATEST_NS] = timestamp_ns
+            header[_H_LATEST_DEVICE] = slot
+        header[_H_HEAD] = index + 1  # Publishes the reading
+        return timestamp_ns
+
+    def append(self, temperature, timestamp_ns=None, device_id=None):
+        """Adds a reading to its device. See ReadingStore.append()."""
+        return self.partition(device_id or DEFAULT_DEVICE_ID, create=True).append(temperature, timestamp_ns)
+
+    def extend(self, readings):
+        """
+        Adds `(temperature, timestamp_ns, device_id)` tuples under one
+        acquisition of the write lock. Returns the stored timestamps in input
+        order, with None for readings that were out of order for their device.
+        Raises ValueError if a new device cannot be registered.
+        """
+        slots = [self._slot(device_id or DEFAULT_DEVICE_ID, create=True) for _, _, device_id in readings]
+        with self._writing():
+            return [self._append(temperature, timestamp_ns, slot)
+                    for (temperature, timestamp_ns, _), slot in zip(readings, slots)]
+
+    def post(self, message):
+        """
+        Passes `message` (bytes) to the message listeners of every process
+        following the store, this one included. Raises ValueError if it is
+        longer than MESSAGE_BYTES.
+        """
+        if len(message) > MESSAGE_BYTES:
+            raise ValueError(f"Messages are limited to {MESSAGE_BYTES} bytes")
+        with self._writing():
+            count = int(self._header[_H_MESSAGES])
+            self._messages[count % MESSAGE_SLOTS] = message
+            self._header[_H_MESSAGES] = count + 1  # Publishes the message
+
+    # Reads
+
+    def _record(self, timestamp_ns, temperature, slot):
+        return {
+            "device_id": self._ids[slot],
+            "temperature": temperature,
+            "timestamp": format_timestamp(timestamp_ns)
+        }
+
+    def latest(self, device_id=None):
+        """
+        Returns the newest reading of one device, or of all devices if none is
+        given, or None if there is no such reading. O(1) either way.
+        """
+        if device_id is None:
+            slot = int(self._header[_H_LATEST_DEVICE])
+            if slot < 0:
+                return None
+            self._refresh_ids()
+        else:
+            slot = self._slot(device_id)
+            if slot is None:
+                return None
+        for _ in range(3):
+            index = int(self._device_latest[slot])
+            if index < 0:
+                return None
+            position = index % self._ring
+            timestamp_ns, temperature = int(self._times[position]), float(self._values[position])
+            if index >= self._oldest() and self._devices[position] == slot:
+                return self._record(timestamp_ns, temperature, slot)
+            if int(self._device_latest[slot]) == index:
+                # Evicted from the ring by other devices' readings; the table still has it
+                return self._record(int(self._device_latest_ns[slot]), float(self._device_latest_value[slot]), slot)
+        return None
+
+    def _chain(self, slot, index):
+        # Yields (index, timestamp_ns, temperature) of a device's readings from
+        # `index` back to the oldest one still in the ring
+        ring = self._ring
+        times, values, previous, devices = self._times, self._values, self._previous, self._devices
+        while index >= 0:
+            position = index % ring
+            timestamp_ns, temperature = int(times[position]), float(values[position])
+            before, owner = int(previous[position]), int(devices[position])
+            if index < self._oldest() or owner != slot:
+                return  # Overwritten: everything older is gone too
+            yield index, timestamp_ns, temperature
+            index = before
+
+    def _forward(self, slot, index):
+        # Yields (index, timestamp_ns, temperature) of a device's readings from
+        # `index` on to the newest one; readings evicted meanwhile are skipped
+        ring = self._ring
+        times, values, following, devices = self._times, self._values, self._following, self._devices
+        last = -1
+        while 0 <= index < int(self._header[_H_HEAD]):
+            position = index % ring
+            timestamp_ns, temperature = int(times[position]), float(values[position])
+            after, owner = int(following[position]), int(devices[position])
+            if index < self._oldest() or owner != slot:
+                # Overtaken by the writer: carry on from the oldest reading left
+                index = int(self._device_oldest[slot])
+                if index <= last:
+                    return
+                continue
+            yield index, timestamp_ns, temperature
+            last, index = index, after
+
+    def _link(self, links, slot, index):
+        # links[index] (previous or following) if reading `index` of the device is still in the ring, else None
+        position = index % self._ring
+        link, owner = int(links[position]), int(self._devices[position])
+        if index < self._oldest() or owner != slot:
+            return None
+        return link
+
+    def _seek(self, slot, index, until_ns):
+        # Index of the device's newest reading at or before reading `index`
+        # with a timestamp <= until_ns, or -1. Takes O(log n) steps: a jump is
+        # followed whenever its target is still too new.
+        ring = self._ring
+        times, previous, jumps, devices = self._times, self._previous, self._jumps, self._devices
+        while index >= 0:
+            position = index % ring
+            timestamp_ns, before, jump, owner = (int(times[position]), int(previous[position]),
+                                                 int(jumps[position]), int(devices[position]))
+            if index < self._oldest() or owner != slot:
+                return -1
+            if timestamp_ns <= until_ns:
+                return index
+            index = before
+            if jump >= 0:
+                target = jump % ring
+                jump_ns, jump_owner = int(times[target]), int(devices[target])
+                if jump >= self._oldest() and jump_owner == slot and jump_ns > until_ns:
+                    index = jump
+        return -1
+
+    def _device_rows(self, slot, since_ns, until_ns, newest_first, cursor=None):
+        # Rows of one device in (since_ns, until_ns] after the cursor's reading,
+        # reading only the rows returned plus O(log n) to find the first one
+        if newest_first:
+            if cursor is None:
+                index = int(self._device_latest[slot])
+            else:
+                index = self._link(self._previous, slot, cursor)
+                if index is None:
+                    return  # The cursor's reading was evicted, and everything older with it
+            if until_ns is not None:
+                index = self._seek(slot, index, until_ns)
+            for row in self._chain(slot, index):
+                if since_ns is not None and row[1] <= since_ns:
+                    return
+                yield row
+            return
+
+        index = self._link(self._following, slot, cursor) if cursor is not None else None
+        if index is None:
+            index = int(self._device_oldest[slot])  # From the start, or the cursor's reading was evicted
+        if since_ns is not None and index >= 0:
+            before = self._seek(slot, int(self._device_latest[slot]), since_ns)
+            after = self._link(self._following, slot, before) if before >= 0 else None
+            if after is None:
+                after = int(self._device_oldest[slot])
+            index = max(index, after) if after >= 0 else -1
+        for row in self._forward(slot, index):
+            if until_ns is not None and row[1] > until_ns:
+                return
+            yield row
+
+    def query(self, since_ns=None, until_ns=None, limit=None, newest_first=True, cursor=None, device_id=None):
+        """
+        Returns `(records, next_cursor)` like PartitionedStore.query(). With a
+        `device_id` the cursor is the ring index of the last reading
+        returned; otherwise it is its `(timestamp_ns, device_id)`.
+        """
+        if device_id is not None:
+            slot = self._slot(device_id)
+            if slot is None:
+                return [], None
+            records, last = [], None
+            for index, timestamp_ns, temperature in self._device_rows(slot, since_ns, until_ns, newest_first, cursor):
+                if limit is not None and len(records) == limit:
+                    return records, last
+                records.append(self._record(timestamp_ns, temperature, slot))
+                last = index
+            return records, None
+
+        records, last = [], None
+        for timestamp_ns, record in self.scan(since_ns, until_ns, newest_first, cursor):
+            if limit is not None and len(records) == limit:
+                return records, (last, records[-1]["device_id"])
+            records.append(record)
+            last = timestamp_ns
+        return records, None
+
+    def scan(self, since_ns=None, until_ns=None, newest_first=True, cursor=None, device_id=None):
+        """
+        Lazily yields `(timestamp_ns, record)` like PartitionedStore.scan(),
+        with the cursors of query().
+        """
+        if device_id is not None:
+            slot = self._slot(device_id)
+            return self._device_scan(slot, since_ns, until_ns, newest_first, cursor) if slot is not None else iter(())
+
+        self._refresh_ids()
+        streams = []
+        for slot, device_id in enumerate(list(self._ids)):
+            lo, hi = since_ns, until_ns
+            if cursor is not None:
+                # Skip everything up to and including the cursor's reading
+                cursor_ns, cursor_device = cursor
+                if newest_first:
+                    bound = cursor_ns if device_id < cursor_device else cursor_ns - 1
+                    hi = bound if hi is None else min(hi, bound)
+                else:
+                    bound = cursor_ns - 1 if device_id > cursor_device else cursor_ns
+                    lo = bound if lo is None else max(lo, bound)
+            streams.append(self._device_scan(slot, lo, hi, newest_first))
+        return heapq.merge(*streams, key=lambda entry: (entry[0], entry[1]["device_id"]), reverse=newest_first)
+
+    def _device_scan(self, slot, since_ns, until_ns, newest_first, cursor=None):
+        for _, timestamp_ns, temperature in self._device_rows(slot, since_ns, until_ns, newest_first, cursor):
+            yield timestamp_ns, self._record(timestamp_ns, temperature, slot)
+
+    # Listeners
+
+    def add_listener(self, listener, replay=False):
+        """
+        Registers `listener(timestamp_ns, temperature, device_id)`, called
+        from the follower thread for every new reading. With `replay` it is
+        first called for the readings already in the ring.
+        """
+        with self._follow_lock:
+            if replay:
+                head = self._position
+                self._dispatch(max(0, head - self.capacity), head, [listener])
+            self._listeners.append(listener)
+
+    def _dispatch(self, start, stop, listeners):
+        # Passes readings [start, stop) to `listeners`; returns how many were already overwritten
+        positions = np.arange(start, stop, dtype=np.int64) % self._ring
+        times, values, devices = self._times[positions], self._values[positions], self._devices[positions]
+        skipped = max(0, self._oldest() - start)
+        self._refresh_ids()
+        ids = self._ids
+        for timestamp_ns, temperature, slot in zip(times[skipped:].tolist(), values[skipped:].tolist(),
+                                                   devices[skipped:].tolist()):
+            device_id = ids[slot]
+            for listener in listeners:
+                try:
+                    listener(timestamp_ns, temperature, device_id)
+                except Exception as e:
+                    print(f"Shared store: Listener {listener!r} failed: {e!r}")
+        return skipped
+
+    def add_message_listener(self, listener, replay=False):
+        """
+        Registers `listener(message)`, called from the follower thread for
+        every posted message. With `replay` it is first called for the
+        messages still in the message ring, oldest first.
+        """
+        with self._follow_lock:
+            if replay:
+                self._dispatch_messages(max(0, self._message_position - MESSAGE_SLOTS + 1),
+                                        self._message_position, [listener])
+            self._message_listeners.append(listener)
+
+    def _dispatch_messages(self, start, stop, listeners):
+        # Passes messages [start, stop) to `listeners`, skipping any overwritten meanwhile
+        for number in range(start, stop):
+            message = bytes(self._messages[number % MESSAGE_SLOTS])
+            # The slot is rewritten by message number + MESSAGE_SLOTS, which may be in progress
+            if number < int(self._header[_H_MESSAGES]) - MESSAGE_SLOTS + 1:
+                continue
+            for listener in listeners:
+                try:
+                    listener(message)
+                except Exception as e:
+                    print(f"Shared store: Message listener {listener!r} failed: {e!r}")
+
+    def _follow(self):
+        while True:
+            messages = int(self._header[_H_MESSAGES])
+            if messages != self._message_position:
+                with self._follow_lock:
+                    start = max(self._message_position, messages - MESSAGE_SLOTS + 1)
+                    self.missed_messages += start - self._message_position
+                    self._dispatch_messages(start, messages, self._message_listeners)
+                    self._message_position = messages
+            head = int(self._header[_H_HEAD])
+            if head == self._position:
+                time.sleep(self.poll_interval)
+                continue
+            with self._follow_lock:
+                start = max(self._position, head - self.capacity)
+                stop = min(head, start + _FOLLOW_BATCH)
+                self.missed += start - self._position
+                self.missed += self._dispatch(start, stop, self._listeners)
+                self._position = stop
+
+
+class _Partition:
+    """One device's readings in a SharedStore, standing in for a ReadingStore partition."""
+
+    def __init__(self, store, device_id, slot):
+        self._store = store
+        self.device_id = device_id
+        self._slot = slot
+
+    def __len__(self):
+        return int(self._store._device_count[self._slot])
+
+    def append(self, temperature, timestamp_ns=None):
+        """See ReadingStore.append(). Raises ValueError for out-of-order readings."""
+        store = self._store
+        with store._writing():
+            timestamp_ns = store._append(temperature, timestamp_ns, self._slot)
+        if timestamp_ns is None:
+            raise ValueError("Readings must be appended in timestamp order")
+        return store._record(timestamp_ns, float(temperature), self._slot)
+
+    def latest(self):
+        return self._store.latest(self.device_id)
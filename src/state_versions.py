@@ -0,0 +1,76 @@
+import asyncio
+import threading
+from collections import OrderedDict
+
+# Versions for polled state, so clients can ask "has anything changed?".
+# A version is assigned per key (e.g. per device) whenever the state served
+# for that key differs from what was last served, drawn from one
+# monotonically increasing counter. Producers call changed() when inputs
+# move; long-polling readers wait for that instead of spinning.
+# At most `max_keys` keys are remembered, least recently used first out; a
+# forgotten key just gets a new version the next time it is served.
+
+
+class VersionTracker:
+    """
+    version(key, snapshot) returns the version of `snapshot`, a comparable
+    summary of the state served for `key`; a different snapshot gets a new,
+    higher version. wait()/wait_async() block until changed() is called or
+    the timeout passes.
+    """
+
+    def __init__(self, max_keys=10_000):
+        self.max_keys = max_keys
+        self._version = 0
+        self._snapshots = OrderedDict()  # key -> (snapshot, version), least recently used first
+        self._changes = 0
+        self._condition = threading.Condition()
+        self._loops = {}  # Event loop -> future resolved on the next change
+
+    def version(self, key, snapshot):
+        with self._condition:
+            entry = self._snapshots.get(key)
+            if entry is None or entry[0] != snapshot:
+                self._version += 1
+                entry = self._snapshots[key] = (snapshot, self._version)
+                if len(self._snapshots) > self.max_keys:
+                    self._snapshots.popitem(last=False)
+            self._snapshots.move_to_end(key)
+            return entry[1]
+
+    def changes(self):
+        """Returns a counter that moves on every changed(); pass it to wait()."""
+        return self._changes
+
+    def changed(self):
+        with self._condition:
+            self._changes += 1
+            self._condition.notify_all()
+            loops = list(self._loops)
+        for loop in loops:
+            loop.call_soon_threadsafe(self._wake, loop)
+
+    def _wake(self, loop):
+        with self._condition:
+            waiter = self._loops.get(loop)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def wait(self, changes, timeout):
+        """Waits up to `timeout` seconds for a change after `changes` (see changes())."""
+        with self._condition:
+            self._condition.wait_for(lambda: self._changes != changes, timeout)
+
+    async def wait_async(self, changes, timeout):
+        """Coroutine version of wait(); every waiter on a loop shares one future."""
+        loop = asyncio.get_running_loop()
+        with self._condition:
+            waiter = self._loops.get(loop)
+            if waiter is None or waiter.done():
+                waiter = self._loops[loop] = loop.create_future()
+            if self._changes != changes:
+                return
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -0,0 +1,293 @@
+// Control panel script, loaded by the page client_application.py serves.
+
+const CONTROL_API_URL = 'http://127.0.0.1:5002';
+const DATA_API_URL = 'http://127.0.0.1:5001';
+// Open the page with ?device_id=... to follow a single sensor
+const DEVICE_ID = new URLSearchParams(window.location.search).get('device_id');
+const DEVICE_QUERY = DEVICE_ID ? `device_id=${encodeURIComponent(DEVICE_ID)}` : '';
+const HISTORY_PAGE = 1000;      // Readings per request for the newest readings
+const BACKFILL_PAGE = 5000;     // Readings per request while loading older history
+const HISTORY_DAYS = 30;        // How far back the history panel goes
+const ROW_HEIGHT = 28;          // Pixels; every history row has the same height
+const OVERSCAN = 10;            // Rows rendered beyond each edge of the visible ones
+
+const currentTempEl = document.getElementById('current-temp');
+const targetTempEl = document.getElementById('target-temp');
+const statusDotEl = document.getElementById('status-dot');
+const statusTextEl = document.getElementById('status-text');
+const historyContainerEl = document.getElementById('history-container');
+const historyMessageEl = document.getElementById('history-message');
+const historyRowsEl = document.getElementById('history-rows');
+const errorMessageEl = document.getElementById('error-message');
+
+// Update the current temperature display
+function showCurrentTemperature(temperature) {
+    if (temperature !== null) {
+        currentTempEl.textContent = `${temperature.toFixed(1)} °C`;
+        statusDotEl.classList.remove('bg-gray-400', 'bg-red-500');
+        statusDotEl.classList.add('bg-green-500');
+        statusTextEl.textContent = 'Connected';
+    } else {
+        currentTempEl.textContent = '--.- °C';
+        statusDotEl.classList.remove('bg-green-500');
+        statusDotEl.classList.add('bg-red-500');
+        statusTextEl.textContent = 'No sensor data';
+    }
+}
+
+// Update the target temperature display
+function showTargetTemperature(temperature) {
+    if (temperature !== null) {
+        targetTempEl.textContent = `${temperature.toFixed(1)} °C`;
+    }
+}
+
+// Fetch the current state from the control service
+async function fetchCurrentState() {
+    try {
+        const response = await fetch(`${CONTROL_API_URL}/state?${DEVICE_QUERY}`);
+        if (!response.ok) throw new Error('Network response was not ok');
+        const data = await response.json();
+
+        showCurrentTemperature(data.current_temperature);
+        showTargetTemperature(data.target_temperature);
+
+        errorMessageEl.textContent = ''; // Clear previous errors
+    } catch (error) {
+        console.error('Failed to fetch state:', error);
+        statusDotEl.classList.remove('bg-green-500');
+        statusDotEl.classList.add('bg-red-500');
+        statusTextEl.textContent = 'Service Unreachable';
+        errorMessageEl.textContent = 'Error: Could not connect to services. Are they running?';
+    }
+}
+
+// Set a new target temperature
+async function setTemperature() {
+    const input = document.getElementById('new-temp-input');
+    const newTemp = parseFloat(input.value);
+
+    if (isNaN(newTemp)) {
+        alert('Please enter a valid number.');
+        return;
+    }
+
+    try {
+        const response = await fetch(`${CONTROL_API_URL}/setpoint`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ temperature: newTemp })
+        });
+        if (!response.ok) throw new Error('Failed to set temperature');
+
+        await response.json();
+        input.value = ''; // Clear input on success
+        fetchCurrentState(); // Refresh state immediately
+    } catch (error) {
+        console.error('Error setting temperature:', error);
+        alert('Failed to set new temperature.');
+    }
+}
+
+// The history is kept as plain numbers, so a month of readings stays small,
+// in two lists that only ever grow at their end: `older` is newest first and
+// filled by the backfill, `newer` is oldest first and filled by delta syncs.
+const olderTimes = [], olderTemps = [];
+const newerTimes = [], newerTemps = [];
+let newestTimestamp = null;  // Timestamp string of the newest reading held, the next sync's 'since'
+let historyLoaded = false;
+let syncing = false, syncAgain = false;
+let renderPending = false;
+const rowPool = [];  // Row elements, reused as the list scrolls
+
+function historyLength() {
+    return olderTimes.length + newerTimes.length;
+}
+
+// [time in ms, temperature] of the i-th reading, newest first
+function historyAt(i) {
+    if (i < newerTimes.length) {
+        const j = newerTimes.length - 1 - i;
+        return [newerTimes[j], newerTemps[j]];
+    }
+    i -= newerTimes.length;
+    return [olderTimes[i], olderTemps[i]];
+}
+
+// Only the rows in view (plus OVERSCAN) exist in the page; they are
+// positioned inside a container as tall as the whole list
+function renderHistory() {
+    renderPending = false;
+    const total = historyLength();
+    historyMessageEl.hidden = total > 0;
+    historyRowsEl.style.height = `${total * ROW_HEIGHT}px`;
+    const top = historyContainerEl.scrollTop;
+    const first = Math.max(0, Math.floor(top / ROW_HEIGHT) - OVERSCAN);
+    const last = Math.min(total, Math.ceil((top + historyContainerEl.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+    while (rowPool.length < last - first) {
+        const row = document.createElement('div');
+        row.className = 'absolute inset-x-0 flex justify-between text-sm p-1 rounded';
+        row.style.height = `${ROW_HEIGHT}px`;
+        row.append(document.createElement('span'), document.createElement('span'));
+        row.lastChild.className = 'text-gray-500';
+        historyRowsEl.appendChild(row);
+        rowPool.push(row);
+    }
+    rowPool.forEach((row, k) => {
+        const i = first + k;
+        // The 'hidden' attribute would lose to the flex class, so set display directly
+        row.style.display = i < last ? '' : 'none';
+        if (i >= last) return;
+        const [time, temperature] = historyAt(i);
+        row.style.top = `${i * ROW_HEIGHT}px`;
+        row.firstChild.textContent = `${temperature.toFixed(1)} °C`;
+        row.lastChild.textContent = new Date(time).toLocaleString();
+    });
+}
+
+function scheduleRender() {
+    if (!renderPending) {
+        renderPending = true;
+        requestAnimationFrame(renderHistory);
+    }
+}
+
+// Older readings, newest first, go to the bottom of the list
+function appendOlder(records) {
+    for (const record of records) {
+        olderTimes.push(Date.parse(record.timestamp));
+        olderTemps.push(record.temperature);
+    }
+    scheduleRender();
+}
+
+// Newer readings, oldest first, go to the top; a scrolled list keeps its place
+function appendNewer(records) {
+    if (records.length === 0) return;
+    for (const record of records) {
+        newerTimes.push(Date.parse(record.timestamp));
+        newerTemps.push(record.temperature);
+    }
+    newestTimestamp = records[records.length - 1].timestamp;
+    if (historyContainerEl.scrollTop > 0) {
+        historyRowsEl.style.height = `${historyLength() * ROW_HEIGHT}px`;
+        historyContainerEl.scrollTop += records.length * ROW_HEIGHT;
+    }
+    scheduleRender();
+}
+
+// Range and limit queries go through the client application's /api/history
+async function fetchHistoryPage(params) {
+    const query = new URLSearchParams(params);
+    if (DEVICE_ID) query.set('device_id', DEVICE_ID);
+    const response = await fetch(`/api/history?${query}`);
+    if (!response.ok) throw new Error('Network response was not ok');
+    return { records: await response.json(), cursor: response.headers.get('X-Next-Cursor') };
+}
+
+// Load the newest readings, then page back through older ones in the background
+async function loadHistory() {
+    historyMessageEl.textContent = 'Loading history...';
+    const since = new Date(Date.now() - HISTORY_DAYS * 86400000).toISOString();
+    try {
+        const page = await fetchHistoryPage({ since, limit: HISTORY_PAGE });
+        if (page.records.length > 0) newestTimestamp = page.records[0].timestamp;
+        appendOlder(page.records);
+        historyMessageEl.textContent = 'No historical data found.';
+        historyLoaded = true;
+        syncHistory();  // Readings that arrived while the first page was loading
+        let cursor = page.cursor;
+        while (cursor) {
+            const older = await fetchHistoryPage({ since, limit: BACKFILL_PAGE, cursor });
+            appendOlder(older.records);
+            cursor = older.cursor;
+        }
+    } catch (error) {
+        console.error('Failed to fetch history:', error);
+        if (!historyLoaded) historyMessageEl.textContent = 'Could not load history.';
+    }
+}
+
+// API timestamps leave out the fraction on whole seconds; this form sorts as a string
+function timestampKey(timestamp) {
+    return timestamp.includes('.') ? timestamp : timestamp.replace('Z', '.000000Z');
+}
+
+// Fetch only the readings newer than the newest one held. Calls made
+// while a sync is running are folded into one more sync after it.
+// 'since' is one timestamp across all devices, so a reading that reaches the
+// data service after a newer one from another device (or with the same
+// timestamp) is not added to the list; a page reload shows it.
+async function syncHistory() {
+    if (!historyLoaded) return;
+    if (syncing) {
+        syncAgain = true;
+        return;
+    }
+    syncing = true;
+    try {
+        let page;
+        do {
+            const params = { order: 'asc', limit: HISTORY_PAGE };
+            if (newestTimestamp !== null) params.since = newestTimestamp;
+            page = await fetchHistoryPage(params);
+            appendNewer(page.records);
+        } while (page.records.length === HISTORY_PAGE);
+    } catch (error) {
+        console.error('Failed to sync history:', error);
+    } finally {
+        syncing = false;
+        if (syncAgain) {
+            syncAgain = false;
+            syncHistory();
+        }
+    }
+}
+
+// Follow new readings and setpoint changes pushed by the data service.
+// The browser reconnects on its own if the stream drops.
+function subscribeLive() {
+    if (!window.EventSource) {
+        // No SSE support: poll every 5 seconds
+        setInterval(() => {
+            fetchCurrentState();
+            syncHistory();
+        }, 5000);
+        return;
+    }
+    const source = new EventSource(`${DATA_API_URL}/stream?${DEVICE_QUERY}`);
+    // (Re)connected: catch up on readings missed while disconnected; after
+    // that the pushed readings are added as they arrive
+    source.onopen = syncHistory;
+    // 'latest' opens the stream with the newest reading, which the history already shows
+    source.addEventListener('latest', event => {
+        showCurrentTemperature(JSON.parse(event.data).temperature);
+    });
+    source.addEventListener('reading', event => {
+        const record = JSON.parse(event.data);
+        showCurrentTemperature(record.temperature);
+        if (syncing) {
+            syncAgain = true;  // The running sync may or may not include it
+        } else if (historyLoaded && (newestTimestamp === null ||
+                   timestampKey(record.timestamp) > timestampKey(newestTimestamp))) {
+            appendNewer([record]);
+        }
+        errorMessageEl.textContent = '';
+    });
+    source.addEventListener('setpoint', event => {
+        showTargetTemperature(JSON.parse(event.data).target_temperature);
+    });
+    source.onerror = () => {
+        statusDotEl.classList.remove('bg-green-500');
+        statusDotEl.classList.add('bg-red-500');
+        statusTextEl.textContent = 'Reconnecting...';
+    };
+}
+
+// On page load, fetch initial data and subscribe to live updates
+document.addEventListener('DOMContentLoaded', () => {
+    fetchCurrentState();
+    historyContainerEl.addEventListener('scroll', scheduleRender, { passive: true });
+    loadHistory();
+    subscribeLive();
+});
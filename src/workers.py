@@ -0,0 +1,65 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+# Runs a service as several worker processes sharing one listening socket.
+# The supervisor binds the port and starts `count` copies of the service
+# script, passing them the socket's file descriptor and their index in the
+# environment; the kernel spreads incoming connections over the workers,
+# which all accept on the same socket. A worker that exits is restarted.
+
+# Index of this worker process, or None when not started by run_workers()
+WORKER_INDEX = int(os.environ["WORKER_INDEX"]) if "WORKER_INDEX" in os.environ else None
+_CHECK_INTERVAL = 1.0
+
+
+def run_workers(script, count, host, port, env=None, name="Workers"):
+    """
+    Binds `host`:`port` and runs `count` processes of `script` serving it,
+    with `env` added to their environment, until interrupted or terminated.
+    """
+    sock = socket.create_server((host, port), backlog=1024)
+    sock.set_inheritable(True)
+    environment = dict(os.environ, **(env or {}), WORKER_LISTEN_FD=str(sock.fileno()))
+
+    def start(index):
+        return subprocess.Popen([sys.executable, script], env=dict(environment, WORKER_INDEX=str(index)),
+                                pass_fds=(sock.fileno(),))
+
+    # Turn SIGTERM (e.g. from Kubernetes) into SystemExit so that the workers are stopped
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    workers = [start(index) for index in range(count)]
+    print(f"{name}: Started {count} workers on {host}:{port}")
+    try:
+        while True:
+            time.sleep(_CHECK_INTERVAL)
+            for index, worker in enumerate(workers):
+                code = worker.poll()
+                if code is not None:
+                    print(f"{name}: Worker {index} exited with status {code}, restarting it")
+                    workers[index] = start(index)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            try:
+                worker.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                worker.kill()
+        sock.close()
+
+
+def listen_fd():
+    """The file descriptor of the socket a worker inherited from run_workers()."""
+    return int(os.environ["WORKER_LISTEN_FD"])
+
+
+def serve_worker(app, host, port):
+    """Serves WSGI `app` on the inherited socket, with a thread per request like app.run()."""
+    from werkzeug.serving import make_server
+    make_server(host, port, app, threaded=True, fd=listen_fd()).serve_forever()
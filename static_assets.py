@@ -0,0 +1,77 @@
+import gzip
+import hashlib
+import mimetypes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # Only gzip variants are built; pip install brotli to add them
+
+# Static responses built once and served from memory.
+# Every asset is compressed ahead of time (gzip, and brotli when the module is
+# installed), so a request only picks the variant the client accepts and
+# nothing is compressed per request. Each variant has a strong ETag derived
+# from the content, so a revalidation that still matches is an empty 304.
+# Assets behind content-hashed URLs never change and are cached for a year as
+# immutable; the page naming them is revalidated on every load instead, so a
+# reload costs a single 304.
+
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+# Preferred first; identity is always available
+ENCODINGS = ("br", "gzip")
+_MIN_COMPRESS_BYTES = 256  # Smaller bodies are not worth a compressed variant
+
+
+class StaticAsset:
+    """
+    `body` (bytes) served as `mimetype` with the Cache-Control header
+    `cache_control`. `digest` is a hash of the body, for fingerprinted URLs.
+    """
+
+    def __init__(self, body, mimetype, cache_control=REVALIDATE):
+        self.mimetype = mimetype
+        self.cache_control = cache_control
+        self.digest = hashlib.sha256(body).hexdigest()[:16]
+        self.variants = {"identity": body}  # Content-Encoding -> body
+        if len(body) >= _MIN_COMPRESS_BYTES:
+            compressed = {"gzip": gzip.compress(body, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                compressed["br"] = brotli.compress(body, quality=11)
+            for encoding, variant in compressed.items():
+                if len(variant) < len(body):
+                    self.variants[encoding] = variant
+
+    @classmethod
+    def from_file(cls, path, cache_control=IMMUTABLE):
+        with open(path, "rb") as f:
+            body = f.read()
+        mimetype = mimetypes.guess_type(path)[0] or "application/octet-stream"
+        if mimetype.startswith("text/") or mimetype == "application/javascript":
+            mimetype += "; charset=utf-8"
+        return cls(body, mimetype, cache_control)
+
+    def etag(self, encoding):
+        """The (unquoted) strong ETag of one variant; each encoding is a different representation."""
+        return self.digest if encoding == "identity" else f"{self.digest}-{encoding}"
+
+
+def serve_asset(asset):
+    """
+    Returns the Flask response for `asset` to the current request: the
+    best-compressed variant the client accepts, or 304 if its ETag matches.
+    """
+    from flask import Response, request
+
+    encoding = next((e for e in ENCODINGS if e in asset.variants and request.accept_encodings.quality(e) > 0),
+                    "identity")
+    headers = {"Cache-Control": asset.cache_control, "Vary": "Accept-Encoding"}
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    etag = asset.etag(encoding)
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304, headers=headers)
+    else:
+        response = Response(asset.variants[encoding], mimetype=asset.mimetype, headers=headers)
+    response.set_etag(etag)
+    return response